@@ -0,0 +1,86 @@
+"""
+Admission control for /chat.
+
+A ConcurrencyLimiter caps how many requests hold a resource at once. Callers
+beyond the cap wait in a bounded queue up to a deadline; when the queue is
+full or the deadline passes they are rejected so the server can answer with
+a fast 503 instead of piling work onto the event loop.
+"""
+import asyncio
+from typing import Dict
+
+class Rejected(Exception):
+    """Raised when a limiter refuses admission"""
+
+    def __init__(self, limiter: str, reason: str):
+        super().__init__(f"{limiter}: {reason}")
+        self.limiter = limiter
+        self.reason = reason
+
+class Permit:
+    """A held slot; release() is idempotent so every exit path can call it"""
+
+    def __init__(self, limiter: "ConcurrencyLimiter"):
+        self._limiter = limiter
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._limiter._release()
+
+class ConcurrencyLimiter:
+    """Semaphore with a bounded wait queue, a queueing deadline and counters"""
+
+    def __init__(self, name: str, limit: int, max_queue: int = 0, queue_timeout: float = 0.0):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._sem = asyncio.Semaphore(limit) if limit > 0 else None
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    async def acquire(self) -> Permit:
+        """Take a slot, waiting in the queue if allowed; raises Rejected otherwise"""
+        if self._sem is not None:
+            if self._sem.locked() or self.waiting > 0:
+                if self.waiting >= self.max_queue:
+                    self.rejected_queue_full += 1
+                    raise Rejected(self.name, "queue_full")
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(self._sem.acquire(), timeout=self.queue_timeout)
+                except asyncio.TimeoutError:
+                    self.rejected_timeout += 1
+                    raise Rejected(self.name, "queue_timeout")
+                finally:
+                    self.waiting -= 1
+            else:
+                await self._sem.acquire()
+        self.active += 1
+        self.admitted += 1
+        return Permit(self)
+
+    def _release(self):
+        self.active -= 1
+        if self._sem is not None:
+            self._sem.release()
+
+    def stats(self) -> Dict:
+        rejected = self.rejected_queue_full + self.rejected_timeout
+        attempts = self.admitted + rejected
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": rejected,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "rejection_rate": round(rejected / attempts, 4) if attempts else 0.0
+        }
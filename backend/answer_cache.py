@@ -0,0 +1,98 @@
+"""
+Semantic answer cache for /chat.
+
+Recent query embeddings are rows of one small matrix, so a lookup is a
+single matvec. If the most similar cached query in the same scope (the
+collection) reaches the cosine threshold, its bullets and sources are reused
+and search and composition are skipped. Entries are evicted least recently
+used once the matrix is full. clear() drops everything, for /reindex, and
+bumps `generation`. An answer computed from the old index that finishes
+after the clear is then refused by put().
+
+The cache only ever sees queries that passed the medical gate. /chat answers
+medical queries before retrieval, so they are neither looked up nor stored.
+"""
+import threading
+from typing import Dict, Optional, Tuple
+import numpy as np
+from memory import deep_sizeof
+
+class SemanticCache:
+    """Fixed-capacity nearest-neighbour cache of answer payloads"""
+
+    def __init__(self, capacity: int, threshold: float):
+        self.capacity = capacity
+        self.threshold = threshold
+        self._embs: Optional[np.ndarray] = None  # allocated on first put, once the width is known
+        self._payloads = [None] * capacity
+        self._scopes = np.full(capacity, -1, dtype=np.int32)  # -1 = empty slot
+        self._used = np.zeros(capacity, dtype=np.int64)
+        self._scope_ids: Dict[str, int] = {}
+        self._tick = 0
+        self.generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query_vec: np.ndarray, scope: str = "") -> Optional[Tuple[Dict, float]]:
+        """(payload, similarity) of the nearest cached query in `scope` at or above the threshold"""
+        with self._lock:
+            scope_id = self._scope_ids.get(scope)
+            if self._embs is None or scope_id is None:
+                self.misses += 1
+                return None
+            sims = self._embs @ query_vec.astype(np.float32)
+            sims[self._scopes != scope_id] = -np.inf
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                self.misses += 1
+                return None
+            self._tick += 1
+            self._used[best] = self._tick
+            self.hits += 1
+            return self._payloads[best], float(sims[best])
+
+    def put(self, query_vec: np.ndarray, payload: Dict, scope: str = "", generation: Optional[int] = None):
+        """Store `payload` under a normalized query embedding, replacing the least recently used entry.
+
+        Pass the `generation` read before retrieval started; the put is dropped if clear() ran since.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if self._embs is None:
+                self._embs = np.zeros((self.capacity, len(query_vec)), dtype=np.float32)
+            empty = np.flatnonzero(self._scopes < 0)
+            slot = int(empty[0]) if len(empty) else int(np.argmin(self._used))
+            self._embs[slot] = query_vec
+            self._payloads[slot] = payload
+            self._scopes[slot] = self._scope_ids.setdefault(scope, len(self._scope_ids))
+            self._tick += 1
+            self._used[slot] = self._tick
+
+    def clear(self):
+        with self._lock:
+            self._embs = None
+            self._payloads = [None] * self.capacity
+            self._scopes[:] = -1
+            self._used[:] = 0
+            self._scope_ids.clear()
+            self.generation += 1
+
+    def nbytes(self) -> int:
+        """Bytes of the embedding matrix, slot bookkeeping and cached payloads"""
+        with self._lock:
+            embs = self._embs.nbytes if self._embs is not None else 0
+            return embs + self._scopes.nbytes + self._used.nbytes + deep_sizeof(self._payloads)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": int((self._scopes >= 0).sum()),
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
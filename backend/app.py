@@ -1,9 +1,19 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
-import asyncio, json, re, uuid, time
+import asyncio, contextlib, hmac, json, os, re, uuid, time, threading
 from pathlib import Path
+import topology
+# Pin BLAS threads before NumPy loads its pool (rag_index imports NumPy)
+thread_topology = topology.configure_from_env()
 from rag_index import LocalRAG
+from admission import ConcurrencyLimiter, Rejected
+from tracing import Tracer, NULL_TRACE
+from behavior_rules import RULES
+from index_manager import IndexManager, UnknownCollection
+from answer_cache import SemanticCache
+import memory
 from typing import List, Dict
 from collections import deque
 import statistics
@@ -30,7 +40,50 @@ def deidentify(text:str)->str:
 
 # Use container data path or fall back to repo path for local dev
 DATA_DIR = Path("/app/data/snippets") if Path("/app/data/snippets").exists() else Path(__file__).resolve().parents[1] / "data" / "snippets"
-rag = LocalRAG(data_dir=DATA_DIR)
+# Writable directory for index snapshots; workers then mmap chunk text and embeddings instead of each holding a copy
+INDEX_DIR = os.getenv("INDEX_DIR") or None
+# Optional reduced-dimension first pass (0 = exact scan only) and how many candidates get rescored in full dimension
+REDUCED_DIM = int(os.getenv("REDUCED_DIM", "0"))
+REDUCTION = os.getenv("REDUCTION", "pca")
+RESCORE_CANDIDATES = int(os.getenv("RESCORE_CANDIDATES", "100"))
+# Score search_enhanced across this many shard processes (0/1 = in-process); count them against the cores.
+# Concurrent requests share the shards. Hits equal in-process search only with REDUCED_DIM off: with it on,
+# each shard rescores its own RESCORE_CANDIDATES rows
+SEARCH_SHARDS = int(os.getenv("SEARCH_SHARDS", "0"))
+# Collapse chunks whose word-shingle Jaccard reaches this before embedding (0 = keep every chunk)
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+# Chunking and score boosts; compare settings with `python benchmark.py eval` before changing them
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "600"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "80"))
+KEYWORD_BOOST = float(os.getenv("KEYWORD_BOOST", "0.1"))
+FIELD_BOOST = float(os.getenv("FIELD_BOOST", "0.15"))
+
+# Extra corpora served by name: one subdirectory of .md files per collection, loaded on first use
+COLLECTIONS_DIR = Path(os.getenv("COLLECTIONS_DIR") or DATA_DIR.parent / "collections")
+# Loaded collections beyond this many MB are evicted least recently used first (the default index is never evicted)
+COLLECTION_MEMORY_MB = int(os.getenv("COLLECTION_MEMORY_MB", "256"))
+
+def build_index() -> LocalRAG:
+    index = LocalRAG(data_dir=DATA_DIR, threads=thread_topology.embed_threads, index_dir=INDEX_DIR,
+                     reduced_dim=REDUCED_DIM or None, reduction=REDUCTION, rescore_candidates=RESCORE_CANDIDATES,
+                     dedup_threshold=DEDUP_THRESHOLD or None, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                     keyword_boost=KEYWORD_BOOST, field_boost=FIELD_BOOST)
+    print("INDEX_DEDUP", json.dumps(index.dedup_stats))
+    if SEARCH_SHARDS > 1 and len(index.store):
+        index.start_shards(SEARCH_SHARDS)
+    return index
+
+def build_collection(name: str, data_dir: Path) -> LocalRAG:
+    """Index one named collection, reusing the default index's embedding model"""
+    index_dir = Path(INDEX_DIR) / "collections" / name if INDEX_DIR else None
+    return LocalRAG(data_dir=data_dir, index_dir=index_dir, model=rag.model,
+                    reduced_dim=REDUCED_DIM or None, reduction=REDUCTION, rescore_candidates=RESCORE_CANDIDATES,
+                    dedup_threshold=DEDUP_THRESHOLD or None, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                    keyword_boost=KEYWORD_BOOST, field_boost=FIELD_BOOST)
+
+rag = build_index()
+collections = IndexManager(COLLECTIONS_DIR, build_collection, COLLECTION_MEMORY_MB * 1024 * 1024)
+print("THREAD_TOPOLOGY", json.dumps(topology.effective_report(thread_topology)))
 
 # Latency tracking - keep last 100 requests
 latency_metrics = {
@@ -38,18 +91,53 @@ latency_metrics = {
     "total_stream_times": deque(maxlen=100)
 }
 
-# Intent Hint Router - keyword to document mapping
-INTENT_MAP = {
-    "sleep": ["sleep-hygiene.md"],
-    "exercise": ["exercise-aerobic.md"], 
-    "diet": ["mind-diet.md"],
-    "nutrition": ["mind-diet.md"],
-    "stress": ["stress-management.md"],
-    "anxiety": ["stress-management.md"],
-    "workout": ["exercise-aerobic.md"],
-    "fitness": ["exercise-aerobic.md"]
+# Streams the client walked away from, and the paced streaming time we skipped
+stream_metrics = {
+    "abandoned_streams": 0,
+    "abandoned_saved_ms": 0.0
 }
 
+TOKEN_DELAY = 0.01  # seconds between streamed characters
+HEARTBEAT_INTERVAL = 15  # seconds between SSE heartbeat comments
+DISCONNECT_POLL_INTERVAL = 0.5  # seconds between client disconnect checks
+_STREAM_END = object()
+
+# Admission control - cap concurrent retrieval and open streams, shed the excess with a fast 503
+RETRIEVAL_CONCURRENCY = int(os.getenv("RETRIEVAL_CONCURRENCY", "8"))
+RETRIEVAL_QUEUE_LIMIT = int(os.getenv("RETRIEVAL_QUEUE_LIMIT", "64"))
+RETRIEVAL_QUEUE_TIMEOUT = float(os.getenv("RETRIEVAL_QUEUE_TIMEOUT", "2.0"))  # seconds
+MAX_OPEN_STREAMS = int(os.getenv("MAX_OPEN_STREAMS", "1000"))  # 0 disables the cap
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "1"))
+WS_MAX_IN_FLIGHT = int(os.getenv("WS_MAX_IN_FLIGHT", "4"))  # questions one /ws/chat connection may stream at once; 0 = no cap
+
+retrieval_limiter = ConcurrencyLimiter("retrieval", RETRIEVAL_CONCURRENCY,
+                                       max_queue=RETRIEVAL_QUEUE_LIMIT, queue_timeout=RETRIEVAL_QUEUE_TIMEOUT)
+stream_limiter = ConcurrencyLimiter("streams", MAX_OPEN_STREAMS)
+
+# Intent routing - the query embedding is matched against per-source centroids built by LocalRAG
+INTENT_MIN_SCORE = float(os.getenv("INTENT_MIN_SCORE", "0.35"))  # centroid similarity needed to force a source
+ROUTE_TOP_SOURCES = int(os.getenv("ROUTE_TOP_SOURCES", "0"))  # >0 scores only chunks from the top-N sources
+SOURCE_MIN_SCORE = float(os.getenv("SOURCE_MIN_SCORE", "0.55"))  # a source is shown only if its best chunk scores this
+
+# Opt-in request tracing - spans for a request sent with the trace header, or a sampled share of requests
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "false").lower() == "true"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_HEADER = os.getenv("TRACE_HEADER", "X-Trace")
+TRACE_PROFILE_DIR = os.getenv("TRACE_PROFILE_DIR") or None  # also dump a cProfile of each traced pipeline here
+
+tracer = Tracer(enabled=TRACE_ENABLED, sample_rate=TRACE_SAMPLE_RATE, header=TRACE_HEADER,
+                profile_dir=TRACE_PROFILE_DIR)
+
+# Semantic answer cache - paraphrases whose embedding is this close to a recent query reuse its bullets and sources
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "0"))  # entries kept; 0 disables the cache
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))  # cosine similarity needed to reuse
+answer_cache = SemanticCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_THRESHOLD) if ANSWER_CACHE_SIZE > 0 else None
+
+# Memory accounting - /debug/memory is off unless enabled, and then also needs X-Debug-Token when DEBUG_TOKEN is set
+DEBUG_MEMORY = os.getenv("DEBUG_MEMORY", "false").lower() == "true"
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN") or None
+allocations = memory.AllocationTracker()
+
 def extract_keywords(query: str) -> List[str]:
     """Extract meaningful keywords from query"""
     query = query.lower()
@@ -111,53 +199,7 @@ def get_medical_redirect_response():
 
 def compose_bullet(text: str, query_keywords: List[str]) -> str:
     """Transform raw snippet into behavior change format: Do X, How Often, Starting When"""
-    
-    # Split into sentences and find best content
-    sentences = text.split(".")
-    content_sentences = []
-    
-    for sentence in sentences:
-        sentence = sentence.strip()
-        
-        # Skip metadata lines
-        if (sentence.startswith("Title:") or 
-            sentence.startswith("source:") or 
-            len(sentence) < 20):
-            continue
-            
-        # Remove field labels
-        clean_sentence = re.sub(r'^[^:]+:\s*', '', sentence)
-        if clean_sentence and len(clean_sentence) > 15:
-            content_sentences.append(clean_sentence)
-    
-    if not content_sentences:
-        return "Focus on this wellness practice regularly, starting this week."
-    
-    # Find the most relevant sentence
-    best_sentence = content_sentences[0]
-    best_score = 0
-    
-    for sentence in content_sentences:
-        score = 0
-        # Boost if contains query keywords
-        for keyword in query_keywords:
-            if keyword in sentence.lower():
-                score += 3
-        # Boost if has specific numbers or frequencies
-        if re.search(r'\d+', sentence):
-            score += 2
-        # Boost if mentions time/frequency
-        if any(word in sentence.lower() for word in ['daily', 'weekly', 'times', 'minutes', 'hours', 'days']):
-            score += 2
-            
-        if score > best_score:
-            best_score = score
-            best_sentence = sentence
-    
-    # Transform into behavior change format
-    bullet = transform_to_behavior_change(best_sentence)
-    
-    return bullet[:200] + "…" if len(bullet) > 200 else bullet
+    return RULES.compose(text, query_keywords)
 
 def calculate_percentiles(values: List[float], p50: bool = True, p95: bool = True) -> Dict[str, float]:
     """Calculate p50 and p95 percentiles from a list of values"""
@@ -174,75 +216,7 @@ def calculate_percentiles(values: List[float], p50: bool = True, p95: bool = Tru
 
 def transform_to_behavior_change(sentence: str) -> str:
     """Transform sentence into 'Do X, How Often, Starting When' format"""
-    
-    # Extract frequency information if present
-    frequency_patterns = {
-        r'(\d+)\s*times?\s*(per\s+|a\s+)?(day|week|month)': r'\1 times \3ly',
-        r'(\d+)\s*minutes?\s*(per\s+|a\s+)?(day|daily)': r'\1 minutes daily',
-        r'(\d+)\s*hours?\s*(per\s+|a\s+)?(day|week)': r'\1 hours per \3',
-        r'daily|every\s+day': 'daily',
-        r'weekly|every\s+week|once\s+a\s+week': 'weekly',
-        r'(\d+[-–]\d+)\s*(times|hours|minutes)': r'\1 \2',
-        r'(\d+)\s*servings?': r'\1 servings',
-    }
-    
-    frequency = "regularly"
-    for pattern, replacement in frequency_patterns.items():
-        match = re.search(pattern, sentence, re.IGNORECASE)
-        if match:
-            if 'times' in replacement or 'minutes' in replacement or 'hours' in replacement:
-                frequency = re.sub(pattern, replacement, sentence, flags=re.IGNORECASE)
-                frequency = re.search(r'(\d+(?:[-–]\d+)?\s*(?:times|minutes|hours|servings)(?:\s+(?:daily|weekly|per\s+\w+))?)', frequency, re.IGNORECASE)
-                frequency = frequency.group(1) if frequency else "regularly"
-            else:
-                frequency = replacement
-            break
-    
-    # Extract the main action
-    action_verbs = ['aim', 'try', 'practice', 'maintain', 'keep', 'create', 'use', 'avoid', 'limit', 'stop', 'start', 'include', 'eat', 'drink', 'exercise', 'sleep', 'breathe', 'focus', 'set', 'take', 'get', 'go', 'choose', 'replace']
-    
-    # Clean the sentence and extract main action
-    clean_sentence = sentence.lower().strip()
-    
-    # Remove common prefixes
-    clean_sentence = re.sub(r'^(adults should|try to|it\'s important to|you should|make sure to|be sure to|remember to)\s*', '', clean_sentence)
-    
-    # Find the main action
-    action = ""
-    for verb in action_verbs:
-        if verb in clean_sentence:
-            # Extract the action phrase starting with this verb
-            verb_match = re.search(rf'\b{verb}\b.*?(?=\.|,|;|$)', clean_sentence)
-            if verb_match:
-                action = verb_match.group(0).strip()
-                break
-    
-    # If no clear action found, use the beginning of the sentence
-    if not action:
-        # Take first meaningful part
-        parts = clean_sentence.split(',')
-        action = parts[0].strip()
-        if len(action) < 10 and len(parts) > 1:
-            action = ', '.join(parts[:2]).strip()
-    
-    # Ensure action starts with a verb
-    if not any(action.startswith(verb) for verb in action_verbs):
-        action = f"practice {action}" if not action.startswith(('practice', 'try', 'aim')) else action
-    
-    # Capitalize first letter
-    action = action[0].upper() + action[1:] if action else "Focus on this practice"
-    
-    # Construct the behavior change format
-    if frequency == "regularly":
-        result = f"{action} {frequency}, starting this week."
-    else:
-        result = f"{action} {frequency}, starting this week."
-    
-    # Clean up any redundancy
-    result = re.sub(r'\s+', ' ', result)
-    result = re.sub(r',\s*,', ',', result)
-    
-    return result
+    return RULES.transform(sentence)
 
 def get_source_preview(text: str) -> str:
     """Generate 1-2 sentence preview for source tooltip"""
@@ -262,6 +236,204 @@ def get_source_preview(text: str) -> str:
     
     return " ".join(preview_sentences) if preview_sentences else "Health and wellness guidance."
 
+def apply_intent_hints(rag_index, user_msg: str, keywords: List[str], results: List[Dict], query_vec) -> List[Dict]:
+    """Ensure at least one result comes from the source whose centroid best matches the query"""
+    forced_sources = [name for name, score in rag_index.route_intent(query_vec, n=1) if score >= INTENT_MIN_SCORE]
+    
+    # If we have an intent hint, ensure at least one result from that source
+    if forced_sources:
+        has_forced_source = any(r["source"] in forced_sources for r in results)
+        if not has_forced_source and len(results) > 0:
+            # Replace the lowest scoring result with one from the forced source
+            for source in forced_sources:
+                forced_result = rag_index.get_best_from_source(user_msg, keywords, source, query_vec=query_vec)
+                if forced_result:
+                    results[-1] = forced_result
+                    break
+    return results
+
+def compose_sources(results: List[Dict]) -> List[Dict]:
+    """Deduplicate result sources with previews, keeping the top 3 that score at least SOURCE_MIN_SCORE"""
+    unique_sources = {}
+    for r in results:
+        source = r["source"]
+        if source not in unique_sources:
+            preview = get_source_preview(r["text"])
+            unique_sources[source] = {
+                "name": source,
+                "preview": preview,
+                "score": r.get("score", 0)
+            }
+    
+    # Sort sources by score (descending)
+    sorted_sources = sorted(unique_sources.values(), key=lambda x: x["score"], reverse=True)
+    
+    # Filter sources: score ≥ SOURCE_MIN_SCORE (0.55) and limit to 3 max
+    return [s for s in sorted_sources if s["score"] >= SOURCE_MIN_SCORE][:3]
+
+def run_answer_pipeline(rag_index, user_msg: str, keywords: List[str], emit,
+                        cancelled: threading.Event = None, trace=NULL_TRACE,
+                        cache: SemanticCache = None, scope: str = "") -> None:
+    """Retrieve, compose bullets and build sources, calling emit(kind, payload) as each piece is ready.
+
+    Emits ("retrieved", retrieve_ms) once search and intent forcing are done, then one
+    ("bullet", text) per bullet, then ("sources", list).
+    Stops early without emitting further if `cancelled` is set.
+    With a `cache`, a close enough earlier query in `scope` replays its bullets and sources
+    (after a ("cache_hit", similarity) event); a completed answer is stored for later ones.
+    """
+    retrieve_start = time.time()
+    # Embed once; retrieval, intent routing and the answer cache share the vector
+    with trace.span("embed"):
+        query_vec = rag_index.embed_query(user_msg)
+    if cache is not None:
+        generation = cache.generation
+        with trace.span("answer_cache"):
+            cached = cache.get(query_vec, scope)
+        if cached is not None:
+            payload, similarity = cached
+            emit("cache_hit", similarity)
+            emit("retrieved", (time.time() - retrieve_start) * 1000)
+            for bullet in payload["bullets"]:
+                if cancelled is not None and cancelled.is_set():
+                    return
+                emit("bullet", bullet)
+            emit("sources", payload["sources"])
+            return
+    # Get RAG results with enhanced relevance
+    with trace.span("score"):
+        results = rag_index.search_enhanced(user_msg, keywords, k=4, query_vec=query_vec,
+                                            top_sources=ROUTE_TOP_SOURCES or None)
+    retrieve_time = (time.time() - retrieve_start) * 1000  # Convert to ms
+
+    # Apply intent hint routing to ensure at least one on-topic result
+    with trace.span("intent_forcing"):
+        results = apply_intent_hints(rag_index, user_msg, keywords, results, query_vec)
+    emit("retrieved", retrieve_time)
+    if cancelled is not None and cancelled.is_set():
+        return
+
+    # Compose high-quality bullets, limited to 4
+    bullets = []
+    with trace.span("compose"):
+        for r in results:
+            if cancelled is not None and cancelled.is_set():
+                return
+            if len(bullets) >= 4:
+                break
+            with trace.span("bullet"):
+                bullet = compose_bullet(r["text"], keywords)
+            if bullet and bullet != "No actionable advice found.":
+                bullets.append(bullet)
+                emit("bullet", bullet)
+
+        # Enhanced sources with previews and deduplication
+        with trace.span("sources"):
+            sources = compose_sources(results)
+    emit("sources", sources)
+    if cache is not None:
+        cache.put(query_vec, {"bullets": bullets, "sources": sources}, scope, generation)
+
+def stream_settler(request_id: str, expected_ms: float, permits=(), trace=NULL_TRACE):
+    """Build the once-only end of a stream: settle(completed) releases the admission `permits`,
+    counts an abandoned stream with the unstreamed remainder of `expected_ms` as saved, and logs a
+    traced request's spans. Later calls do nothing, so every exit path can call it.
+    """
+    stream_start = time.time()
+    settled = False
+
+    def settle(completed: bool):
+        nonlocal settled
+        if settled:
+            return
+        settled = True
+        for permit in permits:
+            permit.release()
+        if not completed:
+            record_abandoned(request_id, stream_start, expected_ms)
+        trace.emit("completed" if completed else "abandoned")
+    return settle
+
+async def supervise_stream(request: Request, request_id: str, frames, expected_ms: float, settle=None):
+    """Relay SSE frames with a timer-driven heartbeat, cancelling the stream's work if the client leaves.
+
+    `frames` runs in its own task so heartbeats still go out while it is stalled. If the client
+    disconnects, the producer is cancelled. The stream is settled (see stream_settler) however
+    it ends.
+    """
+    if settle is None:
+        settle = stream_settler(request_id, expected_ms)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=8)
+
+    async def produce():
+        try:
+            async for frame in frames:
+                await queue.put(frame)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(_STREAM_END)
+
+    producer = asyncio.create_task(produce())
+    last_heartbeat = last_check = time.time()
+    completed = False
+    try:
+        while True:
+            now = time.time()
+            if now - last_check >= DISCONNECT_POLL_INTERVAL:
+                last_check = now
+                if await request.is_disconnected():
+                    break
+            if now - last_heartbeat >= HEARTBEAT_INTERVAL:
+                yield ":\n\n"  # Heartbeat comment to keep connection alive
+                last_heartbeat = now
+
+            wait = min(last_heartbeat + HEARTBEAT_INTERVAL, last_check + DISCONNECT_POLL_INTERVAL) - time.time()
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=max(wait, 0))
+            except asyncio.TimeoutError:
+                continue
+            if item is _STREAM_END:
+                completed = True
+                break
+            if isinstance(item, Exception):
+                completed = True  # a failed stream is not an abandoned one
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+        settle(completed)
+
+def record_abandoned(request_id: str, stream_start: float, expected_ms: float):
+    """Count a stream the client walked away from and the paced streaming time it saved"""
+    elapsed_ms = (time.time() - stream_start) * 1000
+    saved_ms = max(0.0, expected_ms - elapsed_ms)
+    stream_metrics["abandoned_streams"] += 1
+    stream_metrics["abandoned_saved_ms"] += saved_ms
+    print("REQUEST_ABANDONED", json.dumps({
+        "request_id": request_id,
+        "elapsed_ms": int(elapsed_ms),
+        "saved_ms": int(saved_ms),
+        "timestamp": int(time.time())
+    }))
+
+def log_rejected(request_id: str, rejection: Rejected):
+    print("REQUEST_REJECTED", json.dumps({
+        "request_id": request_id,
+        "limiter": rejection.limiter,
+        "reason": rejection.reason,
+        "timestamp": int(time.time())
+    }))
+
+def reject_busy(request_id: str, rejection: Rejected) -> JSONResponse:
+    """Fast 503 telling the client when to retry"""
+    log_rejected(request_id, rejection)
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Server busy, please retry shortly", "reason": rejection.reason},
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint for operational readiness monitoring"""
@@ -291,7 +463,15 @@ async def health_check():
                 "health": {"ok": True, "snippets": snippet_count}
             },
             "latency_report": latency_report,
-            "request_count": len(latency_metrics["total_stream_times"])
+            "request_count": len(latency_metrics["total_stream_times"]),
+            "abandoned_streams": stream_metrics["abandoned_streams"],
+            "abandoned_saved_ms": int(stream_metrics["abandoned_saved_ms"]),
+            "admission": {
+                "retrieval": retrieval_limiter.stats(),
+                "streams": stream_limiter.stats()
+            },
+            "collections": collections.stats(),
+            "answer_cache": answer_cache.stats() if answer_cache is not None else None
         }
     except Exception as e:
         return {
@@ -301,51 +481,32 @@ async def health_check():
             "status": "error"
         }
 
-@app.post("/chat")
-async def chat(request: Request):
-    # Generate unique request ID for tracking
-    request_id = str(uuid.uuid4())[:8]
-    start_time = time.time()
-    
-    body = await request.json()
-    raw_msg = body.get("message", "")
-    user_msg = deidentify(raw_msg)
-
-    # PHI-safe logging - NEVER log raw text content
-    # This is critical for HIPAA compliance and patient privacy
-    log_data = {
-        "request_id": request_id,
-        "endpoint": "POST /chat",
-        "input_length": len(raw_msg),
-        "redacted_length": len(user_msg),
-        "phi_detected": len(raw_msg) != len(user_msg),  # True if PHI was redacted
-        "timestamp": int(start_time)
-    }
-    print("REQUEST_START", json.dumps(log_data))
+async def prepare_answer(request_id: str, user_msg: str, collection, trace, start_time: float):
+    """Gate, route and admit one question, then start answering it in a worker thread.
 
+    Returns (frames, expected_ms, permits): an async generator of the answer's frame payloads
+    (tokens, bullets, the bullets array, sources), how long pacing them out should take, and the
+    admission permits taken here. The worker thread only starts once frames is iterated, so an
+    answer nobody reads costs nothing, and the caller releases `permits` however the request
+    ends, alongside the stream permit it holds. Raises UnknownCollection or Rejected before any
+    work starts.
+    """
     # Check for out-of-scope medical queries
-    if is_medical_query(user_msg):
+    with trace.span("medical_gate"):
+        medical = is_medical_query(user_msg)
+    if medical:
         print("MEDICAL_QUERY_DETECTED", json.dumps({"request_id": request_id, "query_type": "medical"}))
-        
+
+        medical_response = get_medical_redirect_response()
+
         async def medical_stream():
-            medical_response = get_medical_redirect_response()
-            last_heartbeat = time.time()
-            
             # Stream the safety message
-            for ch in medical_response["text"]:
-                # Send heartbeat every ~15 seconds
-                current_time = time.time()
-                if current_time - last_heartbeat >= 15:
-                    yield ":\n\n"  # Heartbeat comment to keep connection alive
-                    last_heartbeat = current_time
-                
-                yield f"data: {json.dumps({'token': ch})}\n\n"
-                await asyncio.sleep(0.01)
-            
-            # Don't send bullets or sources for medical responses
-            yield "data: [DONE]\n\n"
-            
-            # Log completion
+            with trace.span("stream"):
+                for ch in medical_response["text"]:
+                    yield {'token': ch}
+                    await asyncio.sleep(TOKEN_DELAY)
+
+            # Don't send bullets or sources for medical responses; just log completion
             end_time = time.time()
             completion_log = {
                 "request_id": request_id,
@@ -354,133 +515,336 @@ async def chat(request: Request):
                 "timestamp": int(end_time)
             }
             print("REQUEST_COMPLETE", json.dumps(completion_log))
-        
-        return StreamingResponse(
-            medical_stream(),
-            media_type="text/event-stream",
-            headers={
-                "Content-Type": "text/event-stream",
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "X-Accel-Buffering": "no"
-            }
-        )
+
+        return medical_stream(), len(medical_response["text"]) * TOKEN_DELAY * 1000, ()
 
     # Extract keywords for intent routing and bullet composition
-    keywords = extract_keywords(user_msg)
-    
-    # Track retrieval latency
-    retrieve_start = time.time()
-    # Get RAG results with enhanced relevance
-    results = rag.search_enhanced(user_msg, keywords, k=4)
-    retrieve_time = (time.time() - retrieve_start) * 1000  # Convert to ms
-    latency_metrics["retrieve_times"].append(retrieve_time)
-    
-    # Apply intent hint routing to ensure at least one on-topic result
-    forced_sources = set()
-    for keyword in keywords:
-        if keyword in INTENT_MAP:
-            forced_sources.update(INTENT_MAP[keyword])
-    
-    # If we have intent hints, ensure at least one result from those sources
-    if forced_sources:
-        has_forced_source = any(r["source"] in forced_sources for r in results)
-        if not has_forced_source and len(results) > 0:
-            # Replace the lowest scoring result with one from the forced source
-            for source in forced_sources:
-                forced_result = rag.get_best_from_source(user_msg, keywords, source)
-                if forced_result:
-                    results[-1] = forced_result
-                    break
+    with trace.span("keywords"):
+        keywords = extract_keywords(user_msg)
+
+    # Pin the index for this request so a concurrent /reindex or an eviction can't swap it mid-stream
+    if collection is None:
+        current_rag = rag
+    else:
+        with trace.span("collection"):
+            current_rag = await asyncio.to_thread(collections.get, str(collection))
+    preface = f"Based on your question about '{user_msg}', here's what can help:\n"
+    retrieve_p50 = calculate_percentiles(list(latency_metrics["retrieve_times"]))["p50"]
+    expected_ms = len(preface) * TOKEN_DELAY * 1000 + retrieve_p50
+
+    # Retrieval waits in a bounded queue for a slot; past the deadline we shed the request
+    with trace.span("admission"):
+        retrieval_permit = await retrieval_limiter.acquire()
+
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def emit(kind: str, payload):
+        if kind == "retrieved":
+            # Free the retrieval slot as soon as embedding and scoring are done
+            loop.call_soon_threadsafe(retrieval_permit.release)
+        loop.call_soon_threadsafe(events.put_nowait, (kind, payload))
+
+    def run_pipeline():
+        try:
+            with trace.profile(), trace.span("pipeline"):
+                run_answer_pipeline(current_rag, user_msg, keywords, emit, cancelled, trace,
+                                    cache=answer_cache, scope=collection or "")
+        except Exception as e:
+            emit("error", e)
+        finally:
+            loop.call_soon_threadsafe(retrieval_permit.release)
 
     async def stream():
-        last_heartbeat = time.time()
-        
-        # Short, personalized intro
-        preface = f"Based on your question about '{user_msg}', here's what can help:\n"
-        for ch in preface:
-            # Send heartbeat every ~15 seconds
-            current_time = time.time()
-            if current_time - last_heartbeat >= 15:
-                yield ":\n\n"  # Heartbeat comment to keep connection alive
-                last_heartbeat = current_time
-            
-            yield f"data: {json.dumps({'token': ch})}\n\n"
-            await asyncio.sleep(0.01)  # Small delay for smooth streaming
+        with trace.span("stream"):
+            # Retrieval and composition run in a worker thread and overlap with the preface
+            pipeline = asyncio.create_task(asyncio.to_thread(run_pipeline))
+            try:
+                # Short, personalized intro - first token goes out before retrieval finishes
+                with trace.span("preface"):
+                    for ch in preface:
+                        yield {'token': ch}
+                        await asyncio.sleep(TOKEN_DELAY)  # Small delay for smooth streaming
 
-        # Compose high-quality bullets
-        bullets = []
-        for r in results:
-            bullet = compose_bullet(r["text"], keywords)
-            if bullet and bullet != "No actionable advice found.":
-                bullets.append(bullet)
-        
-        # Ensure we have good bullets
-        bullets = bullets[:4]  # Limit to 4 bullets max
-        
-        # Stream bullets one by one for snappy feel
-        for i, bullet in enumerate(bullets):
-            # Send heartbeat if needed
-            current_time = time.time()
-            if current_time - last_heartbeat >= 15:
-                yield ":\n\n"  # Heartbeat comment to keep connection alive
-                last_heartbeat = current_time
-            
-            await asyncio.sleep(0.15)  # Sub-200ms delay between bullets
-            single_bullet_data = {"bullet_index": i, "bullet": bullet}
-            yield f"data: {json.dumps(single_bullet_data)}\n\n"
+                # Stream each bullet as soon as the pipeline has composed it
+                bullets = []
+                filtered_sources = []
+                retrieve_time = 0.0
+                cache_similarity = None
+                status = "completed"
+                with trace.span("results"):
+                    while True:
+                        kind, payload = await events.get()
+                        if kind == "cache_hit":
+                            cache_similarity = payload
+                        elif kind == "retrieved":
+                            retrieve_time = payload
+                            latency_metrics["retrieve_times"].append(retrieve_time)
+                        elif kind == "bullet":
+                            yield {"bullet_index": len(bullets), "bullet": payload}
+                            bullets.append(payload)
+                        elif kind == "sources":
+                            filtered_sources = payload
+                            break
+                        elif kind == "error":
+                            status = "error"
+                            print("PIPELINE_ERROR", json.dumps({"request_id": request_id, "error": type(payload).__name__}))
+                            break
+                await pipeline
+            finally:
+                # Client gone or stream finished: stop any composition still in flight
+                cancelled.set()
+                pipeline.cancel()
 
-        # After all bullets, send the complete bullets array
-        yield f"data: {json.dumps({'bullets': bullets})}\n\n"
+            # After all bullets, send the complete bullets array
+            yield {'bullets': bullets}
+            yield {'sources': filtered_sources}
 
-        # Enhanced sources with previews and deduplication
-        unique_sources = {}
-        for r in results:
-            source = r["source"]
-            if source not in unique_sources:
-                preview = get_source_preview(r["text"])
-                unique_sources[source] = {
-                    "name": source,
-                    "preview": preview,
-                    "score": r.get("score", 0)
-                }
-        
-        # Sort sources by score (descending)
-        sorted_sources = sorted(unique_sources.values(), key=lambda x: x["score"], reverse=True)
-        
-        # Filter sources: score ≥0.55 threshold and limit to 3 max
-        filtered_sources = [s for s in sorted_sources if s["score"] >= 0.55][:3]
-        
-        yield f"data: {json.dumps({'sources': filtered_sources})}\n\n"
-        yield "data: [DONE]\n\n"
-        
         # PHI-safe completion logging
         end_time = time.time()
         total_time = (end_time - start_time) * 1000  # Convert to ms
         latency_metrics["total_stream_times"].append(total_time)
-        
+
         completion_log = {
             "request_id": request_id,
-            "status": "completed",
+            "status": status,
             "duration_ms": int(total_time),
             "retrieve_ms": int(retrieve_time),
             "bullets_generated": len(bullets),
             "sources_used": len(filtered_sources),
+            "cache_hit": cache_similarity is not None,
             "timestamp": int(end_time)
         }
         print("REQUEST_COMPLETE", json.dumps(completion_log))
 
+    return stream(), expected_ms, (retrieval_permit,)
+
+async def sse_frames(frames):
+    """Serialize answer frames as SSE events, ending with [DONE]"""
+    async with contextlib.aclosing(frames):
+        async for frame in frames:
+            yield f"data: {json.dumps(frame)}\n\n"
+    yield "data: [DONE]\n\n"
+
+@app.post("/chat")
+async def chat(request: Request):
+    # Generate unique request ID for tracking
+    request_id = str(uuid.uuid4())[:8]
+    start_time = time.time()
+    trace = tracer.start(request_id, request.headers)
+
+    body = await request.json()
+    raw_msg = body.get("message", "")
+    collection = body.get("collection") or None
+    with trace.span("deidentify"):
+        user_msg = deidentify(raw_msg)
+
+    # PHI-safe logging - NEVER log raw text content
+    # This is critical for HIPAA compliance and patient privacy
+    log_data = {
+        "request_id": request_id,
+        "endpoint": "POST /chat",
+        "input_length": len(raw_msg),
+        "redacted_length": len(user_msg),
+        "phi_detected": len(raw_msg) != len(user_msg),  # True if PHI was redacted
+        "collection": collection,
+        "timestamp": int(start_time)
+    }
+    print("REQUEST_START", json.dumps(log_data))
+
+    # Every stream needs an open-stream slot; refuse immediately when we're full
+    try:
+        stream_permit = await stream_limiter.acquire()
+    except Rejected as e:
+        return reject_busy(request_id, e)
+
+    try:
+        frames, expected_ms, permits = await prepare_answer(request_id, user_msg, collection, trace, start_time)
+    except UnknownCollection:
+        stream_permit.release()
+        return JSONResponse(status_code=404, content={"error": "Unknown collection"})
+    except Rejected as e:
+        stream_permit.release()
+        return reject_busy(request_id, e)
+    except BaseException:
+        # Cancelled while queued for retrieval or building a collection
+        stream_permit.release()
+        raise
+    settle = stream_settler(request_id, expected_ms, (stream_permit, *permits), trace)
+
+    # The client may have left while we waited for admission; don't start work nobody will read
+    if await request.is_disconnected():
+        settle(False)
+        return Response(status_code=499)
+
     return StreamingResponse(
-        stream(),
+        supervise_stream(request, request_id, sse_frames(frames), expected_ms, settle),
+        # Starlette drops the body unread if the client leaves before the first frame; settle then
+        background=BackgroundTask(settle, False),
         media_type="text/event-stream",
         headers={
             "Content-Type": "text/event-stream",
-            "Cache-Control": "no-cache", 
+            "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "X-Accel-Buffering": "no"
         }
     )
 
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket):
+    """/chat over one long-lived WebSocket, with several questions in flight at once.
+
+    The client sends {"type": "ask", "id": ..., "message": ..., "collection": ...} to start a
+    question and {"type": "cancel", "id": ...} to drop it. Every frame sent back is a /chat SSE
+    payload plus the question's "id"; an answer ends with "done", "cancelled" or "error".
+    Keepalive is the server's protocol-level ping/pong, so no heartbeat frames are sent.
+    """
+    await websocket.accept()
+    connection_id = str(uuid.uuid4())[:8]
+    in_flight: Dict[str, asyncio.Task] = {}
+    send_lock = asyncio.Lock()
+    print("WS_CONNECT", json.dumps({"connection_id": connection_id, "timestamp": int(time.time())}))
+
+    async def send(frame: Dict):
+        # Answers interleave on one socket; never let two sends overlap
+        async with send_lock:
+            await websocket.send_json(frame)
+
+    async def answer(question_id: str, raw_msg: str, collection):
+        request_id = str(uuid.uuid4())[:8]
+        start_time = time.time()
+        trace = tracer.start(request_id, websocket.headers)
+        with trace.span("deidentify"):
+            user_msg = deidentify(raw_msg)
+
+        # PHI-safe logging - NEVER log raw text content
+        print("REQUEST_START", json.dumps({
+            "request_id": request_id,
+            "endpoint": "WS /ws/chat",
+            "connection_id": connection_id,
+            "input_length": len(raw_msg),
+            "redacted_length": len(user_msg),
+            "phi_detected": len(raw_msg) != len(user_msg),
+            "collection": collection,
+            "timestamp": int(start_time)
+        }))
+
+        try:
+            stream_permit = await stream_limiter.acquire()
+        except Rejected as e:
+            log_rejected(request_id, e)
+            await send({"id": question_id, "error": "Server busy, please retry shortly", "reason": e.reason,
+                        "retry_after": RETRY_AFTER_SECONDS})
+            return
+        try:
+            frames, expected_ms, permits = await prepare_answer(request_id, user_msg, collection, trace, start_time)
+        except UnknownCollection:
+            stream_permit.release()
+            await send({"id": question_id, "error": "Unknown collection"})
+            return
+        except Rejected as e:
+            stream_permit.release()
+            log_rejected(request_id, e)
+            await send({"id": question_id, "error": "Server busy, please retry shortly", "reason": e.reason,
+                        "retry_after": RETRY_AFTER_SECONDS})
+            return
+        except BaseException:
+            # Cancelled while queued for retrieval or building a collection
+            stream_permit.release()
+            raise
+        settle = stream_settler(request_id, expected_ms, (stream_permit, *permits), trace)
+        completed = False
+        try:
+            async with contextlib.aclosing(frames):
+                async for frame in frames:
+                    await send({"id": question_id, **frame})
+            await send({"id": question_id, "done": True})
+            completed = True
+        finally:
+            settle(completed)
+
+    async def run(question_id: str, raw_msg: str, collection):
+        try:
+            await answer(question_id, raw_msg, collection)
+        except Exception as e:  # usually a send racing the client's disconnect
+            print("WS_ANSWER_ERROR", json.dumps({"connection_id": connection_id, "error": type(e).__name__}))
+        finally:
+            # A cancelled id may already have been reused for a new question
+            if in_flight.get(question_id) is asyncio.current_task():
+                del in_flight[question_id]
+
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except json.JSONDecodeError:
+                await send({"error": "Invalid message"})
+                continue
+            if not isinstance(message, dict):
+                await send({"error": "Invalid message"})
+                continue
+            question_id = message.get("id")
+            if not isinstance(question_id, str) or not question_id:
+                await send({"error": "Every message needs a string id"})
+                continue
+
+            if message.get("type") == "cancel":
+                task = in_flight.pop(question_id, None)
+                if task is not None:
+                    task.cancel()
+                    await send({"id": question_id, "cancelled": True})
+            elif message.get("type") == "ask":
+                if question_id in in_flight:
+                    await send({"id": question_id, "error": "Question id already in flight"})
+                elif WS_MAX_IN_FLIGHT and len(in_flight) >= WS_MAX_IN_FLIGHT:
+                    await send({"id": question_id, "error": "Too many questions in flight", "reason": "in_flight",
+                                "retry_after": RETRY_AFTER_SECONDS})
+                else:
+                    in_flight[question_id] = asyncio.create_task(
+                        run(question_id, str(message.get("message", "")), message.get("collection") or None))
+            else:
+                await send({"id": question_id, "error": "Unknown message type"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        # Connection gone: stop every answer still streaming on it
+        tasks = list(in_flight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        print("WS_DISCONNECT", json.dumps({"connection_id": connection_id, "cancelled": len(tasks),
+                                           "timestamp": int(time.time())}))
+
+@app.get("/debug/memory")
+async def debug_memory(request: Request, top: int = 0, stop: bool = False):
+    """Bytes per index component, model, cache and metric buffer, and process RSS.
+
+    `top=N` also returns the N allocation sites that grew most since the previous `top` call
+    (the first one starts tracemalloc and records the baseline); `stop=true` ends tracing.
+    """
+    if not DEBUG_MEMORY:
+        return JSONResponse(status_code=404, content={"detail": "Not Found"})
+    if DEBUG_TOKEN is not None and not hmac.compare_digest(request.headers.get("x-debug-token", ""), DEBUG_TOKEN):
+        return JSONResponse(status_code=403, content={"error": "Forbidden"})
+
+    current_rag = rag
+    report = {
+        "process": memory.process_memory(),
+        "index": memory.index_bytes(current_rag),
+        "model_onnx_bytes": memory.model_file_bytes(current_rag.model),
+        "collections": collections.stats(),
+        "answer_cache_bytes": answer_cache.nbytes() if answer_cache is not None else 0,
+        "latency_metrics_bytes": memory.deep_sizeof(latency_metrics),
+        "timestamp": int(time.time())
+    }
+    if stop:
+        allocations.stop()
+        report["tracemalloc"] = {"tracing": False}
+    elif top > 0:
+        report["tracemalloc"] = await asyncio.to_thread(allocations.diff, top)
+    return report
+
 @app.post("/reindex")
 async def reindex():
     """Reindex the RAG system with current data"""
@@ -489,7 +853,11 @@ async def reindex():
         
         # Reinitialize the RAG system to pick up new data
         global rag
-        rag = LocalRAG(data_dir=DATA_DIR)
+        previous, rag = rag, build_index()
+        previous.close_shards()  # waits for any query still using the old shards
+        collections.clear()  # named collections rebuild on their next request
+        if answer_cache is not None:
+            answer_cache.clear()  # cached answers came from the old index
         
         print("POST /reindex - completed successfully")
         return {"status": "success", "message": "Reindexing completed successfully"}
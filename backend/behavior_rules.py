@@ -0,0 +1,145 @@
+"""
+Rule engine that turns snippet text into "Do X, How Often, Starting When" bullets.
+
+Every pattern is compiled once at import. The frequency rules keep their
+priority order. A rule is skipped without running its regex when the
+sentence has no digit and the rule needs one, or when an ASCII sentence
+lacks every word the rule can match. Non-ASCII sentences always run every
+rule, because IGNORECASE also folds characters such as U+017F (long s)
+that str.lower() leaves alone.
+
+The 24 action verbs are found with one combined word-bounded alternation.
+Only the highest-priority verb present then runs its own precompiled action
+pattern, instead of one recompiled search per verb.
+
+Output is byte-for-byte what the original per-call regex code produced,
+including its quirks: a range or servings match yields the literal text
+"\\1 \\2" / "\\1 servings". golden_bullets.json pins this, and
+test_behavior_rules.py and `python benchmark.py rules` check against it.
+"""
+import re
+from typing import List, Tuple
+
+# (pattern, replacement, words any match contains one of) in priority order; the first rule that matches decides
+FREQUENCY_RULES: List[Tuple[str, str, Tuple[str, ...]]] = [
+    (r'(\d+)\s*times?\s*(per\s+|a\s+)?(day|week|month)', r'\1 times \3ly', ('time',)),
+    (r'(\d+)\s*minutes?\s*(per\s+|a\s+)?(day|daily)', r'\1 minutes daily', ('minute',)),
+    (r'(\d+)\s*hours?\s*(per\s+|a\s+)?(day|week)', r'\1 hours per \3', ('hour',)),
+    (r'daily|every\s+day', 'daily', ('daily', 'every')),
+    (r'weekly|every\s+week|once\s+a\s+week', 'weekly', ('weekly', 'every', 'once')),
+    (r'(\d+[-–]\d+)\s*(times|hours|minutes)', r'\1 \2', ('time', 'hour', 'minute')),
+    (r'(\d+)\s*servings?', r'\1 servings', ('serving',)),
+]
+
+ACTION_VERBS = ('aim', 'try', 'practice', 'maintain', 'keep', 'create', 'use', 'avoid', 'limit', 'stop', 'start',
+                'include', 'eat', 'drink', 'exercise', 'sleep', 'breathe', 'focus', 'set', 'take', 'get', 'go',
+                'choose', 'replace')
+
+FREQUENCY_WORDS = ('daily', 'weekly', 'times', 'minutes', 'hours', 'days')
+
+_DIGIT = re.compile(r'\d')
+_FIELD_LABEL = re.compile(r'^[^:]+:\s*')
+_PREFIX = re.compile(r"^(adults should|try to|it's important to|you should|make sure to|be sure to|remember to)\s*")
+_FREQUENCY_PHRASE = re.compile(r'(\d+(?:[-–]\d+)?\s*(?:times|minutes|hours|servings)(?:\s+(?:daily|weekly|per\s+\w+))?)',
+                               re.IGNORECASE)
+_VERB = re.compile(r'\b(?:' + '|'.join(ACTION_VERBS) + r')\b')
+_SPACES = re.compile(r'\s+')
+_DOUBLE_COMMA = re.compile(r',\s*,')
+
+class BehaviorRules:
+    """Compiled frequency, prefix and action rules behind compose_bullet"""
+
+    def __init__(self):
+        self._frequency = []
+        for pattern, replacement, words in FREQUENCY_RULES:
+            expands = 'times' in replacement or 'minutes' in replacement or 'hours' in replacement
+            self._frequency.append((re.compile(pattern, re.IGNORECASE), replacement, expands,
+                                    pattern.startswith('(\\d'), words))
+        self._actions = {verb: re.compile(rf'\b{verb}\b.*?(?=\.|,|;|$)') for verb in ACTION_VERBS}
+
+    def frequency(self, sentence: str) -> str:
+        """How often, from the first frequency rule that matches, else "regularly\""""
+        has_digit = _DIGIT.search(sentence) is not None
+        lower = sentence.lower() if sentence.isascii() else None
+        for pattern, replacement, expands, needs_digit, words in self._frequency:
+            if needs_digit and not has_digit:
+                continue
+            if lower is not None and not any(word in lower for word in words):
+                continue
+            if pattern.search(sentence):
+                if not expands:
+                    return replacement
+                phrase = _FREQUENCY_PHRASE.search(pattern.sub(replacement, sentence))
+                return phrase.group(1) if phrase else "regularly"
+        return "regularly"
+
+    def action(self, sentence: str) -> str:
+        """The action phrase, led by the highest-priority verb that appears as a word"""
+        clean_sentence = _PREFIX.sub('', sentence.lower().strip())
+
+        present = set(_VERB.findall(clean_sentence))
+        action = ""
+        for verb in ACTION_VERBS:
+            if verb in present:
+                verb_match = self._actions[verb].search(clean_sentence)
+                if verb_match:
+                    action = verb_match.group(0).strip()
+                    break
+
+        # If no clear action found, use the beginning of the sentence
+        if not action:
+            parts = clean_sentence.split(',')
+            action = parts[0].strip()
+            if len(action) < 10 and len(parts) > 1:
+                action = ', '.join(parts[:2]).strip()
+
+        # Ensure action starts with a verb
+        if not action.startswith(ACTION_VERBS):
+            action = f"practice {action}" if not action.startswith(('practice', 'try', 'aim')) else action
+
+        return action[0].upper() + action[1:] if action else "Focus on this practice"
+
+    def transform(self, sentence: str) -> str:
+        """Rewrite one sentence as "<Action> <how often>, starting this week.\""""
+        result = f"{self.action(sentence)} {self.frequency(sentence)}, starting this week."
+        return _DOUBLE_COMMA.sub(',', _SPACES.sub(' ', result))
+
+    def best_sentence(self, text: str, query_keywords: List[str]):
+        """The content sentence with the most keyword, number and frequency evidence, or None"""
+        best_sentence = None
+        best_score = 0
+        for sentence in text.split("."):
+            sentence = sentence.strip()
+
+            # Skip metadata lines
+            if sentence.startswith(("Title:", "source:")) or len(sentence) < 20:
+                continue
+
+            # Remove field labels
+            clean_sentence = _FIELD_LABEL.sub('', sentence)
+            if not clean_sentence or len(clean_sentence) <= 15:
+                continue
+            if best_sentence is None:
+                best_sentence = clean_sentence
+
+            lower = clean_sentence.lower()
+            score = 3 * sum(1 for keyword in query_keywords if keyword in lower)
+            if _DIGIT.search(clean_sentence):
+                score += 2
+            if any(word in lower for word in FREQUENCY_WORDS):
+                score += 2
+
+            if score > best_score:
+                best_score = score
+                best_sentence = clean_sentence
+        return best_sentence
+
+    def compose(self, text: str, query_keywords: List[str]) -> str:
+        """One bullet from a snippet: its best sentence rewritten, capped at 200 characters"""
+        best_sentence = self.best_sentence(text, query_keywords)
+        if best_sentence is None:
+            return "Focus on this wellness practice regularly, starting this week."
+        bullet = self.transform(best_sentence)
+        return bullet[:200] + "…" if len(bullet) > 200 else bullet
+
+RULES = BehaviorRules()
@@ -0,0 +1,362 @@
+"""
+Offline retrieval benchmarks.
+
+    python benchmark.py reduce --dims 32,64,128 --replicate 50 --stub
+    python benchmark.py shards --shards 1,2,4 --replicate 200 --stub
+    python benchmark.py rules
+    python benchmark.py eval --chunk-sizes 400,600,800 --keyword-boosts 0,0.1,0.2 --backends exact,pca:64,route:3
+
+`reduce` builds the index once exact and once per reduced width, replays the
+same queries through search_enhanced, and reports first-pass speedup against
+recall@k versus the exact full-dimension ranking. Recall counts a returned row
+as correct when its exact score reaches the exact k-th best score, so
+replicated (tied) chunks do not read as misses.
+
+`shards` replays the queries in-process and then through 1..N shard processes
+(scatter-gather), checks that every sharded result equals the in-process one
+and reports latency and throughput per shard count.
+
+`rules` replays golden_bullets.json through transform_to_behavior_change and
+compose_bullet, fails if any output differs from the recorded one and reports
+the time per call.
+
+`eval` scores retrieval quality against labelled queries (eval_queries.json:
+each query with the source files that answer it) for every combination of
+chunk size, overlap, keyword boost, field boost and backend. It prints one
+table with recall@k and MRR of the expected sources, the share of queries
+whose expected source survives each source threshold, index size, build
+time and query latency, so a faster setting can be weighed against what it
+costs in quality. The row marked * is the shipped configuration.
+"""
+import argparse, itertools, json, random, re, shutil, statistics, sys, tempfile, time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+DEFAULT_DATA = Path(__file__).resolve().parents[1] / "data" / "snippets"
+GOLDEN_BULLETS = Path(__file__).resolve().parent / "golden_bullets.json"
+EVAL_QUERIES = Path(__file__).resolve().parent / "eval_queries.json"
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+BENCH_QUERIES = [
+    "How can I sleep better?",
+    "tips for managing stress at work",
+    "what should I eat for brain health",
+    "how often should I do aerobic exercise",
+    "ways to improve focus and memory",
+    "staying hydrated during the day",
+]
+
+def _keywords(query: str) -> List[str]:
+    return [w for w in re.findall(r"\b\w+\b", query.lower()) if len(w) > 2]
+
+def replicate_corpus(data_dir: Path, copies: int) -> Path:
+    """Copy every snippet `copies` times into a temp dir to simulate a larger corpus"""
+    out = Path(tempfile.mkdtemp(prefix="bench-corpus-"))
+    for i in range(copies):
+        for fp in sorted(data_dir.glob("*.md")):
+            (out / f"{i:04d}-{fp.name}").write_text(fp.read_text(encoding="utf-8"), encoding="utf-8")
+    return out
+
+def sample_queries(rag, n: int, seed: int = 0) -> List[str]:
+    """Fixed queries plus short word runs drawn from random chunks"""
+    rng = random.Random(seed)
+    queries = list(BENCH_QUERIES)
+    while len(queries) < n:
+        words = rag.store.text(rng.randrange(len(rag.store))).split()
+        start = rng.randrange(max(1, len(words) - 6))
+        queries.append(" ".join(words[start:start + rng.randint(2, 6)]))
+    return queries[:n]
+
+def _timed_search(rag, queries: List[str], query_vecs, k: int, **search_args) -> Tuple[List[List[Dict]], List[float]]:
+    results, latencies = [], []
+    for q, qv in zip(queries, query_vecs):
+        t0 = time.perf_counter()
+        results.append(rag.search_enhanced(q, _keywords(q), k=k, query_vec=qv, **search_args))
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return results, latencies
+
+def recall_at_k(exact: List[Dict], approx: List[Dict], k: int) -> float:
+    """Share of approximate hits scoring at least the exact k-th best score"""
+    if not exact:
+        return 1.0
+    threshold = exact[min(k, len(exact)) - 1]["score"] - 1e-9
+    return sum(1 for hit in approx if hit["score"] >= threshold) / min(k, len(exact))
+
+def run_reduce(args) -> List[Dict]:
+    from rag_index import LocalRAG
+
+    corpus = replicate_corpus(Path(args.data_dir), args.replicate) if args.replicate > 1 else Path(args.data_dir)
+    index_root = Path(tempfile.mkdtemp(prefix="bench-index-"))
+    rows = []
+    try:
+        exact_rag = LocalRAG(data_dir=corpus, index_dir=index_root / "exact")
+        queries = sample_queries(exact_rag, args.queries)
+        query_vecs = [exact_rag.embed_query(q) for q in queries]
+        _timed_search(exact_rag, queries[:10], query_vecs[:10], args.k)  # warm up
+        exact, exact_ms = _timed_search(exact_rag, queries, query_vecs, args.k)
+        rows.append({"mode": "exact", "dim": exact_rag.embs.shape[1], "fit_s": 0.0,
+                     "p50_ms": statistics.median(exact_ms), "speedup": 1.0, "recall": 1.0})
+
+        for dim in args.dims:
+            t0 = time.perf_counter()
+            rag = LocalRAG(data_dir=corpus, index_dir=index_root / f"{args.method}-{dim}", reduced_dim=dim,
+                           reduction=args.method, rescore_candidates=args.candidates)
+            fit_s = time.perf_counter() - t0
+            _timed_search(rag, queries[:10], query_vecs[:10], args.k)
+            approx, approx_ms = _timed_search(rag, queries, query_vecs, args.k)
+            p50 = statistics.median(approx_ms)
+            rows.append({
+                "mode": args.method if rag.reduced is not None else "exact (too few rows)",
+                "dim": dim,
+                "fit_s": fit_s,
+                "p50_ms": p50,
+                "speedup": statistics.median(exact_ms) / p50 if p50 else 0.0,
+                "recall": statistics.mean(recall_at_k(e, a, args.k) for e, a in zip(exact, approx)),
+            })
+    finally:
+        shutil.rmtree(index_root, ignore_errors=True)
+        if corpus != Path(args.data_dir):
+            shutil.rmtree(corpus, ignore_errors=True)
+
+    print(f"chunks={len(exact_rag.store)} queries={len(queries)} k={args.k} candidates={args.candidates}")
+    print(f"{'mode':>22} {'dim':>5} {'build s':>8} {'p50 ms':>8} {'speedup':>8} {'recall@k':>9}")
+    for row in rows:
+        print(f"{row['mode']:>22} {row['dim']:>5} {row['fit_s']:>8.2f} {row['p50_ms']:>8.3f} "
+              f"{row['speedup']:>7.2f}x {row['recall']:>9.4f}")
+    return rows
+
+def run_shards(args) -> List[Dict]:
+    from rag_index import LocalRAG
+    from topology import available_cores
+
+    corpus = replicate_corpus(Path(args.data_dir), args.replicate) if args.replicate > 1 else Path(args.data_dir)
+    index_root = Path(tempfile.mkdtemp(prefix="bench-index-"))
+    rows = []
+    try:
+        rag = LocalRAG(data_dir=corpus, index_dir=index_root)
+        queries = sample_queries(rag, args.queries)
+        query_vecs = [rag.embed_query(q) for q in queries]
+        _timed_search(rag, queries[:10], query_vecs[:10], args.k)
+        expected, base_ms = _timed_search(rag, queries, query_vecs, args.k)
+        base_p50 = statistics.median(base_ms)
+        rows.append({"shards": 0, "p50_ms": base_p50, "qps": 1000 * len(base_ms) / sum(base_ms),
+                     "speedup": 1.0, "identical": True})
+        for n in args.shards:
+            rag.start_shards(n)
+            try:
+                _timed_search(rag, queries[:10], query_vecs[:10], args.k)
+                got, ms = _timed_search(rag, queries, query_vecs, args.k)
+            finally:
+                rag.close_shards()
+            p50 = statistics.median(ms)
+            rows.append({"shards": n, "p50_ms": p50, "qps": 1000 * len(ms) / sum(ms),
+                         "speedup": base_p50 / p50 if p50 else 0.0, "identical": got == expected})
+    finally:
+        shutil.rmtree(index_root, ignore_errors=True)
+        if corpus != Path(args.data_dir):
+            shutil.rmtree(corpus, ignore_errors=True)
+
+    print(f"chunks={len(rag.store)} queries={len(queries)} k={args.k} cores={available_cores()}")
+    print(f"{'shards':>10} {'p50 ms':>8} {'qps':>8} {'speedup':>8} {'identical':>9}")
+    for row in rows:
+        label = "in-process" if row["shards"] == 0 else str(row["shards"])
+        print(f"{label:>10} {row['p50_ms']:>8.3f} {row['qps']:>8.1f} {row['speedup']:>7.2f}x {str(row['identical']):>9}")
+    return rows
+
+def run_rules(args) -> List[Dict]:
+    from behavior_rules import RULES
+
+    golden = json.loads(Path(args.golden).read_text(encoding="utf-8"))
+    keyword_sets = golden["keywords"]
+
+    mismatches = sum(RULES.transform(sentence) != expected for sentence, expected in golden["sentences"])
+    mismatches += sum(RULES.compose(text, keywords) != expected
+                      for text, outputs in golden["chunks"] for keywords, expected in zip(keyword_sets, outputs))
+
+    rows = []
+    for name, calls in [
+        ("transform", [(RULES.transform, (sentence,)) for sentence, _ in golden["sentences"]]),
+        ("compose", [(RULES.compose, (text, keywords)) for text, _ in golden["chunks"] for keywords in keyword_sets]),
+    ]:
+        per_call = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            for fn, fn_args in calls:
+                fn(*fn_args)
+            per_call.append((time.perf_counter() - t0) * 1e6 / len(calls))
+        rows.append({"rule": name, "calls": len(calls), "us_per_call": statistics.median(per_call)})
+
+    print(f"golden cases={len(golden['sentences']) + len(golden['chunks']) * len(keyword_sets)} mismatches={mismatches}")
+    print(f"{'rule':>10} {'calls':>7} {'us/call':>9}")
+    for row in rows:
+        print(f"{row['rule']:>10} {row['calls']:>7} {row['us_per_call']:>9.2f}")
+    if mismatches:
+        sys.exit(1)
+    return rows
+
+def shown_sources(hits: List[Dict], min_score: float, limit: int = 3) -> List[str]:
+    """Sources compose_sources() in app.py would show: best score per source, at least min_score, top `limit`"""
+    best: Dict[str, float] = {}
+    for hit in hits:
+        best.setdefault(hit["source"], hit["score"])
+    ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+    return [name for name, score in ranked if score >= min_score][:limit]
+
+def score_ranking(hits: List[Dict], expected: List[str], k: int) -> Tuple[float, float]:
+    """(recall@k, reciprocal rank) of the expected sources in one ranked hit list"""
+    sources = [hit["source"] for hit in hits[:k]]
+    recall = len(set(expected) & set(sources)) / len(expected)
+    rank = next((i for i, source in enumerate(sources, 1) if source in expected), None)
+    return recall, 1.0 / rank if rank else 0.0
+
+def _parse_backend(spec: str) -> Tuple[str, int]:
+    """'exact', 'pca:64', 'random:64', 'route:3' or 'shards:2' -> (kind, number)"""
+    kind, _, number = spec.partition(":")
+    if kind not in ("exact", "pca", "random", "route", "shards") or (kind != "exact") != bool(number):
+        raise argparse.ArgumentTypeError(f"Unknown backend {spec!r}")
+    return kind, int(number or 0)
+
+def run_eval(args) -> List[Dict]:
+    import rag_index
+    from rag_index import LocalRAG
+
+    labelled = json.loads(Path(args.queries_file).read_text(encoding="utf-8"))
+    queries = [item["query"] for item in labelled]
+    corpus = replicate_corpus(Path(args.data_dir), args.replicate) if args.replicate > 1 else Path(args.data_dir)
+    # Replicated files are named NNNN-<source>; score them as the source they copy
+    base = (lambda source: re.sub(r"^\d{4}-", "", source)) if args.replicate > 1 else (lambda source: source)
+    model = rag_index.TextEmbedding(model_name=args.model)
+    rows = []
+    try:
+        query_vecs = None
+        for chunk_size, overlap in itertools.product(args.chunk_sizes, args.overlaps):
+            built: Dict[Tuple[str, int], Tuple[LocalRAG, float]] = {}
+            for kind, number in args.backends:
+                # route and shards query the exact index; only reductions need their own build
+                reduction = kind if kind in ("pca", "random") else None
+                key = (kind, number) if reduction else ("exact", 0)
+                if key not in built:
+                    t0 = time.perf_counter()
+                    rag = LocalRAG(data_dir=corpus, model_name=args.model, model=model, chunk_size=chunk_size,
+                                   chunk_overlap=overlap, reduced_dim=number if reduction else None,
+                                   reduction=reduction or "pca", rescore_candidates=args.candidates)
+                    built[key] = rag, time.perf_counter() - t0
+                rag, build_s = built[key]
+                if query_vecs is None:
+                    query_vecs = [rag.embed_query(q) for q in queries]
+                search_args = {"top_sources": number} if kind == "route" else {}
+                label = "exact" if kind == "exact" else f"{kind}:{number}"
+                if reduction and rag.reduced is None:
+                    label += " (too few rows)"
+                for keyword_boost, field_boost in itertools.product(args.keyword_boosts, args.field_boosts):
+                    rag.keyword_boost, rag.field_boost = keyword_boost, field_boost
+                    if kind == "shards":
+                        rag.start_shards(number)  # shard processes take the boosts when they start
+                    try:
+                        _timed_search(rag, queries[:10], query_vecs[:10], args.k, **search_args)  # warm up
+                        ms = []
+                        for _ in range(args.repeat):
+                            results, batch_ms = _timed_search(rag, queries, query_vecs, args.k, **search_args)
+                            ms += batch_ms
+                    finally:
+                        rag.close_shards()
+                    results = [[dict(hit, source=base(hit["source"])) for hit in hits] for hits in results]
+                    scored = [score_ranking(hits, item["sources"], args.k) for hits, item in zip(results, labelled)]
+                    rows.append({
+                        "chunk_size": chunk_size,
+                        "overlap": overlap,
+                        "backend": label,
+                        "keyword_boost": keyword_boost,
+                        "field_boost": field_boost,
+                        "chunks": len(rag.store),
+                        "index_mb": rag.nbytes() / 1e6,
+                        "build_s": build_s,
+                        "recall": statistics.mean(recall for recall, _ in scored),
+                        "mrr": statistics.mean(rr for _, rr in scored),
+                        "shown": {min_score: statistics.mean(
+                            any(source in item["sources"] for source in shown_sources(hits, min_score))
+                            for hits, item in zip(results, labelled)) for min_score in args.min_scores},
+                        "p50_ms": statistics.median(ms),
+                        "p95_ms": statistics.quantiles(ms, n=20)[18] if len(ms) >= 20 else max(ms),
+                        "shipped": (chunk_size, overlap, label, keyword_boost, field_boost) == (600, 80, "exact", 0.1, 0.15),
+                    })
+    finally:
+        if corpus != Path(args.data_dir):
+            shutil.rmtree(corpus, ignore_errors=True)
+
+    print(f"queries={len(queries)} k={args.k} replicate={args.replicate} candidates={args.candidates}")
+    shown_cols = "".join(f" {'shown@' + format(m, 'g'):>10}" for m in args.min_scores)
+    print(f"  {'chunk':>5} {'overlap':>7} {'backend':>22} {'kw':>5} {'field':>5} {'chunks':>7} {'MB':>7} "
+          f"{'build s':>8} {'recall@k':>9} {'MRR':>6}{shown_cols} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in rows:
+        shown = "".join(f" {row['shown'][m]:>10.3f}" for m in args.min_scores)
+        print(f"{'*' if row['shipped'] else ' '} {row['chunk_size']:>5} {row['overlap']:>7} {row['backend']:>22} "
+              f"{row['keyword_boost']:>5g} {row['field_boost']:>5g} {row['chunks']:>7} {row['index_mb']:>7.2f} "
+              f"{row['build_s']:>8.2f} {row['recall']:>9.3f} {row['mrr']:>6.3f}{shown} {row['p50_ms']:>8.3f} "
+              f"{row['p95_ms']:>8.3f}")
+    return rows
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+def _float_list(value: str) -> List[float]:
+    return [float(v) for v in value.split(",") if v]
+
+def _backend_list(value: str) -> List[Tuple[str, int]]:
+    return [_parse_backend(v) for v in value.split(",") if v]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    reduce = sub.add_parser("reduce", help="Reduced-dimension first pass: speedup vs recall")
+    reduce.add_argument("--dims", type=_int_list, default=[32, 64, 128])
+    reduce.add_argument("--method", choices=["pca", "random"], default="pca")
+    reduce.add_argument("--candidates", type=int, default=100, help="Rows rescored in full dimension")
+    reduce.add_argument("--k", type=int, default=4)
+    reduce.add_argument("--queries", type=int, default=200)
+    reduce.add_argument("--replicate", type=int, default=1, help="Copy the corpus N times")
+    reduce.add_argument("--data-dir", default=str(DEFAULT_DATA))
+    reduce.add_argument("--stub", action="store_true", help="Use the stub embedder instead of the ONNX model")
+    reduce.set_defaults(run=run_reduce)
+
+    shards = sub.add_parser("shards", help="Scatter-gather scaling across shard processes")
+    shards.add_argument("--shards", type=_int_list, default=[1, 2, 4])
+    shards.add_argument("--k", type=int, default=4)
+    shards.add_argument("--queries", type=int, default=200)
+    shards.add_argument("--replicate", type=int, default=1, help="Copy the corpus N times")
+    shards.add_argument("--data-dir", default=str(DEFAULT_DATA))
+    shards.add_argument("--stub", action="store_true", help="Use the stub embedder instead of the ONNX model")
+    shards.set_defaults(run=run_shards)
+
+    rules = sub.add_parser("rules", help="Bullet rule engine: golden output check and time per call")
+    rules.add_argument("--golden", default=str(GOLDEN_BULLETS))
+    rules.add_argument("--repeat", type=int, default=20)
+    rules.set_defaults(run=run_rules, stub=False)
+
+    evaluate = sub.add_parser("eval", help="Retrieval quality vs latency across chunking, boosts and backends")
+    evaluate.add_argument("--queries-file", default=str(EVAL_QUERIES), help="JSON list of {query, sources}")
+    evaluate.add_argument("--chunk-sizes", type=_int_list, default=[600])
+    evaluate.add_argument("--overlaps", type=_int_list, default=[80])
+    evaluate.add_argument("--keyword-boosts", type=_float_list, default=[0.1])
+    evaluate.add_argument("--field-boosts", type=_float_list, default=[0.15])
+    evaluate.add_argument("--min-scores", type=_float_list, default=[0.55], help="Source thresholds to report")
+    evaluate.add_argument("--backends", type=_backend_list, default=[("exact", 0)],
+                          help="exact, pca:DIM, random:DIM, route:TOP_SOURCES, shards:N")
+    evaluate.add_argument("--candidates", type=int, default=100, help="Rows rescored in full dimension")
+    evaluate.add_argument("--k", type=int, default=4)
+    evaluate.add_argument("--repeat", type=int, default=5, help="Timed passes over the queries")
+    evaluate.add_argument("--replicate", type=int, default=1, help="Copy the corpus N times")
+    evaluate.add_argument("--data-dir", default=str(DEFAULT_DATA))
+    evaluate.add_argument("--model", default=DEFAULT_MODEL)
+    evaluate.add_argument("--stub", action="store_true", help="Use the stub embedder instead of the ONNX model")
+    evaluate.set_defaults(run=run_eval)
+
+    args = parser.parse_args(argv)
+    if args.stub:
+        import stub_embedding
+        stub_embedding.install()
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
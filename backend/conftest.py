@@ -65,4 +65,11 @@ def mock_embedding_model():
         mock_instance = Mock()
         mock_instance.embed.return_value = iter([np.random.rand(384)])
         mock.return_value = mock_instance
-        yield mock_instance
\ No newline at end of file
+        yield mock_instance
+
+@pytest.fixture
+def embed(mock_embedding_model):
+    """Mock embedding model whose vectors are a fixed function of each text, so re-embedding reproduces them"""
+    mock_embedding_model.embed.side_effect = lambda docs: iter(
+        [np.random.default_rng(abs(hash(d)) % 2**32).random(384).astype(np.float32) for d in docs])
+    return mock_embedding_model
@@ -0,0 +1,59 @@
+"""
+Near-duplicate chunk detection at ingest.
+
+Each chunk becomes a set of hashed word 3-shingles. MinHash signatures with
+locality-sensitive banding propose candidate pairs without comparing every
+chunk to every other. Each candidate is then confirmed with the exact Jaccard
+similarity of the two shingle sets, so the outcome does not depend on hash
+luck. A chunk that reaches the threshold against an earlier kept chunk is
+collapsed into that chunk.
+"""
+import re, zlib
+from typing import List, Optional, Set
+import numpy as np
+
+NUM_PERM = 64
+SHINGLE_WORDS = 3
+# Prime just above 2**32: crc32 shingles (< 2**32) times coefficients (< 2**31) stay inside uint64
+_PRIME = np.uint64(4294967311)
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> Set[int]:
+    """crc32 hashes of the lowercased word `size`-grams in `text`"""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))}
+    return {zlib.crc32(" ".join(words[i:i + size]).encode("utf-8")) for i in range(len(words) - size + 1)}
+
+def jaccard(a: Set[int], b: Set[int]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def _band_rows(threshold: float, num_perm: int) -> int:
+    """Rows per LSH band: the widest band whose S-curve midpoint sits well below `threshold`"""
+    rows = 1
+    for r in range(1, num_perm + 1):
+        if num_perm % r == 0 and (r / num_perm) ** (1 / r) <= 0.8 * threshold:
+            rows = r
+    return rows
+
+def find_duplicates(texts: List[str], threshold: float, num_perm: int = NUM_PERM,
+                    seed: int = 1) -> List[Optional[int]]:
+    """For each text, the index of the earlier kept text it duplicates, or None if it is kept"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+    rows = _band_rows(threshold, num_perm)
+    bands = [dict() for _ in range(num_perm // rows)]
+
+    sets = [shingles(t) for t in texts]
+    duplicate_of: List[Optional[int]] = []
+    for i, shingle_set in enumerate(sets):
+        x = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set))
+        signature = ((np.outer(x, a) + b) % _PRIME).min(axis=0)
+        keys = [signature[j * rows:(j + 1) * rows].tobytes() for j in range(len(bands))]
+        candidates = sorted({c for band, key in zip(bands, keys) for c in band.get(key, ())})
+        rep = next((c for c in candidates if jaccard(shingle_set, sets[c]) >= threshold), None)
+        duplicate_of.append(rep)
+        if rep is None:  # only kept chunks can absorb later ones
+            for band, key in zip(bands, keys):
+                band.setdefault(key, []).append(i)
+    return duplicate_of
@@ -0,0 +1,111 @@
+"""
+Named collections of snippets, each served by its own LocalRAG.
+
+A collection is a directory of .md files under the collections root. Its
+index is built, or opened from its snapshot, on first use. Every collection
+is built through the same `build` callable, so they all share the one
+embedding model it closes over. Loaded indexes are kept in LRU order. When
+their combined size passes the memory budget, the least recently used ones
+are dropped until it fits again. The collection just loaded always stays.
+Requests hold a reference to the index they started with, so eviction never
+pulls an index out from under a running query.
+"""
+import json, re, threading, time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List
+
+COLLECTION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+class UnknownCollection(Exception):
+    """Raised for a collection name that is malformed or has no directory"""
+
+    def __init__(self, name: str):
+        super().__init__(f"Unknown collection {name!r}")
+        self.name = name
+
+class IndexManager:
+    """Lazily built per-collection indexes with LRU eviction under a byte budget"""
+
+    def __init__(self, root: Path, build: Callable[[str, Path], object], budget_bytes: int):
+        self.root = Path(root)
+        self.budget_bytes = budget_bytes
+        self._build = build
+        self._indexes: "OrderedDict[str, object]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._building: Dict[str, threading.Lock] = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def path(self, name: str) -> Path:
+        """Directory holding `name`'s snippets; UnknownCollection if there is none"""
+        if not COLLECTION_NAME.match(name):
+            raise UnknownCollection(name)
+        path = self.root / name
+        if not path.is_dir():
+            raise UnknownCollection(name)
+        return path
+
+    def get(self, name: str):
+        """The index for `name`, building it on first use (blocking; call from a worker thread)"""
+        with self._lock:
+            if name in self._indexes:
+                self._indexes.move_to_end(name)
+                return self._indexes[name]
+        path = self.path(name)
+        with self._lock:
+            build_lock = self._building.setdefault(name, threading.Lock())
+        # One build per collection; other requests for it wait here rather than building again
+        with build_lock:
+            with self._lock:
+                if name in self._indexes:
+                    self._indexes.move_to_end(name)
+                    return self._indexes[name]
+            start = time.time()
+            index = self._build(name, path)
+            size = index.nbytes()
+            with self._lock:
+                self._indexes[name] = index
+                self._sizes[name] = size
+                self.loads += 1
+                evicted = self._evict(keep=name)
+                self._building.pop(name, None)
+        print("COLLECTION_LOADED", json.dumps({
+            "collection": name,
+            "bytes": size,
+            "load_ms": int((time.time() - start) * 1000),
+            "evicted": evicted
+        }))
+        return index
+
+    def _evict(self, keep: str) -> List[str]:
+        """Drop least recently used indexes until the budget fits; caller holds the lock"""
+        evicted = []
+        while sum(self._sizes.values()) > self.budget_bytes and len(self._indexes) > 1:
+            name = next(n for n in self._indexes if n != keep)
+            index = self._indexes.pop(name)
+            del self._sizes[name]
+            index.close_shards()
+            evicted.append(name)
+            self.evictions += 1
+        return evicted
+
+    def clear(self):
+        """Forget every loaded collection so the next request rebuilds it from disk"""
+        with self._lock:
+            indexes = list(self._indexes.values())
+            self._indexes.clear()
+            self._sizes.clear()
+        for index in indexes:
+            index.close_shards()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "loaded": list(self._indexes),
+                "bytes": sum(self._sizes.values()),
+                "budget_bytes": self.budget_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,300 @@
+"""
+Concurrent SSE load generator for POST /chat.
+
+Opens many /chat streams at a configurable arrival rate and reports
+time-to-first-byte, time-to-first-bullet, time-to-[DONE], heartbeat gaps
+and error rate as histograms.
+
+By default it starts the app in-process on a local uvicorn server with the
+embedding model stubbed (see stub_embedding.py). Pass --url to target a
+server that is already running instead.
+
+Usage:
+    python loadgen.py --streams 2000 --rate 200
+    python loadgen.py --streams 500 --rate 50 --medical-ratio 0.2
+    python loadgen.py --url http://localhost:8000 --streams 100 --rate 10
+"""
+import argparse, asyncio, contextlib, json, os, random, socket, threading, time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import statistics
+import httpx
+
+# (query, weight) pairs for wellness questions
+WELLNESS_QUERIES = [
+    ("How can I sleep better?", 3),
+    ("Give me tips for managing stress at work", 2),
+    ("What should I eat for brain health?", 2),
+    ("How often should I do aerobic exercise?", 2),
+    ("How do I stay hydrated during the day?", 1),
+    ("Ways to build stronger social connections", 1),
+    ("How can I improve my focus and memory?", 1),
+]
+
+# Queries that trip is_medical_query() and take the redirect path
+MEDICAL_QUERIES = [
+    ("Can you diagnose my headache?", 1),
+    ("Do I have a heart condition?", 1),
+    ("What medication helps with insomnia?", 1),
+]
+
+# Histogram bucket upper bounds in milliseconds
+BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+@dataclass
+class StreamResult:
+    """Timings for a single /chat stream, all in ms from request send"""
+    query_kind: str
+    ok: bool = False
+    status: Optional[int] = None
+    error: Optional[str] = None
+    ttfb_ms: Optional[float] = None
+    first_bullet_ms: Optional[float] = None
+    done_ms: Optional[float] = None
+    heartbeat_gaps_ms: List[float] = field(default_factory=list)
+    max_frame_gap_ms: Optional[float] = None
+    frames: int = 0
+
+class Histogram:
+    """Fixed-bucket latency histogram with percentile summary"""
+
+    def __init__(self, name: str, buckets: List[float] = BUCKETS_MS):
+        self.name = name
+        self.buckets = buckets
+        self.values: List[float] = []
+
+    def add(self, value: Optional[float]):
+        if value is not None:
+            self.values.append(value)
+
+    def counts(self) -> List[int]:
+        counts = [0] * (len(self.buckets) + 1)
+        for v in self.values:
+            for i, upper in enumerate(self.buckets):
+                if v <= upper:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+        return counts
+
+    def percentiles(self) -> Dict[str, float]:
+        if not self.values:
+            return {"p50": 0, "p95": 0, "p99": 0, "max": 0}
+        if len(self.values) >= 100:
+            q = statistics.quantiles(self.values, n=100)
+            p95, p99 = q[94], q[98]
+        else:
+            ordered = sorted(self.values)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+        return {"p50": statistics.median(self.values), "p95": p95, "p99": p99, "max": max(self.values)}
+
+    def render(self, width: int = 40) -> str:
+        counts = self.counts()
+        pct = self.percentiles()
+        lines = [f"{self.name} (n={len(self.values)}) "
+                 f"p50={pct['p50']:.1f}ms p95={pct['p95']:.1f}ms p99={pct['p99']:.1f}ms max={pct['max']:.1f}ms"]
+        if not self.values:
+            return lines[0]
+        peak = max(counts)
+        labels = [f"<= {b}ms" for b in self.buckets] + [f">  {self.buckets[-1]}ms"]
+        for label, count in zip(labels, counts):
+            if count == 0:
+                continue
+            bar = "#" * max(1, int(width * count / peak))
+            lines.append(f"  {label:>12} {count:>7} {bar}")
+        return "\n".join(lines)
+
+def build_query_mix(medical_ratio: float) -> List[Tuple[str, str, float]]:
+    """Flatten wellness/medical queries into (kind, query, weight) with the requested medical share"""
+    mix = []
+    wellness_total = sum(w for _, w in WELLNESS_QUERIES)
+    medical_total = sum(w for _, w in MEDICAL_QUERIES)
+    for query, weight in WELLNESS_QUERIES:
+        mix.append(("wellness", query, (1 - medical_ratio) * weight / wellness_total))
+    for query, weight in MEDICAL_QUERIES:
+        mix.append(("medical", query, medical_ratio * weight / medical_total))
+    return [m for m in mix if m[2] > 0]
+
+def load_query_mix(path: str) -> List[Tuple[str, str, float]]:
+    """Read a JSON list of {"query", "weight", "kind"} objects"""
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    return [(e.get("kind", "wellness"), e["query"], float(e.get("weight", 1))) for e in entries]
+
+async def run_stream(client: httpx.AsyncClient, url: str, query: str, kind: str, timeout: float) -> StreamResult:
+    """Open one /chat stream and record frame timings until [DONE]"""
+    result = StreamResult(query_kind=kind)
+    start = time.perf_counter()
+    last_frame = None
+    last_heartbeat = start
+    max_gap = 0.0
+    try:
+        async with client.stream("POST", url, json={"message": query}, timeout=timeout) as response:
+            result.status = response.status_code
+            if response.status_code != 200:
+                result.error = f"HTTP {response.status_code}"
+                return result
+            async for line in response.aiter_lines():
+                now = time.perf_counter()
+                if not line:
+                    continue
+                if result.ttfb_ms is None:
+                    result.ttfb_ms = (now - start) * 1000
+                if last_frame is not None:
+                    max_gap = max(max_gap, now - last_frame)
+                last_frame = now
+                result.frames += 1
+
+                if line.startswith(":"):
+                    result.heartbeat_gaps_ms.append((now - last_heartbeat) * 1000)
+                    last_heartbeat = now
+                    continue
+                if not line.startswith("data: "):
+                    continue
+                payload = line[6:]
+                if payload == "[DONE]":
+                    result.done_ms = (now - start) * 1000
+                    result.ok = True
+                    break
+                if result.first_bullet_ms is None and '"bullet_index"' in payload:
+                    result.first_bullet_ms = (now - start) * 1000
+            if not result.ok and result.error is None:
+                result.error = "stream ended without [DONE]"
+    except Exception as e:
+        result.error = type(e).__name__
+    result.max_frame_gap_ms = max_gap * 1000 if last_frame is not None else None
+    return result
+
+async def generate_load(base_url: str, streams: int, rate: float, mix: List[Tuple[str, str, float]],
+                        timeout: float = 120.0, seed: Optional[int] = None) -> Tuple[List[StreamResult], float]:
+    """Launch streams as a Poisson process at `rate` per second and wait for them all"""
+    rng = random.Random(seed)
+    kinds = [m[0] for m in mix]
+    queries = [m[1] for m in mix]
+    weights = [m[2] for m in mix]
+    url = base_url.rstrip("/") + "/chat"
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        tasks = []
+        started = time.perf_counter()
+        for _ in range(streams):
+            i = rng.choices(range(len(mix)), weights=weights)[0]
+            tasks.append(asyncio.create_task(run_stream(client, url, queries[i], kinds[i], timeout)))
+            if rate > 0:
+                await asyncio.sleep(rng.expovariate(rate))
+        results = await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    return list(results), elapsed
+
+def summarize(results: List[StreamResult], elapsed: float) -> str:
+    """Render the histograms and error breakdown as a text report"""
+    ttfb = Histogram("time-to-first-byte")
+    first_bullet = Histogram("time-to-first-bullet")
+    done = Histogram("time-to-[DONE]")
+    heartbeat = Histogram("heartbeat gap")
+    frame_gap = Histogram("max frame gap")
+    errors: Dict[str, int] = {}
+    for r in results:
+        ttfb.add(r.ttfb_ms)
+        first_bullet.add(r.first_bullet_ms)
+        done.add(r.done_ms)
+        frame_gap.add(r.max_frame_gap_ms)
+        for gap in r.heartbeat_gaps_ms:
+            heartbeat.add(gap)
+        if not r.ok:
+            errors[r.error or "unknown"] = errors.get(r.error or "unknown", 0) + 1
+
+    total = len(results)
+    failed = sum(errors.values())
+    by_kind: Dict[str, int] = {}
+    for r in results:
+        by_kind[r.query_kind] = by_kind.get(r.query_kind, 0) + 1
+
+    lines = [
+        f"streams={total} elapsed={elapsed:.1f}s throughput={total / elapsed if elapsed else 0:.1f} streams/s",
+        "query mix: " + ", ".join(f"{k}={v}" for k, v in sorted(by_kind.items())),
+        f"error rate: {failed}/{total} ({100 * failed / total if total else 0:.2f}%)",
+    ]
+    for name, count in sorted(errors.items(), key=lambda kv: -kv[1]):
+        lines.append(f"  {name}: {count}")
+    for hist in (ttfb, first_bullet, done, heartbeat, frame_gap):
+        lines.append("")
+        lines.append(hist.render())
+    return "\n".join(lines)
+
+def _raise_fd_limit():
+    """Each stream needs a client and a server socket; lift the soft fd limit to the hard limit"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_local_server(port: int, stub_model: bool = True):
+    """Run the app on a uvicorn server in a background thread and wait until it accepts connections"""
+    if stub_model:
+        import stub_embedding
+        stub_embedding.install()
+    import uvicorn
+    from app import app
+
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                            backlog=4096, timeout_keep_alive=30)
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn server failed to start")
+        time.sleep(0.05)
+    return server, thread
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent SSE load generator for /chat")
+    parser.add_argument("--url", help="Target an already running server instead of starting one in-process")
+    parser.add_argument("--streams", type=int, default=1000, help="Total number of /chat streams to open")
+    parser.add_argument("--rate", type=float, default=100.0, help="Mean arrival rate in streams/s (0 = all at once)")
+    parser.add_argument("--medical-ratio", type=float, default=0.1, help="Share of queries taking the medical redirect path")
+    parser.add_argument("--mix", help="JSON file with [{query, weight, kind}] overriding the built-in mix")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-stream timeout in seconds")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for arrivals and query choice")
+    parser.add_argument("--real-model", action="store_true", help="Load the real embedding model in-process instead of the stub")
+    parser.add_argument("--show-server-logs", action="store_true", help="Keep the app's per-request log lines")
+    args = parser.parse_args(argv)
+
+    mix = load_query_mix(args.mix) if args.mix else build_query_mix(args.medical_ratio)
+    _raise_fd_limit()
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        port = _free_port()
+        server, _ = start_local_server(port, stub_model=not args.real_model)
+        base_url = f"http://127.0.0.1:{port}"
+
+    # The in-process app prints REQUEST_START/COMPLETE per stream; mute it while measuring
+    quiet = server is not None and not args.show_server_logs
+    with open(os.devnull, "w") as devnull, \
+            (contextlib.redirect_stdout(devnull) if quiet else contextlib.nullcontext()):
+        results, elapsed = asyncio.run(
+            generate_load(base_url, args.streams, args.rate, mix, timeout=args.timeout, seed=args.seed)
+        )
+
+    print(f"target={base_url} streams={args.streams} rate={args.rate}/s")
+    print(summarize(results, elapsed))
+
+    if server is not None:
+        server.should_exit = True
+
+if __name__ == "__main__":
+    main()
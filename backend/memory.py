@@ -0,0 +1,245 @@
+"""
+Memory accounting for /debug/memory, plus a footprint projection CLI.
+
+index_bytes() breaks a LocalRAG down by component. Components mapped from a
+snapshot are flagged "mapped". They live in the page cache, are shared by
+every worker mapping the same snapshot, and only count toward a process's RSS
+(as RssFile) once their pages are touched. Everything else is private heap.
+process_memory() reads RSS and its anonymous/file split from /proc.
+
+AllocationTracker wraps tracemalloc. Tracing slows every allocation, so it
+starts only when first asked for a diff. Each later call returns the top-N
+allocation sites by growth since the previous call, until stop().
+
+Run as a script to project the footprint of a corpus before deploying:
+
+    python memory.py --chunks 200000 --dtype float16 --workers 4 --snapshot
+
+Per-chunk text, column, term index and metadata sizes are measured by
+chunking --data-dir (no model is loaded). Embeddings, centroids and
+query scratch are computed from the dimension and dtype.
+"""
+import argparse, os, re, resource, sys, threading, tracemalloc
+from collections import deque
+from pathlib import Path
+from typing import Dict, Optional
+import numpy as np
+
+DEFAULT_DATA = Path(__file__).resolve().parents[1] / "data" / "snippets"
+
+# Per scored row while a query runs: float32 cosine, float64 score, two int64 match counts, two float64 bonuses
+SCRATCH_BYTES_PER_ROW = 4 + 8 + 2 * 8 + 2 * 8
+
+_STATUS_FIELDS = {"VmRSS": "rss", "VmHWM": "peak_rss", "RssAnon": "rss_anon", "RssFile": "rss_file",
+                  "RssShmem": "rss_shmem"}
+
+def _mapped(obj) -> bool:
+    return isinstance(obj, np.memmap) or not isinstance(obj, (bytes, np.ndarray))
+
+def _component(*parts) -> Dict:
+    """Combined size of arrays and byte buffers; mapped only if every part is"""
+    return {
+        "bytes": int(sum(p.nbytes if isinstance(p, np.ndarray) else len(p) for p in parts)),
+        "mapped": bool(parts) and all(_mapped(p) for p in parts)
+    }
+
+def index_bytes(rag) -> Dict[str, Dict]:
+    """Bytes per LocalRAG component, each with whether it is mapped from a snapshot"""
+    store = rag.store
+    components = {
+        "texts": _component(store.buf),
+        "chunk_columns": _component(*(getattr(store, name) for name in store._ARRAYS)),
+        "sources": {"bytes": deep_sizeof(store.sources), "mapped": False},
+        "metadata": _component(rag.metadata.codes),
+        "metadata_aliases": _component(rag.metadata.alias_rows, rag.metadata.alias_codes),
+        "embeddings": _component(rag.embs),
+        "has_field": _component(rag.has_field),
+        "centroids": _component(rag.centroids),
+    }
+    if store.term_index is not None:
+        index = store.term_index
+        components["term_index"] = _component(index.vocab, index.vocab_offsets, index.postings_ptr, index.postings)
+    if rag.reduced is not None:
+        components["reduced"] = _component(rag.reduced, rag.projection, rag.proj_mean)
+    components["total"] = {
+        "bytes": sum(c["bytes"] for c in components.values()),
+        "mapped_bytes": sum(c["bytes"] for c in components.values() if c["mapped"])
+    }
+    return components
+
+def model_file_bytes(model) -> Optional[int]:
+    """Size of the ONNX files behind a fastembed TextEmbedding; None when there are none (e.g. a stub)"""
+    model_dir = getattr(getattr(model, "model", None), "_model_dir", None)
+    if not isinstance(model_dir, (str, os.PathLike)):
+        return None
+    return sum(p.stat().st_size for p in Path(model_dir).rglob("*.onnx"))
+
+def deep_sizeof(obj, _seen=None) -> int:
+    """Approximate bytes of a Python object and everything it holds (arrays by nbytes)"""
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (0 if obj.base is not None else obj.nbytes)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+def process_memory() -> Dict[str, int]:
+    """RSS, peak RSS and the anonymous/file/shmem split of RSS, in bytes"""
+    try:
+        with open("/proc/self/status") as f:
+            status = f.read()
+    except OSError:
+        # No procfs (e.g. macOS): only the peak is available, and ru_maxrss is bytes there
+        return {"peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    report = {}
+    for field, name in _STATUS_FIELDS.items():
+        match = re.search(rf"^{field}:\s+(\d+) kB", status, re.MULTILINE)
+        if match:
+            report[name] = int(match.group(1)) * 1024
+    return report
+
+class AllocationTracker:
+    """tracemalloc top-N growth between successive calls"""
+
+    def __init__(self, frames: int = 1):
+        self.frames = frames
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def diff(self, top: int) -> Dict:
+        """Top `top` allocation sites by growth since the last call; the first call only starts tracing"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self._previous = None
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__),))
+            previous, self._previous = self._previous, snapshot
+        traced, peak = tracemalloc.get_traced_memory()
+        report = {"tracing": True, "traced_bytes": traced, "traced_peak_bytes": peak, "top": []}
+        if previous is None:
+            report["baseline"] = True
+            return report
+        for stat in snapshot.compare_to(previous, "lineno")[:top]:
+            frame = stat.traceback[0]
+            report["top"].append({
+                "location": f"{frame.filename}:{frame.lineno}",
+                "size_diff": stat.size_diff,
+                "count_diff": stat.count_diff,
+                "size": stat.size
+            })
+        return report
+
+    def stop(self):
+        with self._lock:
+            self._previous = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+def calibrate(data_dir: Path, chunk_size: int = 600, chunk_overlap: int = 80) -> Dict[str, float]:
+    """Measured per-chunk bytes of text, columns, postings and metadata, the vocabulary's total, and chunks per file"""
+    from rag_index import ChunkStore, MetadataIndex, TermIndex, _chunk, _parse_metadata
+
+    records, row_meta, raw_bytes = [], [], 0
+    files = sorted(Path(data_dir).glob("*.md"))
+    for fp in files:
+        raw = fp.read_text(encoding="utf-8")
+        raw_bytes += len(raw.encode("utf-8"))
+        meta, body = _parse_metadata(fp.name, raw)
+        for idx, ch in enumerate(_chunk(body, chunk_size, chunk_overlap)):
+            records.append((fp.name, idx, ch))
+            row_meta.append(meta)
+    if not records:
+        raise ValueError(f"No .md files to calibrate on in {data_dir}")
+    store = ChunkStore(records)
+    index = TermIndex.build(store.text(i) for i in range(len(store)))
+    n = len(store)
+    return {
+        "texts": len(store.buf) / n,
+        "chunk_columns": sum(getattr(store, name).nbytes for name in store._ARRAYS) / n,
+        "postings": index.postings.nbytes / n,
+        "vocab_total": len(index.vocab) + index.vocab_offsets.nbytes + index.postings_ptr.nbytes,
+        "metadata": MetadataIndex.build(row_meta).codes.nbytes / n,
+        "chunks": n,
+        "per_source": deep_sizeof(store.sources) / len(store.sources),
+        "chunks_per_source": n / len(files),
+        "chunks_per_mb": n / (raw_bytes / 1e6),
+    }
+
+def project_footprint(chunks: int, per_chunk: Dict[str, float], dim: int = 384, dtype: str = "float32",
+                      reduced_dim: int = 0, model_bytes: int = 0, workers: int = 1, snapshot: bool = False,
+                      concurrency: int = 8) -> Dict[str, Dict]:
+    """Projected bytes per component: one copy's size and how many copies the deployment holds.
+
+    The model, source names, centroids and query scratch are private to each worker. Index arrays are one
+    copy mapped by every worker with a `snapshot` (INDEX_DIR), otherwise one per worker; the
+    term index only exists in a snapshot. Its vocabulary is scaled by the square root of the
+    corpus growth (Heaps' law), its postings linearly.
+    """
+    itemsize = np.dtype(dtype).itemsize
+    sources = max(1, round(chunks / per_chunk["chunks_per_source"]))
+    index_copies = 1 if snapshot else workers
+    components = {
+        "model": (model_bytes, workers),
+        "embeddings": (chunks * dim * itemsize, index_copies),
+        "texts": (chunks * per_chunk["texts"], index_copies),
+        "chunk_columns": (chunks * per_chunk["chunk_columns"], index_copies),
+        "term_index": (chunks * per_chunk["postings"] + per_chunk["vocab_total"] * (chunks / per_chunk["chunks"]) ** 0.5
+                       if snapshot else 0, index_copies),
+        "metadata": (chunks * (per_chunk["metadata"] + 1), index_copies),  # + one has_field byte per row
+        "sources": (sources * per_chunk["per_source"], workers),
+        "centroids": (sources * dim * itemsize, workers),
+        "query_scratch": (chunks * SCRATCH_BYTES_PER_ROW * concurrency, workers),
+    }
+    if reduced_dim:
+        components["reduced"] = (chunks * reduced_dim * 4 + dim * reduced_dim * 4, index_copies)
+    report = {name: {"bytes": int(size), "copies": copies, "total": int(size * copies)}
+              for name, (size, copies) in components.items()}
+    report["total"] = {"bytes": sum(c["bytes"] for c in report.values()), "copies": None,
+                       "total": sum(c["total"] for c in report.values())}
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Project the memory footprint of an index before deploying")
+    parser.add_argument("--chunks", type=int, help="Chunks in the target corpus")
+    parser.add_argument("--corpus-mb", type=float, help="Markdown MB in the target corpus (instead of --chunks)")
+    parser.add_argument("--dim", type=int, default=384, help="Embedding width")
+    parser.add_argument("--dtype", choices=["float32", "float16", "int8"], default="float32",
+                        help="Embedding storage type")
+    parser.add_argument("--reduced-dim", type=int, default=0, help="REDUCED_DIM first-pass width (0 = none)")
+    parser.add_argument("--model-mb", type=float, default=90.0, help="Resident size of one loaded model")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--snapshot", action="store_true", help="Workers map one INDEX_DIR snapshot")
+    parser.add_argument("--concurrency", type=int, default=8, help="RETRIEVAL_CONCURRENCY per worker")
+    parser.add_argument("--chunk-size", type=int, default=600)
+    parser.add_argument("--chunk-overlap", type=int, default=80)
+    parser.add_argument("--data-dir", default=str(DEFAULT_DATA), help="Sample corpus to measure per-chunk sizes on")
+    args = parser.parse_args(argv)
+
+    per_chunk = calibrate(Path(args.data_dir), args.chunk_size, args.chunk_overlap)
+    if args.chunks:
+        chunks = args.chunks
+    elif args.corpus_mb:
+        chunks = round(args.corpus_mb * per_chunk["chunks_per_mb"])
+    else:
+        chunks = per_chunk["chunks"]
+    report = project_footprint(chunks, per_chunk, dim=args.dim, dtype=args.dtype, reduced_dim=args.reduced_dim,
+                               model_bytes=int(args.model_mb * 1e6), workers=args.workers, snapshot=args.snapshot,
+                               concurrency=args.concurrency)
+
+    print(f"chunks={chunks} dim={args.dim} dtype={args.dtype} workers={args.workers} "
+          f"index={'shared snapshot' if args.snapshot else 'per worker'}")
+    print(f"{'component':>14} {'MB each':>10} {'copies':>7} {'MB total':>10}")
+    for name, row in report.items():
+        copies = "" if row["copies"] is None else row["copies"]
+        print(f"{name:>14} {row['bytes'] / 1e6:>10.2f} {copies:>7} {row['total'] / 1e6:>10.2f}")
+    return report
+
+if __name__ == "__main__":
+    main()
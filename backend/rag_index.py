@@ -1,8 +1,9 @@
-import os, glob, re
-from typing import List, Dict
+import os, glob, re, json, mmap, hashlib, shutil, tempfile, time
+from typing import List, Dict, Tuple, Optional, Sequence
 from pathlib import Path
 import numpy as np
 from fastembed import TextEmbedding
+from dedup import find_duplicates
 
 def _chunk(text: str, size=600, overlap=80):
     text = re.sub(r"\s+", " ", text).strip()
@@ -13,121 +14,715 @@ def _chunk(text: str, size=600, overlap=80):
         i += size - overlap
     return chunks
 
+# The only non-ASCII characters whose str.lower() contains ASCII (U+0130 -> "i\u0307", KELVIN SIGN -> "k")
+_FOLDS_TO_ASCII = ("\u0130", "\u212a")
+
+# Bump when the on-disk snapshot layout changes
+SNAPSHOT_VERSION = 4
+
+_TITLE = re.compile(r"^Title:[ \t]*(.*?)[ \t]*$", re.MULTILINE)
+
+def _parse_metadata(name: str, raw: str) -> Tuple[Dict[str, str], str]:
+    """Metadata for one snippet file and its text with any front matter removed.
+
+    `category` is the filename prefix before the first "-" and `title` the first
+    "Title:" line. A leading block of "key: value" lines fenced by "---" adds
+    arbitrary keys (lowercased), overriding those two, and is not indexed as text.
+    """
+    meta = {"category": Path(name).stem.split("-", 1)[0]}
+    lines = raw.split("\n")
+    if lines and lines[0].strip() == "---" and "---" in (line.strip() for line in lines[1:]):
+        end = next(i for i in range(1, len(lines)) if lines[i].strip() == "---")
+        front = {}
+        for line in lines[1:end]:
+            key, sep, value = line.partition(":")
+            if sep and key.strip():
+                front[key.strip().lower()] = value.strip()
+        raw = "\n".join(lines[end + 1:])
+    else:
+        front = {}
+    title = _TITLE.search(raw)
+    if title:
+        meta["title"] = title.group(1)
+    meta.update(front)
+    return meta, raw
+
+def _map_file(path: Path):
+    """Read-only mmap of a file: pages load on first access and are shared between processes"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mapped, "madvise"):
+        mapped.madvise(mmap.MADV_RANDOM)  # hits are scattered; don't read ahead around them
+    return mapped
+
+class TermIndex:
+    """Lowercased token vocabulary with the rows each token occurs in.
+
+    A term without whitespace occurs in `text.lower()` exactly when it is a substring of
+    one of its whitespace-separated tokens, so keyword matching scans the vocabulary and
+    gathers postings instead of reading chunk text.
+    """
+
+    def __init__(self, vocab, vocab_offsets: np.ndarray, postings_ptr: np.ndarray, postings: np.ndarray):
+        self.vocab = vocab                  # newline-terminated UTF-8 tokens, sorted
+        self.vocab_offsets = vocab_offsets  # token i is vocab[vocab_offsets[i]:vocab_offsets[i + 1] - 1]
+        self.postings_ptr = postings_ptr    # rows of token i are postings[postings_ptr[i]:postings_ptr[i + 1]]
+        self.postings = postings
+
+    @classmethod
+    def build(cls, texts) -> "TermIndex":
+        rows_by_token: Dict[str, List[int]] = {}
+        for row, text in enumerate(texts):
+            for token in set(text.lower().split()):
+                rows_by_token.setdefault(token, []).append(row)
+        vocab = sorted(rows_by_token)
+        encoded = [token.encode("utf-8") + b"\n" for token in vocab]
+        vocab_offsets = np.concatenate([[0], np.cumsum([len(e) for e in encoded])]).astype(np.int64)
+        lengths = [len(rows_by_token[token]) for token in vocab]
+        postings_ptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        postings = np.array([row for token in vocab for row in rows_by_token[token]], dtype=np.int32)
+        return cls(b"".join(encoded), vocab_offsets, postings_ptr, postings)
+
+    def rows_containing(self, term: str) -> np.ndarray:
+        """Sorted unique rows whose lowercased text contains `term` (no whitespace allowed)"""
+        pattern = re.compile(re.escape(term.encode("utf-8")) + b"[^\n]*")
+        starts = np.fromiter((m.start() for m in pattern.finditer(self.vocab)), dtype=np.int64)
+        if len(starts) == 0:
+            return np.zeros(0, dtype=np.int32)
+        ids = np.searchsorted(self.vocab_offsets, starts, side="right") - 1
+        lo, hi = self.postings_ptr[ids], self.postings_ptr[ids + 1]
+        lengths = hi - lo
+        flat = np.repeat(lo - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+        return np.unique(self.postings[flat])
+
+class ChunkStore:
+    """Columnar chunk storage.
+
+    Source names are interned in `sources`; each chunk is a row in the `source_ids` and
+    `chunk_nos` arrays, and all chunk text lives in one UTF-8 buffer sliced by `offsets`.
+    Text is only decoded for rows that are returned. Chunks are separated by a newline,
+    which _chunk() never leaves inside a chunk, so substring matches cannot straddle rows.
+
+    `aliases` lists, per row, the (source, chunk) positions of near-duplicates collapsed
+    into it at ingest; they are kept as a CSR column (`alias_ptr` into `alias_source_ids`
+    and `alias_chunk_nos`). Sources that only occur as aliases are interned after the
+    others, so `source_ids` stays non-decreasing.
+
+    save() writes the columns plus a TermIndex to a directory; open() maps them back
+    read-only, so a snapshot-backed store only pages in the text of the rows it returns.
+    """
+
+    _ARRAYS = ("source_ids", "chunk_nos", "offsets", "non_ascii", "folds_to_ascii",
+               "alias_ptr", "alias_source_ids", "alias_chunk_nos")
+
+    def __init__(self, records: List[Tuple[str, int, str]],
+                 aliases: Optional[List[List[Tuple[str, int]]]] = None):
+        self.sources: List[str] = []
+        source_index: Dict[str, int] = {}
+
+        def intern(source: str) -> int:
+            if source not in source_index:
+                source_index[source] = len(self.sources)
+                self.sources.append(source)
+            return source_index[source]
+
+        source_ids, chunk_nos, offsets, parts, non_ascii, folds = [], [], [0], [], [], []
+        pos = 0
+        for source, chunk_no, text in records:
+            source_ids.append(intern(source))
+            chunk_nos.append(chunk_no)
+            non_ascii.append(not text.isascii())
+            folds.append(any(ch in text for ch in _FOLDS_TO_ASCII))
+            data = text.encode("utf-8") + b"\n"
+            parts.append(data)
+            pos += len(data)
+            offsets.append(pos)
+        self.source_ids = np.array(source_ids, dtype=np.int32)
+        self.chunk_nos = np.array(chunk_nos, dtype=np.int32)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.non_ascii = np.array(non_ascii, dtype=bool)
+        self.folds_to_ascii = np.array(folds, dtype=bool)
+        self.buf = b"".join(parts)
+        self.term_index: Optional[TermIndex] = None
+
+        aliases = aliases or [[] for _ in records]
+        self.alias_ptr = np.concatenate([[0], np.cumsum([len(a) for a in aliases])]).astype(np.int64)
+        self.alias_source_ids = np.array([intern(src) for row in aliases for src, _ in row], dtype=np.int32)
+        self.alias_chunk_nos = np.array([no for row in aliases for _, no in row], dtype=np.int32)
+
+    def save(self, path: Path):
+        """Write the columns, text blob and term index as files open() can map"""
+        path.mkdir(parents=True, exist_ok=True)
+        (path / "texts.bin").write_bytes(self.buf)
+        (path / "sources.json").write_text(json.dumps(self.sources), encoding="utf-8")
+        for name in self._ARRAYS:
+            np.save(path / f"{name}.npy", getattr(self, name))
+        index = TermIndex.build(self.text(i) for i in range(len(self)))
+        (path / "vocab.bin").write_bytes(index.vocab)
+        np.save(path / "vocab_offsets.npy", index.vocab_offsets)
+        np.save(path / "postings_ptr.npy", index.postings_ptr)
+        np.save(path / "postings.npy", index.postings)
+
+    @classmethod
+    def open(cls, path: Path) -> "ChunkStore":
+        """Map a saved store read-only; nothing but the source table is read eagerly"""
+        store = cls.__new__(cls)
+        store.sources = json.loads((path / "sources.json").read_text(encoding="utf-8"))
+        for name in cls._ARRAYS:
+            setattr(store, name, np.load(path / f"{name}.npy", mmap_mode="r"))
+        store.buf = _map_file(path / "texts.bin")
+        store.term_index = TermIndex(
+            _map_file(path / "vocab.bin"),
+            np.load(path / "vocab_offsets.npy", mmap_mode="r"),
+            np.load(path / "postings_ptr.npy", mmap_mode="r"),
+            np.load(path / "postings.npy", mmap_mode="r"),
+        )
+        return store
+
+    def __len__(self) -> int:
+        return len(self.source_ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of text, columns and term index (mapped or in memory)"""
+        total = len(self.buf) + sum(getattr(self, name).nbytes for name in self._ARRAYS)
+        if self.term_index is not None:
+            index = self.term_index
+            total += len(index.vocab) + index.vocab_offsets.nbytes + index.postings_ptr.nbytes + index.postings.nbytes
+        return total
+
+    def text(self, idx: int) -> str:
+        return self.buf[self.offsets[idx]:self.offsets[idx + 1] - 1].decode("utf-8")
+
+    def source(self, idx: int) -> str:
+        return self.sources[self.source_ids[idx]]
+
+    def aliases(self, idx: int) -> List[Tuple[str, int]]:
+        """(source, chunk) of every near-duplicate collapsed into row `idx`"""
+        lo, hi = self.alias_ptr[idx], self.alias_ptr[idx + 1]
+        return [(self.sources[s], int(c)) for s, c in zip(self.alias_source_ids[lo:hi], self.alias_chunk_nos[lo:hi])]
+
+    def match_counts(self, terms: List[str], start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        """Per-row count of `terms` found in the lowercased text of rows [start, end).
+
+        Stores opened from a snapshot answer whitespace-free terms from the TermIndex.
+        Otherwise the byte range is lowercased once; each ASCII term pattern also swallows
+        the rest of its row, so the regex yields at most one match per row and the row
+        lookup is a single searchsorted. Rows where str.lower() and the ASCII-only
+        bytes.lower() can disagree (or all non-ASCII rows, for non-ASCII terms) are
+        rechecked on decoded text.
+        """
+        end = len(self) if end is None else end
+        counts = np.zeros(max(end - start, 0), dtype=np.int64)
+        if end <= start or not terms:
+            return counts
+        if self.term_index is not None and all(t.split() == [t] for t in terms):
+            for term in set(terms):
+                rows = self.term_index.rows_containing(term)
+                rows = rows[(rows >= start) & (rows < end)]
+                counts[rows - start] += terms.count(term)
+            return counts
+        base = int(self.offsets[start])
+        low = self.buf[base:int(self.offsets[end])].lower()
+        rel = self.offsets[start:end + 1] - base
+        for term in set(t for t in terms if t.isascii()):
+            pattern = re.compile(re.escape(term.encode("ascii")) + b"[^\n]*")
+            starts = np.fromiter((m.start() for m in pattern.finditer(low)), dtype=np.int64)
+            counts[np.searchsorted(rel, starts, side="right") - 1] += terms.count(term)
+        recheck = self.folds_to_ascii if all(t.isascii() for t in terms) else self.non_ascii
+        for pos in np.flatnonzero(recheck[start:end]):
+            text = self.text(start + int(pos)).lower()
+            counts[pos] = sum(1 for t in terms if t in text)
+        return counts
+
+class MetadataIndex:
+    """Per-row value codes for each metadata field.
+
+    `codes[f, row]` is the position of the row's value in `values[f]`, or -1 when the
+    row's file has no such field. A `where` filter becomes one vectorized comparison per
+    field, giving a boolean row mask before anything is scored.
+
+    A row that near-duplicates were collapsed into also stands for their files. Each
+    collapsed file whose metadata differs from the row's own adds a column to
+    `alias_codes`, with `alias_rows` naming the row it belongs to, so a filter matching
+    only that file still keeps the row.
+    """
+
+    def __init__(self, fields: List[str], values: List[List[str]], codes: np.ndarray,
+                 alias_rows: Optional[np.ndarray] = None, alias_codes: Optional[np.ndarray] = None):
+        self.fields = fields
+        self.values = values
+        self.codes = codes
+        self.alias_rows = np.zeros(0, dtype=np.int32) if alias_rows is None else alias_rows
+        self.alias_codes = np.full((len(fields), 0), -1, dtype=np.int32) if alias_codes is None else alias_codes
+        self._field_index = {field: i for i, field in enumerate(fields)}
+        self._value_index = [{value: i for i, value in enumerate(vals)} for vals in values]
+
+    @classmethod
+    def build(cls, row_meta: List[Dict[str, str]],
+              alias_meta: Sequence[Tuple[int, Dict[str, str]]] = ()) -> "MetadataIndex":
+        """Index each row's metadata, plus the (row, metadata) of files collapsed into rows"""
+        alias_meta = [(row, meta) for row, meta in alias_meta if meta != row_meta[row]]
+        # One column per distinct alias metadata on a row
+        alias_meta = list({(row, tuple(sorted(meta.items()))): (row, meta) for row, meta in alias_meta}.values())
+        all_meta = row_meta + [meta for _, meta in alias_meta]
+        fields = sorted({field for meta in all_meta for field in meta})
+        values = [sorted({meta[field] for meta in all_meta if field in meta}) for field in fields]
+        lookup = [{value: i for i, value in enumerate(vals)} for vals in values]
+        codes = np.full((len(fields), len(all_meta)), -1, dtype=np.int32)
+        for col, meta in enumerate(all_meta):
+            for f, field in enumerate(fields):
+                if field in meta:
+                    codes[f, col] = lookup[f][meta[field]]
+        alias_rows = np.array([row for row, _ in alias_meta], dtype=np.int32)
+        return cls(fields, values, np.ascontiguousarray(codes[:, :len(row_meta)]), alias_rows,
+                   np.ascontiguousarray(codes[:, len(row_meta):]))
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.alias_rows.nbytes + self.alias_codes.nbytes
+
+    def save(self, path: Path):
+        (path / "metadata.json").write_text(json.dumps({"fields": self.fields, "values": self.values}),
+                                            encoding="utf-8")
+        np.save(path / "meta_codes.npy", self.codes)
+        np.save(path / "meta_alias_rows.npy", self.alias_rows)
+        np.save(path / "meta_alias_codes.npy", self.alias_codes)
+
+    @classmethod
+    def open(cls, path: Path) -> "MetadataIndex":
+        header = json.loads((path / "metadata.json").read_text(encoding="utf-8"))
+        return cls(header["fields"], header["values"], np.load(path / "meta_codes.npy", mmap_mode="r"),
+                   np.load(path / "meta_alias_rows.npy"), np.load(path / "meta_alias_codes.npy"))
+
+    def _match(self, codes: np.ndarray, where: Dict[str, object]) -> np.ndarray:
+        """Columns of `codes` matching every field in `where`"""
+        match = np.ones(codes.shape[1], dtype=bool)
+        for field, wanted in where.items():
+            f = self._field_index.get(field)
+            wanted = list(wanted) if isinstance(wanted, (list, tuple, set, frozenset)) else [wanted]
+            found = [] if f is None else [self._value_index[f][v] for v in wanted if v in self._value_index[f]]
+            if not found:
+                return np.zeros_like(match)
+            column = codes[f]
+            match &= column == found[0] if len(found) == 1 else np.isin(column, found)
+        return match
+
+    def mask(self, where: Dict[str, object]) -> np.ndarray:
+        """Rows whose own file or a file collapsed into them matches every field in `where`;
+        a list value matches any of its entries"""
+        mask = self._match(self.codes, where)
+        if len(self.alias_rows):
+            mask[self.alias_rows[self._match(self.alias_codes, where)]] = True
+        return mask
+
+class _TextColumn:
+    """Read-only list-like view over the chunk texts"""
+
+    def __init__(self, store: ChunkStore):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._store.text(i) for i in range(*idx.indices(len(self)))]
+        return self._store.text(int(idx))
+
+    def __iter__(self):
+        return (self._store.text(i) for i in range(len(self)))
+
+class _MetaColumn(_TextColumn):
+    """Read-only list-like view producing {"source", "chunk"} dicts on access"""
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = int(idx)
+        return {"source": self._store.source(idx), "chunk": int(self._store.chunk_nos[idx])}
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
 class LocalRAG:
-    def __init__(self, data_dir: str | os.PathLike, model_name="sentence-transformers/all-MiniLM-L6-v2"):
+    def __init__(self, data_dir: str | os.PathLike, model_name="sentence-transformers/all-MiniLM-L6-v2",
+                 threads: Optional[int] = None, index_dir: Optional[str | os.PathLike] = None,
+                 reduced_dim: Optional[int] = None, reduction: str = "pca", rescore_candidates: int = 100,
+                 dedup_threshold: Optional[float] = None, model: Optional[TextEmbedding] = None,
+                 chunk_size: int = 600, chunk_overlap: int = 80, keyword_boost: float = 0.1,
+                 field_boost: float = 0.15):
         self.data_dir = Path(data_dir)
-        self.model = TextEmbedding(model_name=model_name)
-        self.texts: List[str] = []
-        self.meta: List[Dict] = []
+        self.model_name = model_name
+        # chunk_size/chunk_overlap = characters per chunk and shared between neighbours (part of the snapshot);
+        # keyword_boost/field_boost = score added per keyword match and per query word in a Title/Key-ideas chunk
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError(f"chunk_overlap must be in [0, chunk_size); got {chunk_overlap} for {chunk_size}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.keyword_boost = keyword_boost
+        self.field_boost = field_boost
+        # dedup_threshold = shingle Jaccard at which chunks are collapsed before embedding (None = keep all)
+        self.dedup_threshold = dedup_threshold
+        self.dedup_stats: Dict = {}
+        # reduced_dim = width of the first-pass scan (None = exact full-dimension scan only);
+        # the best `rescore_candidates` first-pass rows are rescored in full dimension
+        if reduction not in ("pca", "random"):
+            raise ValueError(f"Unknown reduction {reduction!r}; expected 'pca' or 'random'")
+        self.reduced_dim = reduced_dim
+        self.reduction = reduction
+        self.rescore_candidates = rescore_candidates
+        self.shards = None  # ShardPool once start_shards() is called
+        # threads = ONNX intra-op threads for this worker's session (None = onnxruntime default);
+        # model = an already loaded embedding model to share, e.g. across collections
+        self.model = model if model is not None else TextEmbedding(model_name=model_name, threads=threads)
+        # index_dir = where snapshots live; None keeps everything in process memory
+        self.index_dir = Path(index_dir) if index_dir else None
+        if self.index_dir is not None and self._open_snapshot():
+            return
         self._load()
         self._build()
+        if self.index_dir is not None and len(self.store):
+            self._write_snapshot()
+            self._open_snapshot()  # drop the in-memory copy in favour of the shared mapping
+
+    @property
+    def texts(self) -> _TextColumn:
+        return _TextColumn(self.store)
+
+    @property
+    def meta(self) -> _MetaColumn:
+        return _MetaColumn(self.store)
 
     def _load(self):
+        records = []
+        file_meta: Dict[str, Dict[str, str]] = {}
         for fp in sorted(self.data_dir.glob("*.md")):
-            raw = fp.read_text(encoding="utf-8")
-            for idx, ch in enumerate(_chunk(raw)):
-                self.texts.append(ch)
-                self.meta.append({"source": fp.name, "chunk": idx})
+            file_meta[fp.name], raw = _parse_metadata(fp.name, fp.read_text(encoding="utf-8"))
+            for idx, ch in enumerate(_chunk(raw, self.chunk_size, self.chunk_overlap)):
+                records.append((fp.name, idx, ch))
+        total = len(records)
+        records, aliases = self._collapse_duplicates(records)
+        self.dedup_stats = {"chunks": total, "kept": len(records), "collapsed": total - len(records)}
+        self.store = ChunkStore(records, aliases)
+        self.metadata = MetadataIndex.build(
+            [file_meta[source] for source, _, _ in records],
+            [(row, file_meta[source]) for row, collapsed in enumerate(aliases or []) for source, _ in collapsed])
+        # Title/Key-ideas chunks get the field boost in search_enhanced
+        self.has_field = np.array(
+            [("title:" in ch.lower() or "key ideas:" in ch.lower()) for _, _, ch in records], dtype=bool
+        )
+
+    def _collapse_duplicates(self, records):
+        """Drop near-duplicate chunks, recording each dropped (source, chunk) on the chunk it matched"""
+        if not self.dedup_threshold or not records:
+            return records, None
+        duplicate_of = find_duplicates([text for _, _, text in records], self.dedup_threshold)
+        kept, aliases, row_of = [], [], {}
+        for i, (record, rep) in enumerate(zip(records, duplicate_of)):
+            if rep is None:
+                row_of[i] = len(kept)
+                kept.append(record)
+                aliases.append([])
+            else:
+                aliases[row_of[rep]].append(record[:2])
+        return kept, aliases
 
     def _build(self):
-        if not self.texts:
+        if len(self.store) == 0:
             print(f"Warning: No text files found in {self.data_dir}")
-            self.embs = np.array([]).reshape(0, 384)  # Empty array with correct dimensions
+            self.embs = np.zeros((0, self._model_dim()), dtype=np.float32)  # Empty array with the model's width
+            self._build_centroids()
+            self._fit_reduction()
             return
+        embed_start = time.perf_counter()
         embs = np.stack(list(self.model.embed(self.texts)))
+        embed_ms = (time.perf_counter() - embed_start) * 1000
+        self.dedup_stats["embed_ms"] = round(embed_ms, 1)
+        # Collapsed chunks would have cost about the same per chunk to embed
+        self.dedup_stats["embed_ms_saved"] = round(embed_ms / len(self.store) * self.dedup_stats.get("collapsed", 0), 1)
         self.embs = embs / (np.linalg.norm(embs, axis=1, keepdims=True) + 1e-12)
+        self._build_centroids()
+        self._fit_reduction()
+
+    def _model_dim(self) -> int:
+        """Embedding width as reported by the model itself (one probe embedding)"""
+        return len(next(iter(self.model.embed(["dimension probe"]))))
+
+    def _fit_reduction(self):
+        """Fit the first-pass projection on the chunk embeddings.
+
+        Rows are centered before projecting: e.q = (e - mean).q + mean.q, and the second
+        term is the same for every row, so the centered projection keeps the ranking.
+        PCA keeps the top principal directions; "random" is a Gaussian projection.
+        """
+        self.projection = self.proj_mean = self.reduced = None
+        n, dim = self.embs.shape
+        if not self.reduced_dim or self.reduced_dim >= dim or n <= max(self.reduced_dim, self.rescore_candidates):
+            return
+        mean = self.embs.mean(axis=0)
+        if self.reduction == "random":
+            rng = np.random.default_rng(0)
+            projection = rng.standard_normal((dim, self.reduced_dim)) / np.sqrt(self.reduced_dim)
+        else:
+            _, _, vt = np.linalg.svd(self.embs - mean, full_matrices=False)
+            projection = vt[:self.reduced_dim].T
+        self.projection = projection.astype(np.float32)
+        self.proj_mean = mean.astype(np.float32)
+        self.reduced = ((self.embs - mean) @ self.projection).astype(np.float32)
+
+    def _fingerprint(self) -> str:
+        """Identify a snapshot by layout version, model, chunking, reduction, dedup and the name/size/mtime of every source file"""
+        digest = hashlib.sha1(f"v{SNAPSHOT_VERSION}:{self.model_name}:{self.chunk_size}/{self.chunk_overlap}:"
+                              f"{self.reduction}:{self.reduced_dim}:{self.dedup_threshold}".encode())
+        for fp in sorted(self.data_dir.glob("*.md")):
+            st = fp.stat()
+            digest.update(f"{fp.name}:{st.st_size}:{st.st_mtime_ns}".encode())
+        return digest.hexdigest()[:16]
+
+    def _open_snapshot(self) -> bool:
+        """Map the snapshot matching the current data files, if one has been written"""
+        path = self.index_dir / self._fingerprint()
+        if not (path / "embs.npy").exists():
+            return False
+        self._map_snapshot(path)
+        return True
+
+    def _map_snapshot(self, path: Path):
+        self.store = ChunkStore.open(path)
+        if (path / "dedup.json").exists():
+            self.dedup_stats = json.loads((path / "dedup.json").read_text(encoding="utf-8"))
+        self.metadata = MetadataIndex.open(path)
+        self.has_field = np.load(path / "has_field.npy", mmap_mode="r")
+        self.embs = np.load(path / "embs.npy", mmap_mode="r")
+        self._build_centroids()
+        self.projection = self.proj_mean = self.reduced = None
+        if (path / "reduced.npy").exists():
+            self.projection = np.load(path / "projection.npy")
+            self.proj_mean = np.load(path / "proj_mean.npy")
+            self.reduced = np.load(path / "reduced.npy", mmap_mode="r")
+
+    @classmethod
+    def from_snapshot(cls, path: str | os.PathLike, rescore_candidates: int = 100, keyword_boost: float = 0.1,
+                      field_boost: float = 0.15) -> "LocalRAG":
+        """Query-only view of a snapshot with no model loaded; callers pass embedded queries"""
+        rag = cls.__new__(cls)
+        rag.model = None
+        rag.index_dir = None
+        rag.shards = None
+        rag.rescore_candidates = rescore_candidates
+        rag.keyword_boost = keyword_boost
+        rag.field_boost = field_boost
+        rag._map_snapshot(Path(path))
+        return rag
+
+    def _write_snapshot(self):
+        """Publish a snapshot atomically and prune older ones.
+
+        Files are written to a temp directory and renamed into place, so concurrent
+        workers either see a complete snapshot or none; the loser of a race discards its
+        copy. Processes still mapping a pruned snapshot keep their open files.
+        """
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        final = self.index_dir / self._fingerprint()
+        tmp = Path(tempfile.mkdtemp(prefix=".tmp-", dir=self.index_dir))
+        self.save_snapshot(tmp)
+        try:
+            os.rename(tmp, final)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+        for old in self.index_dir.iterdir():
+            # Only snapshots are pruned; other directories (e.g. collections/) may share index_dir
+            if old.name != final.name and not old.name.startswith(".tmp-") and (old / "embs.npy").exists():
+                shutil.rmtree(old, ignore_errors=True)
+
+    def save_snapshot(self, path: Path):
+        """Write every array the index needs to `path` in the layout _map_snapshot() reads"""
+        self.store.save(path)
+        (path / "dedup.json").write_text(json.dumps(self.dedup_stats), encoding="utf-8")
+        self.metadata.save(path)
+        np.save(path / "has_field.npy", self.has_field)
+        np.save(path / "embs.npy", self.embs)
+        if self.reduced is not None:
+            np.save(path / "projection.npy", self.projection)
+            np.save(path / "proj_mean.npy", self.proj_mean)
+            np.save(path / "reduced.npy", self.reduced)
+
+    def nbytes(self) -> int:
+        """Bytes held by the index arrays; mapped snapshots count in full, resident or not"""
+        total = (self.store.nbytes + self.metadata.nbytes + self.embs.nbytes + self.has_field.nbytes
+                 + self.centroids.nbytes)
+        if self.reduced is not None:
+            total += self.reduced.nbytes + self.projection.nbytes + self.proj_mean.nbytes
+        return total
+
+    def start_shards(self, n_shards: int):
+        """Score search_enhanced() across `n_shards` worker processes (see shards.py)"""
+        from shards import ShardPool
+        self.close_shards()
+        self.shards = ShardPool(self, n_shards)
+
+    def close_shards(self):
+        if self.shards is not None:
+            self.shards.close()
+            self.shards = None
+
+    def _build_centroids(self):
+        """Precompute one normalized centroid per source for intent routing.
+
+        Chunks are loaded file by file, so each source owns a contiguous row range.
+        """
+        self.sources: List[str] = self.store.sources
+        # Sources whose chunks were all collapsed into other files get an empty range
+        ids = np.arange(len(self.sources))
+        starts = np.searchsorted(self.store.source_ids, ids, side="left")
+        ends = np.searchsorted(self.store.source_ids, ids, side="right")
+        self.source_ranges: List[Tuple[int, int]] = [(int(a), int(b)) for a, b in zip(starts, ends)]
+        self.source_index = {name: i for i, name in enumerate(self.sources)}
+
+        dim = self.embs.shape[1]
+        centroids = np.zeros((len(self.sources), dim), dtype=self.embs.dtype)
+        for i, (start, end) in enumerate(self.source_ranges):
+            rows = self.embs[start:end]
+            if len(rows):
+                centroids[i] = rows.mean(axis=0)
+        self.centroids = centroids / (np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embed and normalize a query once so callers can reuse it across lookups"""
+        q = next(self.model.embed([query]))
+        return q / (np.linalg.norm(q) + 1e-12)
+
+    def route_intent(self, query_vec: np.ndarray, n: int = 1) -> List[Tuple[str, float]]:
+        """Rank sources by centroid similarity to an already-embedded query"""
+        if len(self.sources) == 0:
+            return []
+        sims = self.centroids @ query_vec
+        order = np.argsort(-sims)[:n]
+        return [(self.sources[i], float(sims[i])) for i in order]
+
+    def _candidate_rows(self, query_vec: np.ndarray, top_sources: Optional[int]) -> np.ndarray:
+        """Row indices to score: all chunks, or only those in the top-N routed sources"""
+        if not top_sources or top_sources >= len(self.sources):
+            return np.arange(len(self.store))
+        routed = sorted(self.source_index[name] for name, _ in self.route_intent(query_vec, top_sources))
+        return np.concatenate([np.arange(*self.source_ranges[i]) for i in routed])
+
+    def _hit(self, idx: int, score: float) -> Dict:
+        """Materialize one result row; the only place chunk text is decoded at query time"""
+        hit = {
+            "text": self.store.text(idx),
+            "source": self.store.source(idx),
+            "score": score
+        }
+        # Other files that carried this chunk before near-duplicates were collapsed
+        also_in = sorted({source for source, _ in self.store.aliases(idx)} - {hit["source"]})
+        if also_in:
+            hit["also_in"] = also_in
+        return hit
+
+    def _rank(self, rows: np.ndarray, q: np.ndarray, bonuses: List[np.ndarray], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Positions in `rows` of the k best cosine-plus-bonus scores, with those scores.
+
+        With a reduced index the cosine is first estimated in the projected space; only
+        the best max(k, `rescore_candidates`) positions are rescored exactly in full dimension.
+        Bonuses are exact either way, so only the cosine term is ever approximated.
+        """
+        full = len(rows) == len(self.store)  # rows are sorted and unique, so this is every row
+        if self.reduced is None or len(rows) <= max(k, self.rescore_candidates):
+            scores = ((self.embs if full else self.embs[rows]) @ q).astype(np.float64)
+            for bonus in bonuses:
+                scores += bonus
+            order = np.argsort(-scores, kind="stable")[:k]
+            return order, scores[order]
+        
+        reduced = self.reduced if full else self.reduced[rows]
+        approx = (reduced @ (q @ self.projection)).astype(np.float64) + float(self.proj_mean @ q)
+        for bonus in bonuses:
+            approx += bonus
+        # Rescore at least k rows so a k above rescore_candidates still gets k hits
+        n_cand = min(len(rows), max(k, self.rescore_candidates))
+        cand = np.sort(np.argpartition(-approx, n_cand - 1)[:n_cand])
+        scores = (self.embs[rows[cand]] @ q).astype(np.float64)
+        for bonus in bonuses:
+            scores += bonus[cand]
+        order = np.argsort(-scores, kind="stable")[:k]
+        return cand[order], scores[order]
 
     def search(self, query: str, k: int = 4):
-        if len(self.texts) == 0:
+        if len(self.store) == 0:
             return []
         q = next(self.model.embed([query]))
         q = q / (np.linalg.norm(q) + 1e-12)
+        if self.reduced is not None:
+            positions, scores = self._rank(np.arange(len(self.store)), q, [], k)
+            return [self._hit(int(idx), float(score)) for idx, score in zip(positions, scores)]
         sims = self.embs @ q  # cosine
         order = np.argsort(-sims)
 
         # Return top k results by relevance, not limited by source
-        out = []
-        for idx in order[:k]:
-            out.append({
-                "text": self.texts[idx],
-                "source": self.meta[idx]["source"],
-                "score": float(sims[idx])
-            })
-        return out
+        return [self._hit(int(idx), float(sims[idx])) for idx in order[:k]]
     
-    def search_enhanced(self, query: str, keywords: list, k: int = 4):
-        """Enhanced search with keyword overlap and field boosting"""
-        q = next(self.model.embed([query]))
-        q = q / (np.linalg.norm(q) + 1e-12)
-        cosine_sims = self.embs @ q
-        
-        # Calculate enhanced scores with keyword overlap and field boosting
-        enhanced_scores = []
-        query_lower = query.lower()
+    def search_enhanced(self, query: str, keywords: list, k: int = 4,
+                        query_vec: Optional[np.ndarray] = None, top_sources: Optional[int] = None,
+                        where: Optional[Dict[str, object]] = None):
+        """Enhanced search with keyword overlap and field boosting.
+
+        Pass `query_vec` from embed_query() to avoid re-embedding. With `top_sources`,
+        only chunks from the N sources whose centroids best match the query are scored.
+        `where` maps metadata fields (category, title, front-matter keys) to a value or
+        list of values; rows outside it are dropped before scoring, so k hits still come
+        back whenever k rows match. A row matches through its own file or any near-duplicate
+        collapsed into it (listed in the hit's "also_in").
+        """
+        if len(self.store) == 0:
+            return []
+        q = self.embed_query(query) if query_vec is None else query_vec
+        rows = self._candidate_rows(q, top_sources)
+        if where:
+            rows = rows[self.metadata.mask(where)[rows]]
+            if len(rows) == 0:
+                return []
+        if self.shards is not None:
+            hits, scores = self.shards.search(query, keywords, q, rows, k)
+        else:
+            hits, scores = self.score_rows(query, keywords, q, rows, k)
+        return [self._hit(int(idx), float(score)) for idx, score in zip(hits, scores)]
+
+    def score_rows(self, query: str, keywords: list, q: np.ndarray, rows: np.ndarray, k: int,
+                   lo: int = 0, hi: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """search_enhanced() scoring for sorted `rows` inside [lo, hi): top-k row ids and scores"""
+        hi = len(self.store) if hi is None else hi
+        if len(rows):  # only match keywords over the span the candidates cover (filters and routing shrink it)
+            lo, hi = max(lo, int(rows[0])), min(hi, int(rows[-1]) + 1)
+        local = rows - lo
         
-        for idx, text in enumerate(self.texts):
-            text_lower = text.lower()
-            
-            # Start with cosine similarity
-            score = float(cosine_sims[idx])
-            
-            # Add keyword overlap bonus (lightweight)
-            keyword_matches = sum(1 for kw in keywords if kw in text_lower)
-            if keyword_matches > 0:
-                score += 0.1 * keyword_matches  # 10% boost per keyword match
-            
-            # Extra boost if query hits Title/Key-ideas fields
-            lines = text.split('\n')
-            for line in lines[:3]:  # Check first 3 lines for title/key content
-                line_lower = line.lower()
-                if ('title:' in line_lower or 'key ideas:' in line_lower):
-                    # Check if any query words appear in these important fields
-                    query_words = query_lower.split()
-                    field_matches = sum(1 for word in query_words if word in line_lower)
-                    if field_matches > 0:
-                        score += 0.15 * field_matches  # 15% boost for title/key field matches
-                        break
-            
-            enhanced_scores.append((idx, score))
+        # Cosine similarity plus keyword overlap bonus (lightweight) - keyword_boost (0.1) per keyword match
+        bonuses = [self.keyword_boost * self.store.match_counts(keywords, lo, hi)[local]]
         
-        # Sort by enhanced score
-        enhanced_scores.sort(key=lambda x: x[1], reverse=True)
+        # Extra boost if query hits Title/Key-ideas fields - field_boost (0.15) per query word in the chunk
+        field_rows = self.has_field[rows]
+        if field_rows.any():
+            field_matches = self.store.match_counts(query.lower().split(), lo, hi)[local]
+            bonuses.append(self.field_boost * np.where(field_rows, field_matches, 0))
         
-        # Return top k results
-        out = []
-        for idx, score in enhanced_scores[:k]:
-            out.append({
-                "text": self.texts[idx],
-                "source": self.meta[idx]["source"],
-                "score": score
-            })
-        return out
+        # Sort by enhanced score (stable, so ties keep index order)
+        positions, scores = self._rank(rows, q, bonuses, k)
+        return rows[positions], scores
     
-    def get_best_from_source(self, query: str, keywords: list, source_name: str):
+    def get_best_from_source(self, query: str, keywords: list, source_name: str,
+                             query_vec: Optional[np.ndarray] = None):
         """Get the best matching chunk from a specific source"""
-        q = next(self.model.embed([query]))
-        q = q / (np.linalg.norm(q) + 1e-12)
-        
-        best_idx = -1
-        best_score = -1
-        
-        for idx, meta in enumerate(self.meta):
-            if meta["source"] == source_name:
-                score = float(self.embs[idx] @ q)
-                
-                # Add keyword bonus
-                text_lower = self.texts[idx].lower()
-                keyword_matches = sum(1 for kw in keywords if kw in text_lower)
-                score += 0.1 * keyword_matches
-                
-                if score > best_score:
-                    best_score = score
-                    best_idx = idx
+        if source_name not in self.source_index:
+            return None
+        q = self.embed_query(query) if query_vec is None else query_vec
+        start, end = self.source_ranges[self.source_index[source_name]]
+        if end <= start:
+            return None
         
-        if best_idx >= 0:
-            return {
-                "text": self.texts[best_idx],
-                "source": self.meta[best_idx]["source"],
-                "score": best_score
-            }
-        return None
+        # Cosine plus keyword bonus
+        positions, scores = self._rank(np.arange(start, end), q,
+                                       [self.keyword_boost * self.store.match_counts(keywords, start, end)], 1)
+        return self._hit(start + int(positions[0]), float(scores[0]))
@@ -0,0 +1,157 @@
+"""
+Sharded retrieval: scatter a query to N worker processes and merge their top-k.
+
+Each shard process maps the index snapshot read-only and scores one contiguous
+slice of rows, so the embeddings, text and term index live once in shared
+memory (the page cache, or /dev/shm for indexes built without INDEX_DIR) and
+every core works on its own slice. The parent embeds the query, fans it out,
+and merges the shards' local top-k lists by score, then row id. That is the
+same order as the stable sort in LocalRAG.search_enhanced.
+
+Shard boundaries are multiples of SHARD_ALIGN rows. BLAS then computes each
+row's dot product with the same kernel path as the single-process matmul, so
+the merged scores are identical, not just close. That holds for the exact
+scan only: with a reduced index each shard rescores its own best
+rescore_candidates rows, so the merged candidates are a superset of the
+single-process ones and results can differ (never by missing a row that
+in-process search would have rescored).
+
+Several queries can be in flight at once. Every message carries a request id,
+each shard answers in turn, and one reader thread per shard hands each reply to
+the query waiting on that id, so a query never waits for another's merge.
+"""
+import itertools, multiprocessing, os, shutil, tempfile, threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+SHARD_ALIGN = 64
+
+def shard_bounds(n_rows: int, n_shards: int) -> List[Tuple[int, int]]:
+    """Split [0, n_rows) into at most n_shards contiguous, SHARD_ALIGN-aligned ranges"""
+    blocks = -(-n_rows // SHARD_ALIGN)
+    n = max(1, min(n_shards, blocks))
+    cuts = [min(n_rows, (blocks * i // n) * SHARD_ALIGN) for i in range(n + 1)]
+    return [(lo, hi) for lo, hi in zip(cuts, cuts[1:]) if hi > lo]
+
+def _shard_main(path: str, lo: int, hi: int, rescore_candidates: int, boosts: Tuple[float, float], conn):
+    """Shard process: map the snapshot, then answer (request_id, query, keywords, q, rows, k) until None"""
+    from rag_index import LocalRAG
+
+    keyword_boost, field_boost = boosts
+    rag = LocalRAG.from_snapshot(path, rescore_candidates=rescore_candidates, keyword_boost=keyword_boost,
+                                 field_boost=field_boost)
+    own_rows = np.arange(lo, hi)
+    conn.send("ready")
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        request_id, query, keywords, q, rows, k = msg
+        try:
+            conn.send((request_id, rag.score_rows(query, keywords, q, own_rows if rows is None else rows, k, lo, hi)))
+        except Exception as e:
+            conn.send((request_id, e))
+    conn.close()
+
+class ShardPool:
+    """Worker processes that each own a row slice of one LocalRAG snapshot"""
+
+    def __init__(self, rag, n_shards: int):
+        self._tmp: Optional[Path] = None
+        if rag.index_dir is not None:
+            path = rag.index_dir / rag._fingerprint()
+        else:
+            # No snapshot on disk: write one to tmpfs so shards still share one copy
+            shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+            self._tmp = Path(tempfile.mkdtemp(prefix="mindr-shards-", dir=shm))
+            rag.save_snapshot(self._tmp)
+            path = self._tmp
+        self.n_rows = len(rag.store)
+        self.bounds = shard_bounds(self.n_rows, n_shards)
+        self._lock = threading.Lock()  # guards sends and shutdown
+        # Readers never take _lock: a send blocked on a full pipe must not stall the reply that frees it
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pending: List[Dict[int, Future]] = [{} for _ in self.bounds]
+        self._conns, self._procs, self._readers = [], [], []
+        ctx = multiprocessing.get_context("spawn")  # never fork a process holding ONNX/BLAS threads
+        for lo, hi in self.bounds:
+            parent, child = ctx.Pipe()
+            args = (str(path), lo, hi, rag.rescore_candidates, (rag.keyword_boost, rag.field_boost), child)
+            proc = ctx.Process(target=_shard_main, args=args, daemon=True)
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+        for conn in self._conns:
+            conn.recv()  # each shard has mapped the snapshot
+        for i in range(len(self._conns)):
+            reader = threading.Thread(target=self._read, args=(i,), daemon=True)
+            reader.start()
+            self._readers.append(reader)
+
+    def _read(self, i: int):
+        """Hand each reply from shard i to the query waiting on its request id"""
+        conn, pending = self._conns[i], self._pending[i]
+        while True:
+            try:
+                request_id, reply = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._pending_lock:
+                future = pending.pop(request_id)
+            future.set_result(reply)
+        with self._pending_lock:
+            orphans = list(pending.values())
+            pending.clear()
+        for future in orphans:
+            future.set_exception(RuntimeError("shard process exited"))
+
+    def search(self, query: str, keywords: list, q: np.ndarray, rows: np.ndarray,
+               k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Fan out to every shard holding candidate rows, then merge local top-k by (-score, row)"""
+        everything = len(rows) == self.n_rows
+        futures = []
+        with self._lock:
+            request_id = next(self._ids)
+            for conn, pending, (lo, hi) in zip(self._conns, self._pending, self.bounds):
+                part = None if everything else rows[np.searchsorted(rows, lo):np.searchsorted(rows, hi)]
+                if part is None or len(part):
+                    with self._pending_lock:
+                        pending[request_id] = future = Future()
+                    conn.send((request_id, query, keywords, q, part, k))
+                    futures.append(future)
+        replies = [future.result() for future in futures]
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+        if not replies:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        ids = np.concatenate([r[0] for r in replies])
+        scores = np.concatenate([r[1] for r in replies])
+        order = np.lexsort((ids, -scores))[:k]
+        return ids[order], scores[order]
+
+    def close(self):
+        """Stop the shard processes once any in-flight query has finished"""
+        with self._lock:
+            # Shards answer in order, so everything sent before None is still answered
+            conns, procs, readers = self._conns, self._procs, self._readers
+            self._conns, self._procs, self._readers = [], [], []
+            for conn in conns:
+                try:
+                    conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+        for proc in procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        for reader in readers:
+            reader.join(timeout=5)
+        for conn in conns:
+            conn.close()
+        if self._tmp is not None:
+            shutil.rmtree(self._tmp, ignore_errors=True)
@@ -0,0 +1,38 @@
+"""
+Deterministic stand-in for fastembed's TextEmbedding.
+
+Used by the load and benchmark tools so the app can be exercised without
+downloading or running the ONNX model. Vectors are hashed bag-of-words, so
+texts sharing words still score as similar.
+"""
+import hashlib
+import re
+import numpy as np
+
+STUB_DIM = 384
+
+class StubEmbedding:
+    """Hashed bag-of-words embedder with the same embed() API as TextEmbedding"""
+
+    def __init__(self, model_name: str = "stub", dim: int = STUB_DIM, **kwargs):
+        self.model_name = model_name
+        self.dim = dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            bucket = int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.dim
+            vec[bucket] += 1.0
+        vec[0] += 1e-3  # keep empty texts off the zero vector
+        return vec
+
+    def embed(self, documents, **kwargs):
+        if isinstance(documents, str):
+            documents = [documents]
+        for doc in documents:
+            yield self._vector(doc)
+
+def install():
+    """Swap the stub in for TextEmbedding; call before importing app"""
+    import rag_index
+    rag_index.TextEmbedding = StubEmbedding
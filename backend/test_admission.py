@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from admission import ConcurrencyLimiter, Rejected
+
+class TestConcurrencyLimiter:
+    """Test admission control for /chat"""
+    
+    def test_admits_up_to_limit(self):
+        """Test requests under the limit are admitted without waiting"""
+        async def run():
+            limiter = ConcurrencyLimiter("retrieval", 2)
+            permits = [await limiter.acquire(), await limiter.acquire()]
+            return limiter, permits
+        
+        limiter, permits = asyncio.run(run())
+        assert limiter.active == 2
+        assert limiter.stats()["admitted"] == 2
+    
+    def test_rejects_when_queue_full(self):
+        """Test a full limiter with no queue rejects immediately"""
+        async def run():
+            limiter = ConcurrencyLimiter("streams", 1)
+            await limiter.acquire()
+            with pytest.raises(Rejected) as exc:
+                await limiter.acquire()
+            return limiter, exc.value
+        
+        limiter, rejection = asyncio.run(run())
+        assert rejection.reason == "queue_full"
+        assert limiter.stats()["rejection_rate"] == 0.5
+    
+    def test_rejects_after_queue_deadline(self):
+        """Test a queued request is rejected once its deadline passes"""
+        async def run():
+            limiter = ConcurrencyLimiter("retrieval", 1, max_queue=4, queue_timeout=0.05)
+            await limiter.acquire()
+            with pytest.raises(Rejected) as exc:
+                await limiter.acquire()
+            return limiter, exc.value
+        
+        limiter, rejection = asyncio.run(run())
+        assert rejection.reason == "queue_timeout"
+        assert limiter.waiting == 0
+    
+    def test_queued_request_admitted_on_release(self):
+        """Test releasing a slot admits the next queued request"""
+        async def run():
+            limiter = ConcurrencyLimiter("retrieval", 1, max_queue=4, queue_timeout=1.0)
+            permit = await limiter.acquire()
+            waiter = asyncio.create_task(limiter.acquire())
+            await asyncio.sleep(0.01)
+            depth = limiter.stats()["queue_depth"]
+            permit.release()
+            permit.release()  # idempotent
+            await waiter
+            return limiter, depth
+        
+        limiter, depth = asyncio.run(run())
+        assert depth == 1
+        assert limiter.active == 1
+        assert limiter.admitted == 2
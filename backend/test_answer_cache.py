@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from answer_cache import SemanticCache
+
+def unit(*values):
+    v = np.array(values, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+class TestSemanticCache:
+    """Test the similarity-keyed answer cache"""
+    
+    def test_hit_above_threshold_only(self):
+        """Test a close paraphrase reuses the payload and a distant query misses"""
+        cache = SemanticCache(capacity=4, threshold=0.9)
+        cache.put(unit(1, 0, 0), {"bullets": ["a"]})
+        
+        payload, similarity = cache.get(unit(1, 0.2, 0))
+        
+        assert payload == {"bullets": ["a"]} and similarity > 0.9
+        assert cache.get(unit(0, 1, 0)) is None
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    
+    def test_scopes_are_isolated(self):
+        """Test an answer cached for one collection is never served to another"""
+        cache = SemanticCache(capacity=4, threshold=0.9)
+        cache.put(unit(1, 0, 0), {"bullets": ["default"]})
+        
+        assert cache.get(unit(1, 0, 0), scope="es") is None
+        cache.put(unit(1, 0, 0), {"bullets": ["es"]}, scope="es")
+        assert cache.get(unit(1, 0, 0), scope="es")[0] == {"bullets": ["es"]}
+        assert cache.get(unit(1, 0, 0))[0] == {"bullets": ["default"]}
+    
+    def test_evicts_least_recently_used(self):
+        """Test a full cache replaces the entry used longest ago"""
+        cache = SemanticCache(capacity=2, threshold=0.99)
+        cache.put(unit(1, 0, 0), "x")
+        cache.put(unit(0, 1, 0), "y")
+        cache.get(unit(1, 0, 0))  # y is now least recently used
+        
+        cache.put(unit(0, 0, 1), "z")
+        
+        assert cache.get(unit(0, 1, 0)) is None
+        assert cache.get(unit(1, 0, 0))[0] == "x"
+        assert cache.get(unit(0, 0, 1))[0] == "z"
+    
+    def test_clear_drops_entries_and_late_puts(self):
+        """Test clear() empties the cache and refuses answers computed before it"""
+        cache = SemanticCache(capacity=4, threshold=0.9)
+        cache.put(unit(1, 0, 0), "old")
+        generation = cache.generation
+        
+        cache.clear()
+        cache.put(unit(0, 1, 0), "stale", generation=generation)
+        
+        assert cache.get(unit(1, 0, 0)) is None
+        assert cache.get(unit(0, 1, 0)) is None
+        assert cache.stats()["entries"] == 0
+    
+    def test_nbytes_counts_matrix_and_payloads(self):
+        """Test the reported size covers the lazily allocated matrix and grows with payloads"""
+        cache = SemanticCache(capacity=4, threshold=0.9)
+        empty = cache.nbytes()
+        cache.put(unit(1, 0, 0), {"bullets": ["x" * 1000]})
+        
+        assert cache.nbytes() >= empty + 4 * 3 * 4 + 1000
@@ -1,5 +1,6 @@
 import pytest
 import json
+import numpy as np
 from unittest.mock import patch, Mock
 
 class TestHealthEndpoint:
@@ -210,4 +211,431 @@ class TestLatencyMetrics:
         assert "ms p50" in latency_report
         assert "ms p95" in latency_report
         assert "Retrieve" in latency_report
-        assert "total" in latency_report
\ No newline at end of file
+        assert "total" in latency_report
+
+class TestAnswerPipeline:
+    """Test the retrieval/composition pipeline behind /chat"""
+    
+    def test_pipeline_emits_bullets_then_sources(self):
+        """Test pipeline emits retrieval timing, each bullet, then sources last"""
+        from app import run_answer_pipeline
+        
+        rag_index = Mock()
+        rag_index.route_intent.return_value = [("sleep-hygiene.md", 0.8)]
+        rag_index.search_enhanced.return_value = [
+            {"text": "Keep a consistent sleep schedule every day of the week.", "source": "sleep-hygiene.md", "score": 0.9},
+            {"text": "Aim for 150 minutes of moderate aerobic exercise weekly.", "source": "exercise-aerobic.md", "score": 0.7},
+        ]
+        events = []
+        run_answer_pipeline(rag_index, "sleep routine", ["sleep", "routine"], lambda kind, payload: events.append((kind, payload)))
+        
+        kinds = [kind for kind, _ in events]
+        assert kinds == ["retrieved", "bullet", "bullet", "sources"]
+        assert [s["name"] for s in events[-1][1]] == ["sleep-hygiene.md", "exercise-aerobic.md"]
+    
+    def test_chat_streams_preface_before_bullets(self, test_client, mock_rag):
+        """Test the first frame is a preface token and bullets precede [DONE]"""
+        mock_rag.search_enhanced.return_value = [
+            {"text": "Keep a consistent sleep schedule every day of the week.", "source": "sleep-hygiene.md", "score": 0.9}
+        ]
+        
+        response = test_client.post("/chat", json={"message": "sleep"})
+        frames = [line[6:] for line in response.text.split("\n") if line.startswith("data: ")]
+        
+        assert '"token"' in frames[0]
+        bullet_pos = next(i for i, f in enumerate(frames) if '"bullet_index"' in f)
+        assert bullet_pos < frames.index("[DONE]")
+
+class TestStreamLifecycle:
+    """Test disconnect cancellation and heartbeats for SSE streams"""
+    
+    def _collect(self, gen):
+        import asyncio
+        
+        async def run():
+            return [frame async for frame in gen]
+        return asyncio.run(run())
+    
+    def test_disconnect_cancels_stream_work(self):
+        """Test a disconnected client stops the producer and is counted as abandoned"""
+        import asyncio
+        import app
+        
+        request = Mock()
+        async def is_disconnected():
+            return True
+        request.is_disconnected = is_disconnected
+        
+        closed = []
+        async def frames():
+            try:
+                while True:
+                    yield "data: {}\n\n"
+                    await asyncio.sleep(0.01)
+            finally:
+                closed.append(True)
+        
+        before = app.stream_metrics["abandoned_streams"]
+        with patch('app.DISCONNECT_POLL_INTERVAL', 0.02):
+            self._collect(app.supervise_stream(request, "test1234", frames(), expected_ms=60000))
+        
+        assert closed == [True]
+        assert app.stream_metrics["abandoned_streams"] == before + 1
+        assert app.stream_metrics["abandoned_saved_ms"] > 0
+    
+    def test_heartbeat_sent_during_stall(self):
+        """Test heartbeats go out on a timer even when no frames are produced"""
+        import asyncio
+        import app
+        
+        request = Mock()
+        async def is_disconnected():
+            return False
+        request.is_disconnected = is_disconnected
+        
+        async def frames():
+            await asyncio.sleep(0.3)
+            yield "data: [DONE]\n\n"
+        
+        with patch('app.HEARTBEAT_INTERVAL', 0.05):
+            out = self._collect(app.supervise_stream(request, "test1234", frames(), expected_ms=0))
+        
+        assert out[-1] == "data: [DONE]\n\n"
+        assert out.count(":\n\n") >= 3
+    
+    def _post_chat(self, disconnect_on):
+        """POST /chat straight through ASGI; the client disconnects at `disconnect_on` ("body" or "response.start")"""
+        import asyncio
+        import app
+        
+        async def run():
+            gone = asyncio.Event()
+            if disconnect_on == "body":
+                gone.set()
+            sent = []
+            messages = [{"type": "http.request", "body": json.dumps({"message": "sleep tips"}).encode(), "more_body": False}]
+            
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                await gone.wait()
+                return {"type": "http.disconnect"}
+            
+            async def send(message):
+                sent.append(message)
+                if message["type"] == "http.response.start" and disconnect_on == "response.start":
+                    gone.set()
+                    await asyncio.sleep(0.1)
+            
+            scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+                     "scheme": "http", "path": "/chat", "raw_path": b"/chat", "query_string": b"", "root_path": "",
+                     "headers": [(b"content-type", b"application/json")], "client": ("test", 1), "server": ("test", 80)}
+            await app.app(scope, receive, send)
+            await asyncio.sleep(0.05)
+            return sent
+        return asyncio.run(run())
+    
+    def test_disconnect_during_admission_releases_permits(self, mock_rag):
+        """Test a client gone by the time admission finishes gets no stream and holds no slot"""
+        import app
+        
+        before = app.stream_metrics["abandoned_streams"]
+        sent = self._post_chat("body")
+        
+        assert sent[0]["status"] == 499
+        assert app.stream_limiter.active == 0
+        assert app.retrieval_limiter.active == 0
+        assert app.stream_metrics["abandoned_streams"] == before + 1
+        mock_rag.search_enhanced.assert_not_called()
+    
+    def test_disconnect_before_first_frame_releases_permits(self, mock_rag):
+        """Test a response cancelled before its body is read still returns both slots and starts no pipeline"""
+        import app
+        
+        before = app.stream_metrics["abandoned_streams"]
+        sent = self._post_chat("response.start")
+        
+        assert [m["type"] for m in sent] == ["http.response.start"]
+        assert app.stream_limiter.active == 0
+        assert app.retrieval_limiter.active == 0
+        assert app.stream_metrics["abandoned_streams"] == before + 1
+        mock_rag.search_enhanced.assert_not_called()
+
+class TestAdmissionControl:
+    """Test load shedding on /chat"""
+    
+    def test_chat_rejected_when_streams_full(self, test_client, mock_rag):
+        """Test /chat answers 503 with Retry-After when no stream slot is free"""
+        import asyncio
+        from admission import ConcurrencyLimiter
+        
+        full = ConcurrencyLimiter("streams", 1)
+        asyncio.run(full.acquire())
+        
+        with patch('app.stream_limiter', full):
+            response = test_client.post("/chat", json={"message": "sleep tips"})
+        
+        assert response.status_code == 503
+        assert "retry-after" in response.headers
+        assert full.stats()["rejected"] == 1
+    
+    def test_health_reports_admission_metrics(self, test_client):
+        """Test queue depth and rejection rate are exposed"""
+        data = test_client.get("/health").json()
+        
+        assert "queue_depth" in data["admission"]["retrieval"]
+        assert "rejection_rate" in data["admission"]["streams"]
+
+class TestIntentRouting:
+    """Test centroid routing in the answer pipeline"""
+    
+    def test_routed_source_forced_into_results(self):
+        """Test the best-matching centroid source replaces the last result when missing"""
+        from app import apply_intent_hints
+        
+        rag_index = Mock()
+        rag_index.route_intent.return_value = [("sleep-hygiene.md", 0.7)]
+        forced = {"text": "Keep a regular bedtime.", "source": "sleep-hygiene.md", "score": 0.6}
+        rag_index.get_best_from_source.return_value = forced
+        results = [
+            {"text": "a", "source": "diet-hydration.md", "score": 0.8},
+            {"text": "b", "source": "stress-nature.md", "score": 0.5},
+        ]
+        
+        out = apply_intent_hints(rag_index, "sleep", ["sleep"], results, query_vec="q")
+        
+        assert out[-1] is forced
+        rag_index.get_best_from_source.assert_called_once_with("sleep", ["sleep"], "sleep-hygiene.md", query_vec="q")
+    
+    def test_weak_route_not_forced(self):
+        """Test a centroid match below INTENT_MIN_SCORE leaves results untouched"""
+        from app import apply_intent_hints
+        
+        rag_index = Mock()
+        rag_index.route_intent.return_value = [("sleep-hygiene.md", 0.05)]
+        results = [{"text": "a", "source": "diet-hydration.md", "score": 0.8}]
+        
+        out = apply_intent_hints(rag_index, "hello", [], list(results), query_vec="q")
+        
+        assert out == results
+        rag_index.get_best_from_source.assert_not_called()
+
+class TestRequestTracing:
+    """Test opt-in trace spans on /chat"""
+    
+    def _traces(self, out):
+        return [json.loads(line.split(" ", 1)[1]) for line in out.splitlines() if line.startswith("REQUEST_TRACE ")]
+    
+    def test_header_traces_chat_without_text(self, test_client, mock_rag, capsys):
+        """Test a traced request logs every stage span and never the message"""
+        from tracing import Tracer
+        mock_rag.search_enhanced.return_value = [
+            {"text": "Keep a consistent sleep schedule every day of the week.", "source": "sleep-hygiene.md", "score": 0.9}
+        ]
+        mock_rag.route_intent.return_value = []
+        
+        with patch('app.tracer', Tracer(enabled=True)):
+            test_client.post("/chat", json={"message": "sleep routine please"}, headers={"X-Trace": "1"})
+        
+        out = capsys.readouterr().out
+        traces = self._traces(out)
+        assert len(traces) == 1
+        names = {s["name"] for s in traces[0]["spans"]}
+        assert {"deidentify", "medical_gate", "keywords", "embed", "score", "intent_forcing",
+                "bullet", "stream", "preface"} <= names
+        assert "sleep routine" not in json.dumps(traces[0])
+    
+    def test_untraced_by_default(self, test_client, mock_rag, capsys):
+        """Test no trace is logged unless tracing is enabled"""
+        test_client.post("/chat", json={"message": "sleep tips"}, headers={"X-Trace": "1"})
+        
+        assert self._traces(capsys.readouterr().out) == []
+
+class TestCollections:
+    """Test /chat against named collections"""
+    
+    def test_chat_uses_named_collection(self, test_client, mock_rag):
+        """Test a collection parameter routes retrieval to that collection's index"""
+        es_index = Mock()
+        es_index.search_enhanced.return_value = [
+            {"text": "Mantenga un horario de sueño constante todos los días.", "source": "sueno.md", "score": 0.9}
+        ]
+        es_index.route_intent.return_value = []
+        manager = Mock()
+        manager.get.return_value = es_index
+        
+        with patch('app.collections', manager):
+            response = test_client.post("/chat", json={"message": "sleep schedule", "collection": "es"})
+        
+        manager.get.assert_called_once_with("es")
+        es_index.search_enhanced.assert_called_once()
+        mock_rag.search_enhanced.assert_not_called()
+        assert "sueno.md" in response.text
+    
+    def test_unknown_collection_404(self, test_client, mock_rag, tmp_path):
+        """Test an unknown collection is refused and its stream slot returned"""
+        import app
+        from index_manager import IndexManager
+        
+        before = app.stream_limiter.active
+        with patch('app.collections', IndexManager(tmp_path, Mock(), budget_bytes=0)):
+            response = test_client.post("/chat", json={"message": "sleep tips", "collection": "../snippets"})
+        
+        assert response.status_code == 404
+        assert app.stream_limiter.active == before
+
+class TestAnswerCache:
+    """Test semantic answer reuse in /chat"""
+    
+    def _rag(self):
+        rag_index = Mock()
+        rag_index.embed_query.return_value = np.array([1.0, 0.0], dtype=np.float32)
+        rag_index.route_intent.return_value = []
+        rag_index.search_enhanced.return_value = [
+            {"text": "Keep a consistent sleep schedule every day of the week.", "source": "sleep-hygiene.md", "score": 0.9}
+        ]
+        return rag_index
+    
+    def test_paraphrase_replays_cached_answer(self):
+        """Test a second close query skips search and gets the same bullets and sources"""
+        from app import run_answer_pipeline
+        from answer_cache import SemanticCache
+        
+        cache = SemanticCache(capacity=8, threshold=0.9)
+        rag_index = self._rag()
+        first, second = [], []
+        run_answer_pipeline(rag_index, "how to sleep better", ["sleep", "better"], lambda *e: first.append(e), cache=cache)
+        run_answer_pipeline(rag_index, "better sleep tips", ["better", "sleep"], lambda *e: second.append(e), cache=cache)
+        
+        assert rag_index.search_enhanced.call_count == 1
+        assert second[0][0] == "cache_hit"
+        assert [e for e in second if e[0] in ("bullet", "sources")] == [e for e in first if e[0] in ("bullet", "sources")]
+    
+    def test_medical_query_never_served_cached_answer(self, test_client, mock_rag):
+        """Test the medical gate answers before the cache, even when every query would hit"""
+        from answer_cache import SemanticCache
+        
+        cache = SemanticCache(capacity=8, threshold=-1.0)
+        cache.put(np.array([1.0, 0.0], dtype=np.float32), {"bullets": ["Sleep well."], "sources": []})
+        
+        with patch('app.answer_cache', cache):
+            response = test_client.post("/chat", json={"message": "what medication helps me sleep"})
+        
+        assert '"bullet' not in response.text
+        assert "Sleep well." not in response.text
+        assert cache.stats()["hits"] == 0
+
+class TestWebSocketChat:
+    """Test the multiplexed /ws/chat transport"""
+    
+    def _until_done(self, ws, ids):
+        frames = []
+        pending = set(ids)
+        while pending:
+            frame = ws.receive_json()
+            frames.append(frame)
+            if frame.get("done") or frame.get("cancelled") or "error" in frame:
+                pending.discard(frame.get("id"))
+        return frames
+    
+    def test_questions_multiplexed_by_id(self, test_client, mock_rag):
+        """Test two questions on one socket each get their own tagged bullets, sources and done"""
+        mock_rag.search_enhanced.return_value = [
+            {"text": "Keep a consistent sleep schedule every day of the week.", "source": "sleep-hygiene.md", "score": 0.9}
+        ]
+        mock_rag.route_intent.return_value = []
+        
+        with test_client.websocket_connect("/ws/chat") as ws:
+            ws.send_json({"type": "ask", "id": "a", "message": "sleep schedule"})
+            ws.send_json({"type": "ask", "id": "b", "message": "sleep routine"})
+            frames = self._until_done(ws, ["a", "b"])
+        
+        for qid in ("a", "b"):
+            own = [f for f in frames if f["id"] == qid]
+            assert "token" in own[0]
+            assert any("bullet_index" in f for f in own)
+            assert own[-2]["sources"][0]["name"] == "sleep-hygiene.md"
+            assert own[-1] == {"id": qid, "done": True}
+    
+    def test_cancel_stops_one_answer(self, test_client, mock_rag):
+        """Test cancelling one id ends it without done while the other still completes"""
+        import app
+        
+        mock_rag.search_enhanced.return_value = []
+        mock_rag.route_intent.return_value = []
+        before = app.stream_metrics["abandoned_streams"]
+        
+        with test_client.websocket_connect("/ws/chat") as ws:
+            ws.send_json({"type": "ask", "id": "a", "message": "sleep schedule"})
+            ws.send_json({"type": "ask", "id": "b", "message": "sleep routine"})
+            frames = [ws.receive_json()]
+            while frames[-1]["id"] != "a":
+                frames.append(ws.receive_json())
+            ws.send_json({"type": "cancel", "id": "a"})
+            frames += self._until_done(ws, ["a", "b"])
+        
+        assert {"id": "a", "cancelled": True} in frames
+        assert {"id": "a", "done": True} not in frames
+        assert frames[-1] == {"id": "b", "done": True}
+        assert app.stream_metrics["abandoned_streams"] == before + 1
+        assert app.stream_limiter.active == 0
+    
+    def test_errors_tagged_with_id(self, test_client, mock_rag, tmp_path):
+        """Test a duplicate in-flight id and an unknown collection get error frames, not a closed socket"""
+        from index_manager import IndexManager
+        
+        mock_rag.search_enhanced.return_value = []
+        mock_rag.route_intent.return_value = []
+        
+        with patch('app.collections', IndexManager(tmp_path, Mock(), budget_bytes=0)):
+            with test_client.websocket_connect("/ws/chat") as ws:
+                ws.send_json({"type": "ask", "id": "a", "message": "sleep schedule"})
+                ws.send_json({"type": "ask", "id": "a", "message": "sleep routine"})
+                duplicate = self._until_done(ws, ["a"])[-1]
+                ws.send_json({"type": "ask", "id": "b", "message": "sleep", "collection": "missing"})
+                frames = self._until_done(ws, ["a", "b"])
+        
+        assert duplicate == {"id": "a", "error": "Question id already in flight"}
+        assert {"id": "b", "error": "Unknown collection"} in frames
+        assert {"id": "a", "done": True} in frames
+    
+    def test_in_flight_cap(self, test_client, mock_rag):
+        """Test questions past WS_MAX_IN_FLIGHT are refused with a retry hint"""
+        mock_rag.search_enhanced.return_value = []
+        mock_rag.route_intent.return_value = []
+        
+        with patch('app.WS_MAX_IN_FLIGHT', 1):
+            with test_client.websocket_connect("/ws/chat") as ws:
+                ws.send_json({"type": "ask", "id": "a", "message": "sleep schedule"})
+                ws.send_json({"type": "ask", "id": "b", "message": "sleep routine"})
+                frames = self._until_done(ws, ["a", "b"])
+        
+        refused = next(f for f in frames if f["id"] == "b")
+        assert refused["reason"] == "in_flight"
+        assert "retry_after" in refused
+        assert {"id": "a", "done": True} in frames
+
+class TestDebugMemory:
+    """Test the /debug/memory endpoint"""
+    
+    def test_disabled_by_default(self, test_client):
+        """Test the endpoint does not exist unless enabled"""
+        response = test_client.get("/debug/memory")
+        
+        assert response.status_code == 404
+    
+    def test_reports_components_behind_token(self, test_client, test_data_dir, mock_embedding_model):
+        """Test an enabled endpoint needs the token and then reports index components and RSS"""
+        from rag_index import LocalRAG
+        
+        mock_embedding_model.embed.side_effect = lambda docs: iter([np.ones(384) for _ in docs])
+        rag_index = LocalRAG(data_dir=test_data_dir)
+        
+        with patch('app.DEBUG_MEMORY', True), patch('app.DEBUG_TOKEN', "s3cret"), patch('app.rag', rag_index):
+            refused = test_client.get("/debug/memory")
+            data = test_client.get("/debug/memory", headers={"X-Debug-Token": "s3cret"}).json()
+        
+        assert refused.status_code == 403
+        assert data["index"]["embeddings"]["bytes"] == rag_index.embs.nbytes
+        assert data["process"]["rss"] > 0
+        assert "tracemalloc" not in data
@@ -0,0 +1,36 @@
+import json
+from pathlib import Path
+import pytest
+from behavior_rules import RULES
+
+GOLDEN = json.loads((Path(__file__).parent / "golden_bullets.json").read_text(encoding="utf-8"))
+
+class TestBehaviorRules:
+    """Test the compiled bullet rule engine"""
+    
+    def test_golden_sentences(self):
+        """Test every golden sentence transforms to its recorded bullet"""
+        got = [RULES.transform(sentence) for sentence, _ in GOLDEN["sentences"]]
+        
+        assert got == [expected for _, expected in GOLDEN["sentences"]]
+    
+    def test_golden_chunks(self):
+        """Test every golden chunk composes to its recorded bullet for each keyword set"""
+        for text, outputs in GOLDEN["chunks"]:
+            assert [RULES.compose(text, keywords) for keywords in GOLDEN["keywords"]] == outputs
+    
+    def test_first_frequency_rule_wins(self):
+        """Test rule order, not position in the sentence, picks the frequency"""
+        assert RULES.frequency("Stretch daily and walk 3 times a week") == "3 times weekly"
+        assert RULES.frequency("Walk every day") == "daily"
+        assert RULES.frequency("Rest when tired") == "regularly"
+    
+    def test_verb_priority_over_position(self):
+        """Test the earliest listed verb leads the action even when another verb comes first"""
+        assert RULES.action("Try to get outside and aim for morning light") == "Aim for morning light"
+        assert RULES.action("Going outside helps") == "Going outside helps"
+    
+    def test_non_ascii_runs_every_rule(self):
+        """Test characters that only IGNORECASE folds still match"""
+        assert RULES.frequency("Stretch once a wee\u212a") == "weekly"
+        assert RULES.frequency("Eat 2 \u017fervings of fruit") == "\\1 servings"
@@ -0,0 +1,26 @@
+import pytest
+from dedup import shingles, jaccard, find_duplicates
+
+PARAGRAPH = ("Keep a consistent sleep schedule by going to bed and waking up at the same time every day, "
+             "even on weekends, so your body clock stays steady and falling asleep gets easier over time.")
+
+class TestNearDuplicates:
+    """Test MinHash near-duplicate detection"""
+    
+    def test_edited_copy_collapses_into_first(self):
+        """Test a lightly edited copy points at the earlier chunk"""
+        edited = PARAGRAPH.replace("steady", "steady and rested")
+        
+        assert jaccard(shingles(PARAGRAPH), shingles(edited)) >= 0.85
+        assert find_duplicates([PARAGRAPH, edited], threshold=0.85) == [None, 0]
+    
+    def test_distinct_texts_are_kept(self):
+        """Test unrelated chunks and chunks below the threshold are all kept"""
+        texts = [PARAGRAPH, "Drink a glass of water with every meal to stay hydrated.",
+                 PARAGRAPH.split(",")[0] + ", and skip caffeine after noon."]
+        
+        assert find_duplicates(texts, threshold=0.9) == [None, None, None]
+    
+    def test_duplicates_point_at_kept_chunk(self):
+        """Test a third copy points at the first kept chunk, never at another duplicate"""
+        assert find_duplicates([PARAGRAPH, PARAGRAPH, PARAGRAPH.upper()], threshold=0.9) == [None, 0, 0]
@@ -0,0 +1,84 @@
+import threading
+import pytest
+from index_manager import IndexManager, UnknownCollection
+
+class FakeIndex:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.closed = False
+    
+    def nbytes(self):
+        return self.size
+    
+    def close_shards(self):
+        self.closed = True
+
+@pytest.fixture
+def root(tmp_path):
+    for name in ("es", "fr", "kids"):
+        (tmp_path / name).mkdir()
+    return tmp_path
+
+class TestIndexManager:
+    """Test lazy per-collection indexes with LRU eviction"""
+    
+    def test_builds_once_on_first_use(self, root):
+        """Test a collection is built on first get and reused after"""
+        built = []
+        manager = IndexManager(root, lambda name, path: built.append(path) or FakeIndex(name, 10), budget_bytes=100)
+        
+        first = manager.get("es")
+        
+        assert manager.get("es") is first
+        assert built == [root / "es"]
+    
+    def test_concurrent_first_use_builds_once(self, root):
+        """Test requests racing on a cold collection share one build"""
+        built = []
+        gate = threading.Event()
+        def build(name, path):
+            gate.wait(1)
+            built.append(name)
+            return FakeIndex(name, 10)
+        manager = IndexManager(root, build, budget_bytes=100)
+        
+        threads = [threading.Thread(target=manager.get, args=("es",)) for _ in range(4)]
+        for t in threads:
+            t.start()
+        gate.set()
+        for t in threads:
+            t.join()
+        
+        assert built == ["es"]
+    
+    def test_evicts_least_recently_used_over_budget(self, root):
+        """Test loading past the budget drops the least recently used collection"""
+        manager = IndexManager(root, lambda name, path: FakeIndex(name, 40), budget_bytes=100)
+        es = manager.get("es")
+        manager.get("fr")
+        manager.get("es")  # fr is now least recently used
+        
+        manager.get("kids")
+        
+        assert manager.stats()["loaded"] == ["es", "kids"]
+        assert manager.stats()["evictions"] == 1
+        assert manager.get("es") is es
+    
+    def test_oversized_collection_still_served(self, root):
+        """Test a collection larger than the budget is kept while it is the only one loaded"""
+        manager = IndexManager(root, lambda name, path: FakeIndex(name, 500), budget_bytes=100)
+        
+        manager.get("es")
+        manager.get("fr")
+        
+        assert manager.stats()["loaded"] == ["fr"]
+    
+    def test_unknown_and_malformed_names_rejected(self, root):
+        """Test names without a directory, or that could escape the root, are refused"""
+        manager = IndexManager(root, lambda name, path: FakeIndex(name, 10), budget_bytes=100)
+        
+        for name in ("de", "../snippets", ".hidden", "es/../fr"):
+            with pytest.raises(UnknownCollection):
+                manager.get(name)
+        assert manager.stats()["loads"] == 0
@@ -0,0 +1,66 @@
+import pytest
+import numpy as np
+from loadgen import Histogram, StreamResult, build_query_mix, summarize
+from stub_embedding import StubEmbedding
+
+class TestHistogram:
+    """Test the latency histogram used in load reports"""
+
+    def test_histogram_bucket_counts(self):
+        """Test values land in the first bucket whose bound they do not exceed"""
+        hist = Histogram("ttfb", buckets=[10, 100])
+        for v in [1, 10, 11, 100, 500]:
+            hist.add(v)
+
+        assert hist.counts() == [2, 2, 1]
+
+    def test_histogram_ignores_missing_values(self):
+        """Test None values (stream never reached that point) are skipped"""
+        hist = Histogram("first bullet")
+        hist.add(None)
+
+        assert hist.values == []
+        assert hist.percentiles()["p99"] == 0
+
+class TestQueryMix:
+    """Test query mix construction"""
+
+    def test_medical_ratio_respected(self):
+        """Test medical queries carry the requested share of the weight"""
+        mix = build_query_mix(0.25)
+        medical = sum(w for kind, _, w in mix if kind == "medical")
+        total = sum(w for _, _, w in mix)
+
+        assert medical / total == pytest.approx(0.25)
+
+    def test_zero_medical_ratio(self):
+        """Test a zero ratio drops medical queries entirely"""
+        mix = build_query_mix(0.0)
+        assert all(kind == "wellness" for kind, _, _ in mix)
+
+class TestSummary:
+    """Test the text report"""
+
+    def test_summary_reports_error_rate(self):
+        """Test failed streams are counted in the error rate"""
+        results = [
+            StreamResult(query_kind="wellness", ok=True, ttfb_ms=5, first_bullet_ms=50, done_ms=100),
+            StreamResult(query_kind="medical", ok=False, error="ReadTimeout"),
+        ]
+        report = summarize(results, elapsed=1.0)
+
+        assert "error rate: 1/2" in report
+        assert "ReadTimeout: 1" in report
+        assert "time-to-first-bullet" in report
+
+class TestStubEmbedding:
+    """Test the stub model used for in-process load runs"""
+
+    def test_stub_is_deterministic(self):
+        """Test the same text always maps to the same vector"""
+        model = StubEmbedding()
+        a = next(model.embed(["better sleep tips"]))
+        b = next(model.embed(["better sleep tips"]))
+
+        assert a.shape == (384,)
+        np.testing.assert_array_equal(a, b)
@@ -0,0 +1,79 @@
+import memory
+from rag_index import LocalRAG
+
+class TestIndexBytes:
+    """Test per-component accounting of a LocalRAG"""
+    
+    def test_components_add_up_to_nbytes(self, test_data_dir, embed):
+        """Test the array components sum to LocalRAG.nbytes() and nothing in memory is flagged mapped"""
+        rag = LocalRAG(data_dir=test_data_dir)
+        
+        report = memory.index_bytes(rag)
+        
+        assert report["total"]["bytes"] - report["sources"]["bytes"] == rag.nbytes()
+        assert report["embeddings"]["bytes"] == rag.embs.nbytes
+        assert report["total"]["mapped_bytes"] == 0
+    
+    def test_snapshot_components_flagged_mapped(self, test_data_dir, tmp_path, embed):
+        """Test a snapshot-backed index reports its text, embeddings and term index as mapped"""
+        rag = LocalRAG(data_dir=test_data_dir, index_dir=tmp_path)
+        
+        report = memory.index_bytes(rag)
+        
+        assert report["texts"]["mapped"] and report["embeddings"]["mapped"] and report["term_index"]["mapped"]
+        assert not report["centroids"]["mapped"]
+        assert report["total"]["bytes"] - report["sources"]["bytes"] == rag.nbytes()
+
+class TestAllocationTracker:
+    """Test tracemalloc diffs between calls"""
+    
+    def test_second_call_reports_growth(self):
+        """Test the first call sets a baseline and the next one finds the allocation made in between"""
+        tracker = memory.AllocationTracker()
+        try:
+            first = tracker.diff(top=5)
+            held = [bytes(1024) for _ in range(2000)]
+            second = tracker.diff(top=5)
+        finally:
+            tracker.stop()
+        
+        assert first["baseline"] and first["top"] == []
+        assert any(__file__ in entry["location"] and entry["size_diff"] >= 2000 * 1024 for entry in second["top"])
+        assert len(held) == 2000
+    
+    def test_stop_ends_tracing(self):
+        """Test stop() turns tracemalloc off and the next diff starts a fresh baseline"""
+        import tracemalloc
+        
+        tracker = memory.AllocationTracker()
+        tracker.diff(top=1)
+        tracker.stop()
+        
+        assert not tracemalloc.is_tracing()
+        try:
+            assert tracker.diff(top=1)["baseline"]
+        finally:
+            tracker.stop()
+
+class TestFootprintProjection:
+    """Test the pre-deploy footprint projection"""
+    
+    def test_calibrated_on_corpus(self, test_data_dir):
+        """Test calibration measures per-chunk sizes from the sample corpus without a model"""
+        per_chunk = memory.calibrate(test_data_dir)
+        
+        assert per_chunk["chunks"] == 2
+        assert per_chunk["texts"] > 0 and per_chunk["postings"] > 0
+    
+    def test_dtype_and_snapshot_sharing(self, test_data_dir):
+        """Test float16 halves the embeddings and a snapshot keeps one index copy across workers"""
+        per_chunk = memory.calibrate(test_data_dir)
+        
+        private = memory.project_footprint(10000, per_chunk, workers=4, model_bytes=1000)
+        shared = memory.project_footprint(10000, per_chunk, dtype="float16", workers=4, snapshot=True,
+                                          model_bytes=1000)
+        
+        assert private["embeddings"]["total"] == 4 * 10000 * 384 * 4
+        assert shared["embeddings"]["total"] == 10000 * 384 * 2
+        assert shared["model"]["total"] == private["model"]["total"] == 4000
+        assert shared["term_index"]["bytes"] > 0 and private["term_index"]["bytes"] == 0
@@ -1,8 +1,9 @@
 import pytest
 import numpy as np
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import Mock, patch
-from rag_index import LocalRAG, _chunk
+from rag_index import LocalRAG, ChunkStore, _chunk, _parse_metadata
 
 class TestChunkingFunction:
     """Test the text chunking functionality"""
@@ -209,4 +210,375 @@ class TestRAGPerformance:
         
         # Should not store redundant data
         assert len(rag.texts) == len(rag.meta)
-        assert len(rag.texts) == rag.embs.shape[0] or rag.embs.shape[0] == 0
\ No newline at end of file
+        assert len(rag.texts) == rag.embs.shape[0] or rag.embs.shape[0] == 0
+
+class TestIntentRouting:
+    """Test centroid-based intent routing and two-stage retrieval"""
+    
+    @pytest.fixture
+    def rag(self, test_data_dir, mock_embedding_model):
+        rng = np.random.default_rng(0)
+        mock_embedding_model.embed.side_effect = lambda docs: iter([rng.random(384) for _ in docs])
+        return LocalRAG(data_dir=test_data_dir)
+    
+    def test_centroids_built_per_source(self, rag):
+        """Test one unit-length centroid is built for each source file"""
+        assert rag.sources == ["test-nutrition.md", "test-sleep.md"]
+        assert rag.centroids.shape == (2, 384)
+        np.testing.assert_allclose(np.linalg.norm(rag.centroids, axis=1), 1.0, rtol=1e-6)
+    
+    def test_route_intent_uses_query_vector(self, rag):
+        """Test routing ranks a source first when the query is its centroid"""
+        routed = rag.route_intent(rag.centroids[1], n=2)
+        
+        assert routed[0][0] == "test-sleep.md"
+        assert routed[0][1] == pytest.approx(1.0)
+        assert rag.model.embed.call_count == 1  # only the build, no query re-embedding
+    
+    def test_two_stage_search_restricts_sources(self, rag):
+        """Test top_sources only returns chunks from the routed sources"""
+        q = rag.centroids[0]
+        results = rag.search_enhanced("nutrition", [], k=4, query_vec=q, top_sources=1)
+        
+        assert results
+        assert all(r["source"] == "test-nutrition.md" for r in results)
+    
+    def test_two_stage_search_matches_full_scan_scores(self, rag):
+        """Test scoring every source through two-stage search gives the full-scan result"""
+        q = rag.centroids[1]
+        full = rag.search_enhanced("sleep", ["schedule"], k=4, query_vec=q)
+        staged = rag.search_enhanced("sleep", ["schedule"], k=4, query_vec=q, top_sources=2)
+        
+        assert full == staged
+    
+    def test_get_best_from_unknown_source(self, rag):
+        """Test a source that is not indexed returns None"""
+        assert rag.get_best_from_source("sleep", [], "missing.md", query_vec=rag.centroids[0]) is None
+
+class TestThreadConfiguration:
+    """Test ONNX thread configuration reaches the embedding model"""
+    
+    def test_threads_passed_to_model(self, test_data_dir):
+        """Test the threads argument configures the ONNX session"""
+        with patch('rag_index.TextEmbedding') as mock_model:
+            mock_model.return_value.embed.side_effect = lambda docs: iter([np.random.rand(384) for _ in docs])
+            LocalRAG(data_dir=test_data_dir, threads=2)
+        
+        assert mock_model.call_args.kwargs["threads"] == 2
+
+class TestChunkStore:
+    """Test columnar chunk text and metadata storage"""
+    
+    def test_store_round_trips_text_and_meta(self):
+        """Test text and metadata come back unchanged from the packed columns"""
+        records = [("a.md", 0, "Title: Sleep"), ("a.md", 1, "Café – naïve"), ("b.md", 0, "Hydrate")]
+        store = ChunkStore(records)
+        
+        assert [store.text(i) for i in range(len(store))] == [r[2] for r in records]
+        assert store.sources == ["a.md", "b.md"]
+        assert store.source_ids.tolist() == [0, 0, 1]
+        assert store.chunk_nos.tolist() == [0, 1, 0]
+    
+    def test_match_counts_matches_lowercased_substring(self):
+        """Test per-row term counts equal `term in text.lower()` including non-ASCII rows"""
+        records = [("a.md", 0, "Sleep BETTER"), ("a.md", 1, "Kelvin K scale"), ("b.md", 0, "CAFÉ sleep")]
+        store = ChunkStore(records)
+        terms = ["sleep", "better", "k", "café"]
+        
+        expected = [sum(1 for t in terms if t in text.lower()) for _, _, text in records]
+        assert store.match_counts(terms).tolist() == expected
+        assert store.match_counts(["sleep"], 1, 3).tolist() == [0, 1]
+    
+    def test_rag_exposes_list_like_columns(self, test_data_dir, mock_embedding_model):
+        """Test texts/meta keep their list-style access on top of the store"""
+        mock_embedding_model.embed.side_effect = lambda docs: iter([np.random.rand(384) for _ in docs])
+        rag = LocalRAG(data_dir=test_data_dir)
+        
+        assert len(rag.texts) == len(rag.meta) > 0
+        assert rag.texts[0] == list(rag.texts)[0]
+        assert set(rag.meta[0]) == {"source", "chunk"}
+
+class TestIndexSnapshot:
+    """Test mmap-backed index snapshots"""
+    
+    def test_snapshot_written_then_reused(self, test_data_dir, tmp_path, embed):
+        """Test the first instance writes a snapshot and the next one maps it without re-embedding"""
+        LocalRAG(data_dir=test_data_dir, index_dir=tmp_path)
+        embed.embed.reset_mock()
+        
+        rag = LocalRAG(data_dir=test_data_dir, index_dir=tmp_path)
+        
+        embed.embed.assert_not_called()
+        assert len(list(tmp_path.iterdir())) == 1
+        assert isinstance(rag.embs, np.memmap)
+        assert rag.store.term_index is not None
+    
+    def test_snapshot_search_matches_in_memory(self, test_data_dir, tmp_path, embed):
+        """Test search results are identical whether the index is mapped or in memory"""
+        in_memory = LocalRAG(data_dir=test_data_dir)
+        mapped = LocalRAG(data_dir=test_data_dir, index_dir=tmp_path)
+        
+        for query in ["sleep better", "Title: exercise", "HEALTH tips", "xyz"]:
+            keywords = [w for w in query.lower().split() if len(w) > 2]
+            assert mapped.search_enhanced(query, keywords, k=3) == in_memory.search_enhanced(query, keywords, k=3)
+        assert list(mapped.texts) == list(in_memory.texts)
+        assert list(mapped.meta) == list(in_memory.meta)
+    
+    def test_changed_data_gets_new_snapshot(self, test_data_dir, tmp_path, embed):
+        """Test editing a snippet file produces a new snapshot and prunes the old one"""
+        first = LocalRAG(data_dir=test_data_dir, index_dir=tmp_path)._fingerprint()
+        (Path(test_data_dir) / "added.md").write_text("Title: Hydration\nDrink water through the day.")
+        
+        rag = LocalRAG(data_dir=test_data_dir, index_dir=tmp_path)
+        
+        assert rag._fingerprint() != first
+        assert [p.name for p in tmp_path.iterdir()] == [rag._fingerprint()]
+        assert "added.md" in rag.sources
+
+class TestRetrievalSettings:
+    """Test chunking and score boost settings"""
+    
+    def test_chunk_settings_change_chunks_and_snapshot(self, test_data_dir, embed):
+        """Test smaller chunks give more rows and a different snapshot fingerprint"""
+        default = LocalRAG(data_dir=test_data_dir)
+        small = LocalRAG(data_dir=test_data_dir, chunk_size=100, chunk_overlap=20)
+        
+        assert len(small.store) > len(default.store)
+        assert small._fingerprint() != default._fingerprint()
+        assert all(len(text) <= 100 for text in small.texts)
+    
+    def test_zero_boosts_rank_by_cosine(self, test_data_dir, embed):
+        """Test with both boosts off, search_enhanced scores are the plain cosine"""
+        rag = LocalRAG(data_dir=test_data_dir, keyword_boost=0.0, field_boost=0.0)
+        q = rag.embed_query("Title: sleep")
+        
+        hits = rag.search_enhanced("Title: sleep", ["sleep", "title"], k=2, query_vec=q)
+        
+        cosine = np.sort(rag.embs @ q)[::-1][:2]
+        assert np.allclose([h["score"] for h in hits], cosine)
+    
+    def test_overlap_must_be_smaller_than_chunk(self, tmp_path, mock_embedding_model):
+        """Test an overlap that would never advance is rejected"""
+        with pytest.raises(ValueError):
+            LocalRAG(data_dir=tmp_path, chunk_size=100, chunk_overlap=100)
+
+class TestDuplicateCollapse:
+    """Test near-duplicate chunks are collapsed at ingest"""
+    
+    @pytest.fixture
+    def corpus(self, tmp_path):
+        text = ("Title: Sleep\nKeep a consistent sleep schedule by going to bed and waking up at the same "
+                "time every day, even on weekends, so your body clock stays steady.")
+        (tmp_path / "a-sleep.md").write_text(text)
+        (tmp_path / "b-sleep-copy.md").write_text(text.replace("steady", "steady!"))
+        (tmp_path / "c-water.md").write_text("Title: Hydration\nDrink a glass of water with every meal.")
+        return tmp_path
+    
+    def test_copy_collapsed_with_pointer(self, corpus, embed):
+        """Test the copy is embedded once and hits list the file it was collapsed from"""
+        rag = LocalRAG(data_dir=corpus, dedup_threshold=0.9)
+        
+        assert len(rag.texts) == 2
+        assert rag.dedup_stats["collapsed"] == 1
+        hit = rag.search_enhanced("sleep schedule", ["sleep", "schedule"], k=1)[0]
+        assert hit["source"] == "a-sleep.md"
+        assert hit["also_in"] == ["b-sleep-copy.md"]
+    
+    def test_dedup_off_keeps_every_chunk(self, corpus, embed):
+        """Test no threshold leaves the index and hits unchanged"""
+        rag = LocalRAG(data_dir=corpus)
+        
+        assert len(rag.texts) == 3
+        assert all("also_in" not in hit for hit in rag.search_enhanced("sleep", ["sleep"], k=3))
+    
+    def test_aliases_survive_snapshot(self, corpus, tmp_path, embed):
+        """Test collapsed pointers are restored from a mapped snapshot"""
+        LocalRAG(data_dir=corpus, index_dir=tmp_path / "index", dedup_threshold=0.9)
+        
+        rag = LocalRAG(data_dir=corpus, index_dir=tmp_path / "index", dedup_threshold=0.9)
+        
+        assert rag.store.aliases(0) == [("b-sleep-copy.md", 0)]
+        assert rag.dedup_stats["collapsed"] == 1
+
+class TestCollectionSupport:
+    """Test LocalRAG behaviour the collection manager relies on"""
+    
+    def test_prune_keeps_other_directories(self, test_data_dir, tmp_path, embed):
+        """Test pruning removes old snapshots but not other directories sharing index_dir"""
+        (tmp_path / "collections" / "es").mkdir(parents=True)
+        LocalRAG(data_dir=test_data_dir, index_dir=tmp_path)
+        (Path(test_data_dir) / "added.md").write_text("Title: Hydration\nDrink water through the day.")
+        
+        rag = LocalRAG(data_dir=test_data_dir, index_dir=tmp_path)
+        
+        assert sorted(p.name for p in tmp_path.iterdir()) == sorted(["collections", rag._fingerprint()])
+    
+    def test_shared_model_not_reloaded(self, test_data_dir, embed):
+        """Test an index given a loaded model uses it instead of constructing another"""
+        with patch('rag_index.TextEmbedding') as constructor:
+            rag = LocalRAG(data_dir=test_data_dir, model=embed)
+        
+        constructor.assert_not_called()
+        assert rag.model is embed
+        assert rag.nbytes() >= rag.embs.nbytes + rag.store.nbytes
+
+class TestReducedSearch:
+    """Test the reduced-dimension first pass with full-dimension rescoring"""
+    
+    @pytest.fixture
+    def corpus(self, tmp_path):
+        for i in range(30):
+            body = " ".join(f"Sentence {j} of {i} about habit {i % 7}." for j in range(60))
+            (tmp_path / f"doc-{i:02d}.md").write_text(f"Title: Topic {i}\n{body}")
+        return tmp_path
+    
+    @pytest.fixture
+    def low_rank_model(self, mock_embedding_model):
+        # Embeddings live in an 8-dim subspace, so an 8-component PCA loses nothing
+        basis = np.random.default_rng(1).standard_normal((8, 384))
+        mock_embedding_model.embed.side_effect = lambda docs: iter(
+            [np.random.default_rng(abs(hash(d)) % 2**32).standard_normal(8) @ basis for d in docs])
+        return mock_embedding_model
+    
+    def test_reduced_search_matches_exact(self, corpus, low_rank_model):
+        """Test rescored results equal the exact scan when the projection keeps all variance"""
+        exact = LocalRAG(data_dir=corpus)
+        reduced = LocalRAG(data_dir=corpus, reduced_dim=8, rescore_candidates=10)
+        
+        # Rescoring a subset can round the last bit differently than the full matmul
+        def ranked(hits):
+            return [(hit["text"], round(hit["score"], 9)) for hit in hits]
+        
+        assert reduced.reduced.shape == (len(reduced.store), 8)
+        for query in ["habit 3", "Topic 12", "sentence"]:
+            keywords = [w for w in query.lower().split() if len(w) > 2]
+            assert ranked(reduced.search_enhanced(query, keywords, k=4)) == ranked(exact.search_enhanced(query, keywords, k=4))
+            assert ranked(reduced.search(query, k=4)) == ranked(exact.search(query, k=4))
+    
+    def test_k_above_rescore_candidates_returns_k(self, corpus, low_rank_model):
+        """Test asking for more hits than rescore candidates still returns k of them"""
+        rag = LocalRAG(data_dir=corpus, reduced_dim=8, rescore_candidates=3)
+        
+        assert len(rag.store) > 10
+        assert len(rag.search("habit 3", k=10)) == 10
+        assert len(rag.search_enhanced("habit 3", ["habit"], k=10)) == 10
+    
+    def test_small_index_skips_reduction(self, test_data_dir, low_rank_model):
+        """Test indexes with no more rows than rescore candidates keep the exact scan"""
+        rag = LocalRAG(data_dir=test_data_dir, reduced_dim=8)
+        
+        assert rag.reduced is None
+    
+    def test_empty_index_takes_model_dimension(self, tmp_path, mock_embedding_model):
+        """Test the empty-index embedding width comes from the model, not a constant"""
+        mock_embedding_model.embed.return_value = iter([np.random.rand(256)])
+        
+        rag = LocalRAG(data_dir=tmp_path)
+        
+        assert rag.embs.shape == (0, 256)
+    
+    def test_unknown_reduction_rejected(self, tmp_path, mock_embedding_model):
+        """Test an unsupported reduction method fails fast"""
+        with pytest.raises(ValueError):
+            LocalRAG(data_dir=tmp_path, reduced_dim=8, reduction="svd-magic")
+
+class TestShardedSearch:
+    """Test scatter-gather search across shard processes"""
+    
+    def test_shard_bounds_aligned_and_complete(self):
+        """Test shards tile every row on SHARD_ALIGN boundaries"""
+        from shards import shard_bounds, SHARD_ALIGN
+        
+        bounds = shard_bounds(1000, 3)
+        
+        assert bounds[0][0] == 0 and bounds[-1][1] == 1000
+        assert all(a[1] == b[0] for a, b in zip(bounds, bounds[1:]))
+        assert all(lo % SHARD_ALIGN == 0 for lo, _ in bounds)
+        assert shard_bounds(10, 4) == [(0, 10)]
+    
+    def test_sharded_results_match_single_process(self, tmp_path, embed):
+        """Test merged shard top-k has the same rows and scores as in-process search"""
+        for i in range(60):
+            body = " ".join(f"Sentence {j} of {i} about habit {i % 7}." for j in range(60))
+            (tmp_path / f"doc-{i:02d}.md").write_text(f"Title: Topic {i}\n{body}")
+        rag = LocalRAG(data_dir=tmp_path)
+        queries = ["habit 3", "Topic 12 sentence", "about"]
+        where = {"title": ["Topic 3", "Topic 40"]}
+        expected = [rag.search_enhanced(q, [w for w in q.lower().split() if len(w) > 2], k=5) for q in queries]
+        expected_filtered = rag.search_enhanced("habit", ["habit"], k=5, where=where)
+        
+        rag.start_shards(3)
+        try:
+            assert len(rag.shards.bounds) == 3
+            got = [rag.search_enhanced(q, [w for w in q.lower().split() if len(w) > 2], k=5) for q in queries]
+            assert rag.search_enhanced("habit", ["habit"], k=5, where=where) == expected_filtered
+            # Queries from several threads are in flight on the pool at once
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                concurrent = list(pool.map(
+                    lambda q: rag.search_enhanced(q, [w for w in q.lower().split() if len(w) > 2], k=5), queries * 4))
+        finally:
+            rag.close_shards()
+        
+        assert got == expected
+        assert concurrent == expected * 4
+
+class TestMetadataFilter:
+    """Test metadata parsing and where-filtered search"""
+    
+    @pytest.fixture
+    def rag(self, tmp_path, embed):
+        (tmp_path / "sleep-basics.md").write_text("Title: Sleep Basics\nKeep a regular bedtime every night.")
+        (tmp_path / "sleep-naps.md").write_text("---\nAudience: Teens\nlanguage: en\n---\nTitle: Napping\nShort naps help.")
+        (tmp_path / "diet-water.md").write_text("Title: Hydration\nDrink water through the day.")
+        (tmp_path / "exercise-walk.md").write_text("Title: Walking\nWalk after dinner for better sleep.")
+        return LocalRAG(data_dir=tmp_path)
+    
+    def test_parse_metadata(self):
+        """Test category, title and front-matter keys are parsed and front matter is not indexed"""
+        meta, body = _parse_metadata("sleep-naps.md", "---\nAudience: Teens\n---\nTitle: Napping\nShort naps help.")
+        
+        assert meta == {"category": "sleep", "title": "Napping", "audience": "Teens"}
+        assert body == "Title: Napping\nShort naps help."
+        assert _parse_metadata("notes.md", "Plain text")[0] == {"category": "notes"}
+    
+    def test_where_matches_post_filter(self, rag):
+        """Test filtered top-k equals the unfiltered ranking filtered afterwards"""
+        everything = rag.search_enhanced("sleep", ["sleep"], k=len(rag.texts))
+        
+        got = rag.search_enhanced("sleep", ["sleep"], k=2, where={"category": "sleep"})
+        
+        assert got == [h for h in everything if h["source"].startswith("sleep-")][:2]
+    
+    def test_where_combines_fields_and_values(self, rag):
+        """Test list values are OR-ed, fields are AND-ed, and unknown fields or values match nothing"""
+        sources = lambda where: {h["source"] for h in rag.search_enhanced("sleep", ["sleep"], k=10, where=where)}
+        
+        assert sources({"category": ["diet", "exercise"]}) == {"diet-water.md", "exercise-walk.md"}
+        assert sources({"category": "sleep", "audience": "Teens"}) == {"sleep-naps.md"}
+        assert sources({"category": "social"}) == set()
+        assert sources({"mood": "calm"}) == set()
+        assert "Audience" not in " ".join(rag.texts)
+    
+    def test_where_from_snapshot(self, rag, tmp_path):
+        """Test metadata survives a snapshot round trip"""
+        mapped = LocalRAG(data_dir=rag.data_dir, index_dir=tmp_path / "index")
+        
+        for where in [{"title": "Walking"}, {"language": "en"}, {"category": ["diet", "sleep"]}]:
+            assert mapped.search_enhanced("sleep", ["sleep"], k=3, where=where) == \
+                rag.search_enhanced("sleep", ["sleep"], k=3, where=where)
+    
+    def test_where_matches_collapsed_duplicates(self, tmp_path, embed):
+        """Test a row kept from a non-matching file still matches through a collapsed file's metadata"""
+        text = ("Title: Sleep\nKeep a consistent sleep schedule by going to bed and waking up at the same "
+                "time every day, even on weekends, so your body clock stays steady.")
+        (tmp_path / "sleep-basics.md").write_text(text)
+        (tmp_path / "teens-sleep.md").write_text("---\nAudience: Teens\n---\n" + text.replace("steady", "steady!"))
+        rag = LocalRAG(data_dir=tmp_path, dedup_threshold=0.9, index_dir=tmp_path / "index")
+        
+        hits = rag.search_enhanced("sleep", ["sleep"], k=3, where={"audience": "Teens"})
+        
+        assert len(rag.texts) == 1
+        assert [(h["source"], h["also_in"]) for h in hits] == [("sleep-basics.md", ["teens-sleep.md"])]
+        assert rag.search_enhanced("sleep", ["sleep"], k=3, where={"category": "diet"}) == []
+        mapped = LocalRAG(data_dir=tmp_path, dedup_threshold=0.9, index_dir=tmp_path / "index")
+        assert mapped.search_enhanced("sleep", ["sleep"], k=3, where={"category": "teens"}) == hits
@@ -0,0 +1,32 @@
+import pytest
+from topology import ThreadTopology, effective_report
+
+class TestThreadTopology:
+    """Test thread topology configuration and reporting"""
+    
+    def test_from_env(self, monkeypatch):
+        """Test topology is read from the environment"""
+        monkeypatch.setenv("EMBED_THREADS", "2")
+        monkeypatch.setenv("BLAS_THREADS", "1")
+        monkeypatch.setenv("WEB_CONCURRENCY", "4")
+        
+        topology = ThreadTopology.from_env()
+        
+        assert topology == ThreadTopology(embed_threads=2, blas_threads=1, workers=4)
+    
+    def test_defaults_leave_library_threads(self, monkeypatch):
+        """Test unset variables leave thread counts to the libraries"""
+        for var in ("EMBED_THREADS", "BLAS_THREADS", "WEB_CONCURRENCY"):
+            monkeypatch.delenv(var, raising=False)
+        
+        topology = ThreadTopology.from_env()
+        
+        assert topology.embed_threads is None
+        assert topology.workers == 1
+    
+    def test_report_flags_oversubscription(self, monkeypatch):
+        """Test workers x threads above the core count is reported as oversubscribed"""
+        monkeypatch.setattr("topology.available_cores", lambda: 4)
+        
+        assert effective_report(ThreadTopology(embed_threads=2, blas_threads=1, workers=4))["oversubscribed"]
+        assert not effective_report(ThreadTopology(embed_threads=1, blas_threads=1, workers=4))["oversubscribed"]
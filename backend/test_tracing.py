@@ -0,0 +1,76 @@
+import json
+import threading
+import pytest
+from tracing import Tracer, Trace, NULL_TRACE
+
+class TestTracer:
+    """Test the per-request trace decision"""
+    
+    def test_disabled_ignores_header(self):
+        """Test nothing is traced unless tracing is enabled"""
+        tracer = Tracer(enabled=False, sample_rate=1.0)
+        
+        assert tracer.start("abc12345", {"x-trace": "1"}) is NULL_TRACE
+    
+    def test_header_forces_trace(self):
+        """Test the trace header traces a request even with sampling off"""
+        tracer = Tracer(enabled=True, header="X-Trace")
+        
+        trace = tracer.start("abc12345", {"x-trace": "1"})
+        
+        assert trace.enabled and trace.request_id == "abc12345"
+        assert tracer.start("abc12345", {}) is NULL_TRACE
+    
+    def test_sampling_rate(self):
+        """Test requests without the header are traced when the sample draw falls under the rate"""
+        draws = iter([0.05, 0.5])
+        tracer = Tracer(enabled=True, sample_rate=0.1, rng=lambda: next(draws))
+        
+        assert tracer.start("a", {}).enabled
+        assert tracer.start("b", {}) is NULL_TRACE
+
+class TestTrace:
+    """Test span recording and profile dumps"""
+    
+    def test_spans_nest_per_thread(self):
+        """Test child spans name their parent and a worker thread starts its own tree"""
+        trace = Trace("abc12345")
+        
+        def worker():
+            with trace.span("compose"):
+                pass
+        
+        with trace.span("pipeline"):
+            with trace.span("embed"):
+                pass
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        
+        spans = {s["name"]: s for s in trace.report("completed")["spans"]}
+        assert spans["pipeline"]["parent"] is None
+        assert spans["embed"]["parent"] == "pipeline"
+        assert spans["compose"]["parent"] is None
+    
+    def test_report_carries_no_text(self, capsys):
+        """Test the emitted trace holds the request_id, names and timings only"""
+        trace = Trace("abc12345")
+        with trace.span("deidentify"):
+            pass
+        
+        trace.emit("completed")
+        
+        line = capsys.readouterr().out.strip()
+        assert line.startswith("REQUEST_TRACE ")
+        report = json.loads(line[len("REQUEST_TRACE "):])
+        assert set(report) == {"request_id", "status", "total_ms", "spans"}
+        assert set(report["spans"][0]) == {"name", "parent", "start_ms", "duration_ms"}
+    
+    def test_profile_dumped_per_request(self, tmp_path):
+        """Test profile() writes <request_id>.prof when a profile directory is set"""
+        trace = Trace("abc12345", profile_dir=str(tmp_path / "profiles"))
+        
+        with trace.profile():
+            sum(range(1000))
+        
+        assert (tmp_path / "profiles" / "abc12345.prof").stat().st_size > 0
@@ -0,0 +1,195 @@
+"""
+Thread topology for query embedding and similarity math.
+
+Each uvicorn worker runs its own ONNX session and NumPy BLAS pool. Left at
+their defaults both size themselves to every core, so N workers oversubscribe
+the box. This module reads the intended layout from the environment, pins the
+BLAS pool and reports what is actually in effect.
+
+    EMBED_THREADS     ONNX intra-op threads per worker (default: library default)
+    BLAS_THREADS      BLAS threads per worker (default: library default)
+    WEB_CONCURRENCY   uvicorn worker count, used for the oversubscription check
+
+Import this module before NumPy is loaded so the BLAS environment variables
+take effect; threadpoolctl (installed with scikit-learn) also limits pools that
+are already loaded.
+
+Benchmark mode sweeps combinations and reports throughput and p99:
+
+    python topology.py --sweep --workers 1,2,4 --embed-threads 1,2,4 --blas-threads 1,2
+"""
+import argparse, itertools, json, multiprocessing, os, statistics, time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BLAS_ENV_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                 "BLIS_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+def available_cores() -> int:
+    """Cores this process may run on (respects cgroup/affinity masks where the OS exposes them)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+@dataclass
+class ThreadTopology:
+    """Requested threads per worker; None leaves the library default in place"""
+    embed_threads: Optional[int] = None
+    blas_threads: Optional[int] = None
+    workers: int = 1
+
+    @classmethod
+    def from_env(cls) -> "ThreadTopology":
+        return cls(
+            embed_threads=_env_int("EMBED_THREADS"),
+            blas_threads=_env_int("BLAS_THREADS"),
+            workers=_env_int("WEB_CONCURRENCY") or 1,
+        )
+
+    def apply(self):
+        """Pin BLAS threads for this process; ONNX threads are passed to LocalRAG"""
+        if self.blas_threads is None:
+            return
+        for var in BLAS_ENV_VARS:
+            os.environ[var] = str(self.blas_threads)
+        try:
+            from threadpoolctl import threadpool_limits
+            threadpool_limits(limits=self.blas_threads, user_api="blas")
+        except ImportError:
+            pass
+
+def blas_pools() -> List[Dict]:
+    """Loaded BLAS/OpenMP pools and their thread counts, if threadpoolctl is available"""
+    try:
+        from threadpoolctl import threadpool_info
+    except ImportError:
+        return []
+    return [{"api": p.get("internal_api"), "num_threads": p.get("num_threads")} for p in threadpool_info()]
+
+def effective_report(topology: ThreadTopology) -> Dict:
+    """What each worker will actually use, and whether the workers oversubscribe the cores"""
+    cores = available_cores()
+    pools = blas_pools()
+    blas_threads = topology.blas_threads or max((p["num_threads"] or 1 for p in pools), default=cores)
+    # onnxruntime's default intra-op pool is one thread per physical core
+    embed_threads = topology.embed_threads or cores
+    # Embedding and scoring run back to back per request, so the busier of the two bounds a worker
+    per_worker = max(embed_threads, blas_threads)
+    return {
+        "cores": cores,
+        "workers": topology.workers,
+        "embed_threads": embed_threads,
+        "embed_threads_configured": topology.embed_threads is not None,
+        "blas_threads": blas_threads,
+        "blas_threads_configured": topology.blas_threads is not None,
+        "blas_pools": pools,
+        "oversubscribed": topology.workers * per_worker > cores,
+    }
+
+def configure_from_env() -> ThreadTopology:
+    """Read the topology from the environment and pin BLAS threads; call before building LocalRAG"""
+    topology = ThreadTopology.from_env()
+    topology.apply()
+    return topology
+
+# ---- benchmark mode -------------------------------------------------------
+
+BENCH_QUERIES = [
+    "How can I sleep better?",
+    "tips for managing stress at work",
+    "what should I eat for brain health",
+    "how often should I do aerobic exercise",
+    "ways to improve focus and memory",
+    "staying hydrated during the day",
+]
+
+def _bench_worker(embed_threads, blas_threads, data_dir, stub, duration, barrier, results):
+    """One simulated uvicorn worker: embed + search in a loop for `duration` seconds"""
+    ThreadTopology(embed_threads=embed_threads, blas_threads=blas_threads).apply()
+    if stub:
+        import stub_embedding
+        stub_embedding.install()
+    from rag_index import LocalRAG
+
+    rag = LocalRAG(data_dir=data_dir, threads=embed_threads)
+    queries = [(q, [w for w in q.lower().split() if len(w) > 2]) for q in BENCH_QUERIES]
+    for q, keywords in queries:  # warm up the session
+        rag.search_enhanced(q, keywords, k=4)
+
+    barrier.wait()
+    latencies = []
+    end = time.perf_counter() + duration
+    i = 0
+    while time.perf_counter() < end:
+        q, keywords = queries[i % len(queries)]
+        t0 = time.perf_counter()
+        rag.search_enhanced(q, keywords, k=4)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        i += 1
+    results.put(latencies)
+
+def run_setting(workers: int, embed_threads: int, blas_threads: int, data_dir: str,
+                stub: bool, duration: float) -> Dict:
+    """Run `workers` processes with the given threads and report aggregate throughput and latency"""
+    ctx = multiprocessing.get_context("spawn")  # fresh interpreters so BLAS env vars apply
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_bench_worker,
+                         args=(embed_threads, blas_threads, data_dir, stub, duration, barrier, results))
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+    latencies: List[float] = []
+    for _ in procs:
+        latencies.extend(results.get())
+    for p in procs:
+        p.join()
+
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] if ordered else 0.0
+    return {
+        "workers": workers,
+        "embed_threads": embed_threads,
+        "blas_threads": blas_threads,
+        "queries": len(latencies),
+        "throughput_qps": len(latencies) / duration,
+        "p50_ms": statistics.median(latencies) if latencies else 0.0,
+        "p99_ms": p99,
+    }
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+def main(argv=None):
+    default_data = Path(__file__).resolve().parents[1] / "data" / "snippets"
+    parser = argparse.ArgumentParser(description="Report or benchmark ONNX/BLAS thread topology")
+    parser.add_argument("--sweep", action="store_true", help="Benchmark every workers x embed x blas combination")
+    parser.add_argument("--workers", type=_int_list, default=[1, 2])
+    parser.add_argument("--embed-threads", type=_int_list, default=[1, 2])
+    parser.add_argument("--blas-threads", type=_int_list, default=[1])
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of load per setting")
+    parser.add_argument("--data-dir", default=str(default_data))
+    parser.add_argument("--stub", action="store_true", help="Use the stub embedder instead of the ONNX model")
+    args = parser.parse_args(argv)
+
+    if not args.sweep:
+        print(json.dumps(effective_report(configure_from_env()), indent=2))
+        return
+
+    cores = available_cores()
+    print(f"cores={cores} duration={args.duration}s stub={args.stub}")
+    print(f"{'workers':>7} {'embed':>5} {'blas':>4} {'qps':>9} {'p50 ms':>8} {'p99 ms':>8}  note")
+    for workers, embed, blas in itertools.product(args.workers, args.embed_threads, args.blas_threads):
+        row = run_setting(workers, embed, blas, args.data_dir, args.stub, args.duration)
+        note = "oversubscribed" if workers * max(embed, blas) > cores else ""
+        print(f"{row['workers']:>7} {row['embed_threads']:>5} {row['blas_threads']:>4} "
+              f"{row['throughput_qps']:>9.1f} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f}  {note}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Opt-in per-request trace spans for /chat.
+
+A Tracer decides per request whether to trace. It never traces when disabled.
+Otherwise a request is traced when it carries the trace header, or at random
+with probability `sample_rate`. A traced request gets a Trace that records
+nested timing spans from any thread. Untraced requests get NULL_TRACE, whose
+span() returns one shared no-op context, so the hot path only pays a method
+call.
+
+Spans carry the request_id, names and timings only, never message text.
+
+With a profile directory set, Trace.profile() runs cProfile around a block and
+writes <request_id>.prof there. cProfile only sees the thread it was enabled
+on, so wrap the code that runs on that thread.
+"""
+import contextlib, cProfile, json, os, random, threading, time
+from typing import Dict, List, Optional
+
+_NO_OP = contextlib.nullcontext()
+
+class Trace:
+    """Timing spans for one request; span() nests per thread"""
+
+    enabled = True
+
+    def __init__(self, request_id: str, profile_dir: Optional[str] = None):
+        self.request_id = request_id
+        self.profile_dir = profile_dir
+        self._t0 = time.perf_counter()
+        self._spans: List[Dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        stack = self._local.__dict__.setdefault("stack", [])
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            with self._lock:
+                self._spans.append({
+                    "name": name,
+                    "parent": parent,
+                    "start_ms": round((start - self._t0) * 1000, 3),
+                    "duration_ms": round((end - start) * 1000, 3)
+                })
+
+    @contextlib.contextmanager
+    def profile(self):
+        """cProfile the enclosed block on this thread and dump it to profile_dir"""
+        if not self.profile_dir:
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler already holds this interpreter (Python 3.12+)
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, f"{self.request_id}.prof"))
+
+    def report(self, status: str) -> Dict:
+        with self._lock:
+            spans = sorted(self._spans, key=lambda s: s["start_ms"])
+        return {
+            "request_id": self.request_id,
+            "status": status,
+            "total_ms": round((time.perf_counter() - self._t0) * 1000, 3),
+            "spans": spans
+        }
+
+    def emit(self, status: str):
+        print("REQUEST_TRACE", json.dumps(self.report(status)))
+
+class _NullTrace:
+    """Stand-in for untraced requests; every method is a no-op"""
+
+    enabled = False
+
+    def span(self, name: str):
+        return _NO_OP
+
+    def profile(self):
+        return _NO_OP
+
+    def emit(self, status: str):
+        pass
+
+NULL_TRACE = _NullTrace()
+
+class Tracer:
+    """Per-request trace decision: off, forced by header, or sampled"""
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 0.0, header: str = "x-trace",
+                 profile_dir: Optional[str] = None, rng=random.random):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.header = header.lower()
+        self.profile_dir = profile_dir
+        self._rng = rng
+
+    def start(self, request_id: str, headers) -> "Trace | _NullTrace":
+        if not self.enabled:
+            return NULL_TRACE
+        forced = headers.get(self.header, "").strip().lower() in ("1", "true", "yes")
+        if forced or (self.sample_rate > 0 and self._rng() < self.sample_rate):
+            return Trace(request_id, self.profile_dir)
+        return NULL_TRACE